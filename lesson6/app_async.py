@@ -0,0 +1,191 @@
+"""
+asyncio 版本的 MQTT 監控應用程式（ASGI）
+與 app_flask.py 共用設定、儲存層與 HTTP API（/、/api/latest、/api/history 等），差別在於：
+- MQTT 客戶端由事件迴圈驅動，不使用 loop_forever() 背景執行緒
+- 訊息處理管線與 WebSocket 合併推送在事件迴圈中執行（寫入檔案的儲存階段在專用的執行緒中執行）
+- 由 uvicorn 提供服務，WebSocket 使用 python-socketio 的 AsyncServer，
+  每個連線不需要一個執行緒，單一程序即可維持數千個儀表板連線
+
+啟動：uv run python app_async.py
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+import asyncio
+import io
+import sys
+
+import socketio
+import uvicorn
+
+import app_flask as web
+from async_mqtt import AsyncMQTTLoop
+from broadcaster import AsyncCoalescingEmitter
+from ingest_pipeline import AsyncIngestPipeline
+
+# 伺服器設定
+HOST = '0.0.0.0'
+PORT = 8081
+
+# HTTP API 由 Flask 處理（可能讀取分區檔案），在執行緒池中執行，不阻塞事件迴圈
+HTTP_WORKERS = 8
+
+
+def build_environ(scope, body):
+    """把 ASGI 的 HTTP scope 轉換為 WSGI environ"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class WSGIBridge:
+    """
+    把 ASGI 的 HTTP 請求交給 WSGI 應用程式（app_flask.app）處理
+
+    API 的程式碼只有一份；WSGI 應用程式在執行緒池中執行，
+    回應逐區塊在執行緒池中產生並送出（more_body），
+    /api/export 之類的串流回應不會整個收集到記憶體中。
+    """
+
+    def __init__(self, wsgi_app, executor):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+
+        body = bytearray()
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        environ = build_environ(scope, bytes(body))
+        loop = asyncio.get_running_loop()
+        status, headers, iterator, result = await loop.run_in_executor(self.executor, self._start, environ)
+        try:
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            while True:
+                block = await loop.run_in_executor(self.executor, next, iterator, None)
+                if block is None:
+                    break
+                if block:
+                    await send({'type': 'http.response.body', 'body': block, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # 送完或連線中斷時關閉回應（例如刪除匯出用的暫存檔）
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
+
+    def _start(self, environ):
+        """
+        在執行緒池中呼叫 WSGI 應用程式，並取得第一個區塊（WSGI 允許到第一個區塊才呼叫 start_response）
+
+        Returns:
+            tuple: (狀態碼, 標頭, 回應的 iterator, WSGI 回傳的 iterable)
+                iterator 會先產生 write() 寫入的內容與第一個區塊
+        """
+        response = {}
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            return written.append
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            iterator = iter(result)
+            first = next(iterator, None)
+        except BaseException:
+            if hasattr(result, 'close'):
+                result.close()
+            raise
+        head = written + ([first] if first is not None else [])
+        return response['status'], response['headers'], chain(head, iterator), result
+
+
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+mqtt_loop = AsyncMQTTLoop(web.mqtt_client)
+http_executor = ThreadPoolExecutor(max_workers=HTTP_WORKERS, thread_name_prefix='http')
+store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='store')
+
+
+async def startup():
+    """啟動事件迴圈版本的推送器、訊息處理管線與 MQTT 接收（取代 app_flask.start_services()）"""
+    # broadcast_message、forward_records、on_message 與 /api/ingest 都使用 app_flask 的這兩個物件
+    web.emitter = AsyncCoalescingEmitter(sio, event='new_batch', window=web.BROADCAST_WINDOW, meta=web.emitter_meta)
+    web.emitter.start()
+    # 儲存階段會寫入分區檔案與彙總檔案，在專用的執行緒中執行，磁碟變慢時不會卡住 Socket.IO 與 HTTP
+    web.ingest = AsyncIngestPipeline(web.ingest_stages(), maxsize=web.INGEST_QUEUE_SIZE, overflow=web.INGEST_OVERFLOW,
+                                     blocking=('store',), executor=store_executor)
+    web.ingest.start()
+
+    # 分片模式：接收執行緒透過 ingest.put() 把數據交給事件迴圈
+    web.start_sharded()
+    if web.INGEST_MODE != 'sharded':
+        mqtt_loop.start(web.MQTT_BROKER, web.MQTT_PORT, 60)
+
+
+async def shutdown():
+    """依序停止 MQTT、分片工作程序、管線與推送器（歷史數據寫入器由 app_flask 的 atexit 關閉）"""
+    await mqtt_loop.stop()
+    if web.sharded is not None:
+        await asyncio.get_running_loop().run_in_executor(None, web.sharded.stop)
+    await web.ingest.stop()
+    store_executor.shutdown(wait=False)
+    await web.emitter.close()
+    http_executor.shutdown(wait=False)
+
+
+# /socket.io 由 AsyncServer 處理，其餘請求交給 Flask 的路由
+asgi_app = socketio.ASGIApp(
+    sio,
+    other_asgi_app=WSGIBridge(web.app, http_executor),
+    on_startup=startup,
+    on_shutdown=shutdown
+)
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print(" asyncio MQTT 監控應用程式（ASGI）")
+    print("=" * 60)
+    print(f" 啟動中...")
+    print(f" MQTT Broker: {web.MQTT_BROKER}:{web.MQTT_PORT}")
+    print(f" MQTT Topics: {', '.join(web.MQTT_TOPICS)}")
+    print(f" 儲存格式: {web.STORAGE_FORMAT}")
+    print(f" 接收模式: {web.INGEST_MODE}")
+    print(f" 歷史數據容量: {web.HISTORY_CAPACITY} 筆")
+    print("=" * 60)
+
+    # uvicorn 收到 SIGINT / SIGTERM 時會執行 shutdown()，結束後 atexit 寫入剩餘數據
+    uvicorn.run(asgi_app, host=HOST, port=PORT, log_level='warning')
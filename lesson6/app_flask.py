@@ -3,14 +3,34 @@ Flask 版本的 MQTT 監控應用程式
 替代 Streamlit，解決 Raspberry Pi 相容性問題
 """
 
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, request, make_response
 from flask_socketio import SocketIO
 import paho.mqtt.client as mqtt
-from datetime import datetime
-import json
 import threading
-import csv
+import time
+import sys
+import zlib
 import os
+import atexit
+import signal
+from urllib.parse import quote
+
+from history_store import DeviceHistories, HistoryStore, RECORD_FIELDS, LIGHT_LABELS, to_epoch_ms, encode_light, format_timestamp
+from sensor_codec import encode_columns, encode_since
+from downsample import downsample, MODES as DOWNSAMPLE_MODES, VALUE_COLUMNS
+from csv_writer import BufferedCSVWriter
+from csv_tail import tail_rows, save_sidecar
+from columnar_store import ColumnarWriter, ColumnarReader, concat_columns
+from partitioned_store import PartitionedStore, device_id, partition_bounds
+from topic_router import TopicRouter
+from sensor_message import decode_sensor, is_heartbeat
+from device_registry import DeviceRegistry
+from rollup import RollupEngine, RESOLUTIONS as ROLLUP_RESOLUTIONS, merge_buckets, bucket_to_dict
+from migrate_to_columnar import migrate as migrate_to_columnar, iter_batches
+from ingest_pipeline import IngestPipeline
+from sharded_ingest import ShardedIngest, ShardedReader
+from broadcaster import CoalescingEmitter
+from history_export import EXPORT_FORMATS, export_stream, export_filename, check_format, iter_csv_chunks
 
 app = Flask(__name__)
 socketio = SocketIO(app, cors_allowed_origins="*")
@@ -21,8 +41,30 @@ MQTT_PORT = 1883
 MQTT_TOPIC = "living_room/sensor"
 MQTT_TOPIC = "living_room/sensor"
 
-# 全域數據儲存
-sensor_data = []
+# 訂閱的主題（支援 + 與 # 萬用字元）
+# 裝置名稱取自第一個被萬用字元符合的層級，例如：
+#   +/sensor  : living_room/sensor       -> living_room
+#   home/#    : home/kitchen/pico1/data  -> kitchen
+# 訊息可以是 JSON 或二進位格式（開頭的魔術位元組自動辨識），
+# 以 /bin 結尾的主題（+/sensor/bin）一律視為二進位格式
+MQTT_TOPICS = ['+/sensor', '+/sensor/bin', 'home/#']
+
+# 沒有指定裝置時使用的裝置名稱（主題的第一層，例如 living_room/sensor -> living_room）
+DEFAULT_DEVICE = device_id(MQTT_TOPIC.split('/')[0])
+
+# 每個裝置的歷史數據保留筆數（固定容量環形緩衝區）
+HISTORY_CAPACITY = 50000
+# /api/history 預設回傳的筆數
+HISTORY_API_LIMIT = 100
+# /api/history?since= 每次最多回傳的筆數（其餘依 next_cursor 繼續取得）
+HISTORY_SINCE_LIMIT = 1000
+
+# 全域數據儲存：每個裝置各自一個歷史數據緩衝區，history 是 DEFAULT_DEVICE 的緩衝區
+histories = DeviceHistories(HISTORY_CAPACITY)
+history = histories.get(DEFAULT_DEVICE, create=True)
+
+# 本次啟動的識別碼：重新啟動後序號從頭開始，ETag 加上它才不會與重新啟動前的回應相同
+BOOT_ID = f"{time.time_ns():x}"
 latest_data = {
     'light_status': '未知',
     'temperature': 0,
@@ -31,50 +73,273 @@ latest_data = {
 }
 mqtt_connected = False
 
+# 裝置離線判斷：固定週期發送的裝置超過 DEVICE_OFFLINE_AFTER 秒沒有訊息視為離線；
+# deadband 模式的裝置（數值沒有變化時只發送心跳）超過 心跳間隔 × HEARTBEAT_GRACE 秒
+DEVICE_OFFLINE_AFTER = 60
+HEARTBEAT_GRACE = 1.5
+
+# 各裝置的最新數據與狀態（latest_data 則是所有裝置中最新的一筆）
+devices = DeviceRegistry(offline_after=DEVICE_OFFLINE_AFTER, heartbeat_grace=HEARTBEAT_GRACE)
+
+# 歷史數據儲存格式：'partitioned'（依裝置與日期分割的欄位式檔案）、'columnar'（單一欄位式檔案）或 'csv'
+# columnar 與 csv 沒有裝置欄位，只保存 DEFAULT_DEVICE 的歷史數據（其他裝置只更新最新數據與彙總統計）
+STORAGE_FORMAT = 'partitioned'
+
+# 分割儲存設定（檔案位於 DATA_DIR/<裝置>/<日期>.pts）
+DATA_DIR = 'data'
+PARTITION_GRANULARITY = 'day'     # 'day' 或 'hour'
+RETENTION_DAYS = 365              # 保留天數，None 表示永久保留
+PARTITION_GZIP = False            # 是否以 gzip 壓縮已關閉的分區（區塊已用 zlib 壓縮時效果有限）
+
+# 欄位式檔案路徑與設定（舊的 CSV / XLSX 可用 migrate_to_columnar.py 轉換）
+DATA_FILE = 'sensor_data.pts'
+COLUMNAR_CHUNK_ROWS = 4096        # 每個區塊的筆數
+COLUMNAR_COMPRESSION = 'zlib'     # 封存區塊的壓縮方式：None 或 'zlib'
+
 # CSV 檔案路徑
 CSV_FILE = 'sensor_data.csv'
+CSV_FIELDNAMES = ['時間戳記', '電燈狀態', '溫度', '濕度']
+CSV_BATCH_SIZE = 200              # 累積幾筆寫入一次
+
+# 寫入設定（兩種格式共用）
+STORAGE_FLUSH_INTERVAL = 1.0      # 最長幾秒寫入一次
+STORAGE_DURABILITY = 'flush'      # 'none'、'flush' 或 'fsync'
+
+# 彙總統計設定（每分鐘 / 每小時 / 每天，檔案位於 DATA_DIR/<裝置>/rollup_<解析度>.v2.bin）
+ROLLUP_FLUSH_INTERVAL = 5.0       # 最長幾秒寫入一次尚未結束的區間
+STATS_MAX_BUCKETS = 5000          # /api/stats 最多回傳的區間數
+
+# 訊息處理管線設定
+INGEST_QUEUE_SIZE = 10000         # 接收佇列容量
+INGEST_OVERFLOW = 'drop_oldest'   # 'block'、'drop_oldest' 或 'drop_newest'
+
+# 接收模式：'thread'（單一程序的處理管線）或 'sharded'（多個工作程序，須使用 partitioned 儲存）
+INGEST_MODE = 'thread'
+INGEST_WORKERS = os.cpu_count() or 1   # 分片模式的工作程序數量
+INGEST_SHARD_STRATEGY = 'shared'       # 'shared'（MQTT 5 共享訂閱）或 'hash'（依裝置名稱雜湊）
+INGEST_SHARE_GROUP = 'pico-ingest'     # 共享訂閱的群組名稱
+
+# WebSocket 推送合併時間窗（秒），0 表示每筆立即推送
+BROADCAST_WINDOW = 0.25
 
 def load_from_csv():
-    """從 CSV 檔案載入歷史數據"""
-    global sensor_data
+    """從 CSV 檔案載入最近 HISTORY_CAPACITY 筆歷史數據（從檔案尾端往回讀取）"""
+    global latest_data
     if os.path.exists(CSV_FILE):
         try:
-            with open(CSV_FILE, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                loaded_data = []
-                for row in reader:
-                    data_dict = {
-                        'timestamp': row['時間戳記'],
-                        'light_status': row['電燈狀態'],
-                        'temperature': float(row['溫度']),
-                        'humidity': float(row['濕度'])
-                    }
-                    loaded_data.append(data_dict)
-                
-                # 只保留最近 100 筆
-                sensor_data = loaded_data[-100:]
-                
-                # 更新最新數據
-                if sensor_data:
-                    global latest_data
-                    latest_data = sensor_data[-1].copy()
-                
-                print(f"✅ 已載入 {len(sensor_data)} 筆歷史數據")
+            rows = tail_rows(CSV_FILE, HISTORY_CAPACITY)
+            for row in rows:
+                history.append(
+                    to_epoch_ms(row['時間戳記']),
+                    float(row['溫度']),
+                    float(row['濕度']),
+                    row['電燈狀態']
+                )
+            
+            # 更新最新數據
+            if rows:
+                last_row = rows[-1]
+                latest_data = {
+                    'device': DEFAULT_DEVICE,
+                    'timestamp': last_row['時間戳記'],
+                    'light_status': last_row['電燈狀態'],
+                    'temperature': float(last_row['溫度']),
+                    'humidity': float(last_row['濕度'])
+                }
+                devices.update(DEFAULT_DEVICE, latest_data, seen_at=to_epoch_ms(last_row['時間戳記']) / 1000)
+            
+            print(f"✅ 已載入 {len(history)} 筆歷史數據")
         except Exception as e:
             print(f"⚠️  載入 CSV 檔案時發生錯誤: {e}")
 
-def save_to_csv(data):
-    """儲存數據到 CSV 檔案"""
-    file_exists = os.path.exists(CSV_FILE)
-    
-    with open(CSV_FILE, 'a', newline='', encoding='utf-8') as f:
-        fieldnames = ['時間戳記', '電燈狀態', '溫度', '濕度']
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        
-        if not file_exists:
-            writer.writeheader()
-        
-        writer.writerow(data)
+def set_latest_from_columns(columns, device=DEFAULT_DEVICE):
+    """以欄位陣列的最後一筆更新裝置的最新數據（比目前的 latest_data 新時一併更新）"""
+    global latest_data
+    if len(columns['timestamps']):
+        latest = {
+            'device': device,
+            'timestamp': format_timestamp(columns['timestamps'][-1]),
+            'light_status': LIGHT_LABELS.get(columns['light'][-1], '未知'),
+            'temperature': round(columns['temperature'][-1], 2),
+            'humidity': round(columns['humidity'][-1], 2)
+        }
+        devices.update(device, latest, seen_at=columns['timestamps'][-1] / 1000)
+        if latest_data['timestamp'] is None or latest['timestamp'] >= latest_data['timestamp']:
+            latest_data = latest
+
+def load_from_columnar():
+    """從欄位式檔案載入最近 HISTORY_CAPACITY 筆歷史數據（只讀檔案尾端的區塊）"""
+    try:
+        with ColumnarReader(DATA_FILE) as reader:
+            columns = reader.tail(HISTORY_CAPACITY)
+        history.extend_columns(columns)
+        set_latest_from_columns(columns)
+        print(f"✅ 已載入 {len(history)} 筆歷史數據")
+    except Exception as e:
+        print(f"⚠️  載入時間序列檔案時發生錯誤: {e}")
+
+def import_legacy_data(store):
+    """第一次使用分割儲存時，把舊的 sensor_data.pts 或 CSV 匯入 DEFAULT_DEVICE 的分區"""
+    if store.devices():
+        return
+    try:
+        if os.path.exists(DATA_FILE):
+            print(f"📦 第一次啟動：將 {DATA_FILE} 依日期分割到 {DATA_DIR}/...")
+            with ColumnarReader(DATA_FILE) as reader:
+                imported = 0
+                for info in reader.chunks:
+                    columns = reader.read_chunk(info)
+                    store.extend(DEFAULT_DEVICE, columns)
+                    imported += info.rows
+        elif os.path.exists(CSV_FILE):
+            print(f"📦 第一次啟動：將 {CSV_FILE} 依日期分割到 {DATA_DIR}/...")
+            imported = 0
+            for columns, _ in iter_batches(CSV_FILE, COLUMNAR_CHUNK_ROWS):
+                store.extend(DEFAULT_DEVICE, columns)
+                imported += len(columns['timestamps'])
+        else:
+            return
+        store.flush()
+        print(f"✅ 已匯入 {imported} 筆數據")
+    except Exception as e:
+        print(f"⚠️  匯入舊的歷史數據時發生錯誤: {e}")
+
+def load_from_partitions(store):
+    """從分割儲存載入各裝置最近的歷史數據（只讀最新的分區）"""
+    try:
+        for device in store.devices():
+            part = store.tail(device, HISTORY_CAPACITY)
+            set_latest_from_columns(part, device)
+            histories.get(device, create=True).extend_columns(part)
+        print(f"✅ 已載入 {len(devices)} 個裝置、{len(histories)} 筆歷史數據")
+    except Exception as e:
+        print(f"⚠️  載入分區檔案時發生錯誤: {e}")
+
+def load_history():
+    """依 STORAGE_FORMAT 載入歷史數據（第一次使用新格式時自動轉換舊的數據檔案）"""
+    if STORAGE_FORMAT == 'partitioned':
+        if INGEST_MODE != 'sharded':
+            import_legacy_data(data_writer)
+        load_from_partitions(data_writer)
+        return
+    if STORAGE_FORMAT == 'columnar':
+        if not os.path.exists(DATA_FILE) and os.path.exists(CSV_FILE):
+            print(f"📦 第一次啟動：將 {CSV_FILE} 轉換為 {DATA_FILE}...")
+            try:
+                converted, _ = migrate_to_columnar(CSV_FILE, DATA_FILE,
+                                                   chunk_rows=COLUMNAR_CHUNK_ROWS,
+                                                   compression=COLUMNAR_COMPRESSION)
+                print(f"✅ 已轉換 {converted} 筆數據")
+            except Exception as e:
+                print(f"⚠️  轉換 CSV 檔案時發生錯誤: {e}")
+        if os.path.exists(DATA_FILE):
+            load_from_columnar()
+        return
+    load_from_csv()
+
+if INGEST_MODE == 'sharded' and STORAGE_FORMAT != 'partitioned':
+    raise ValueError("INGEST_MODE = 'sharded' 須搭配 STORAGE_FORMAT = 'partitioned'")
+
+# 分割儲存設定（分片模式的工作程序使用相同設定）
+partition_options = {
+    'granularity': PARTITION_GRANULARITY,
+    'retention_days': RETENTION_DAYS,
+    'gzip_closed': PARTITION_GZIP,
+    'chunk_rows': COLUMNAR_CHUNK_ROWS,
+    'compression': COLUMNAR_COMPRESSION,
+    'flush_interval': STORAGE_FLUSH_INTERVAL,
+    'durability': STORAGE_DURABILITY,
+}
+
+# 分割儲存區在寫入第一筆數據前不會建立檔案，可以先建立再載入歷史數據
+if INGEST_MODE == 'sharded':
+    # 由各工作程序寫入自己的分片，網頁程序只跨分片讀取
+    data_writer = ShardedReader(DATA_DIR, INGEST_WORKERS, granularity=PARTITION_GRANULARITY)
+elif STORAGE_FORMAT == 'partitioned':
+    data_writer = PartitionedStore(DATA_DIR, **partition_options)
+
+# 啟動前先載入歷史數據（須在建立單一檔案的寫入器之前，寫入器會建立新的空檔案）
+print("📂 載入歷史數據...")
+load_history()
+
+# 持續持有檔案的批次寫入器（關閉程式時自動寫入剩餘數據）
+if STORAGE_FORMAT == 'columnar':
+    data_writer = ColumnarWriter(
+        DATA_FILE,
+        chunk_rows=COLUMNAR_CHUNK_ROWS,
+        compression=COLUMNAR_COMPRESSION,
+        flush_interval=STORAGE_FLUSH_INTERVAL,
+        durability=STORAGE_DURABILITY
+    )
+elif STORAGE_FORMAT == 'csv':
+    data_writer = BufferedCSVWriter(
+        CSV_FILE,
+        CSV_FIELDNAMES,
+        batch_size=CSV_BATCH_SIZE,
+        flush_interval=STORAGE_FLUSH_INTERVAL,
+        durability=STORAGE_DURABILITY
+    )
+    # 關閉寫入器後記錄最後 N 筆的位置，下次啟動直接讀取
+    atexit.register(save_sidecar, CSV_FILE, HISTORY_CAPACITY)
+atexit.register(data_writer.close)
+
+# 增量彙總：每筆數據進來時更新各解析度目前的區間
+if INGEST_MODE == 'sharded':
+    # 工作程序各自維護彙總，查詢時跨分片合併
+    rollups = data_writer
+else:
+    rollups = RollupEngine(DATA_DIR, flush_interval=ROLLUP_FLUSH_INTERVAL)
+    atexit.register(rollups.close)
+
+def backfill_rollups():
+    """還沒有彙總檔案的裝置：從已保存的數據重建彙總（只在第一次啟動時執行）"""
+    try:
+        if STORAGE_FORMAT == 'partitioned':
+            for device in data_writer.devices():
+                if rollups.has_device(device):
+                    continue
+                print(f"📊 建立 {device} 的彙總統計...")
+                for key, _ in data_writer.partitions(device):
+                    start, end = partition_bounds(key, PARTITION_GRANULARITY)
+                    rollups.extend(device, data_writer.read(device, start, end - 1))
+        elif len(history) and not rollups.has_device(DEFAULT_DEVICE):
+            print(f"📊 建立 {DEFAULT_DEVICE} 的彙總統計...")
+            rollups.extend(DEFAULT_DEVICE, history.columns())
+        rollups.flush()
+    except Exception as e:
+        print(f"⚠️  建立彙總統計時發生錯誤: {e}")
+
+if INGEST_MODE != 'sharded':
+    backfill_rollups()
+
+def keeps_history(device):
+    """裝置是否保存歷史數據（只有分割儲存區分裝置，其他格式只保存 DEFAULT_DEVICE）"""
+    return STORAGE_FORMAT == 'partitioned' or device == DEFAULT_DEVICE
+
+def save_record(record):
+    """儲存一筆數據到歷史數據檔案（放入批次寫入緩衝區）"""
+    if STORAGE_FORMAT == 'partitioned':
+        data_writer.append(
+            record['device'],
+            record['epoch_ms'],
+            record['temperature'],
+            record['humidity'],
+            encode_light(record['light_status'])
+        )
+    elif STORAGE_FORMAT == 'columnar':
+        data_writer.append(
+            record['epoch_ms'],
+            record['temperature'],
+            record['humidity'],
+            encode_light(record['light_status'])
+        )
+    else:
+        data_writer.write({
+            '時間戳記': record['timestamp'],
+            '電燈狀態': record['light_status'],
+            '溫度': record['temperature'],
+            '濕度': record['humidity']
+        })
 
 def on_connect(client, userdata, flags, reason_code, properties):
     """MQTT 連線回調"""
@@ -85,57 +350,123 @@ def on_connect(client, userdata, flags, reason_code, properties):
     else:
         print(f"✅ MQTT 連線成功")
         mqtt_connected = True
-        client.subscribe(MQTT_TOPIC, qos=1)
-        print(f"✅ 已訂閱主題: {MQTT_TOPIC}")
+        topics = router.patterns()
+        client.subscribe([(topic, 1) for topic in topics])
+        print(f"✅ 已訂閱主題: {', '.join(topics)}")
 
-def on_message(client, userdata, message):
-    """MQTT 訊息回調"""
-    global latest_data, sensor_data
+# 主題路由：依主題樹找出處理函式（不需要逐一比對字串）
+router = TopicRouter()
+for topic in MQTT_TOPICS:
+    router.add(topic, decode_sensor)
+
+def decode_message(item):
+    """管線階段 1：依主題路由解析原始 MQTT 訊息（一則批次訊息可能有多筆數據；沒有符合的主題時略過）"""
+    topic, payload, recv_time = item
+    records = router.route(topic, payload, recv_time)
+    if records is None:
+        print(f"⚠️  沒有處理函式的主題: {topic}")
+    return records or None
+
+def store_message(records):
+    """管線階段 2：依序更新最新數據、歷史數據與歷史數據檔案（records 由舊到新）"""
+    global latest_data
     
-    try:
-        payload = message.payload.decode('utf-8')
-        print(f"📨 收到訊息: {payload}")
-        
-        # 解析 JSON
-        data_dict = json.loads(payload)
+    updates = []
+    for record in records:
+        # 心跳：裝置仍在線上但數值沒有變化，只更新裝置狀態
+        if is_heartbeat(record):
+            devices.heartbeat(record['device'], record['heartbeat'], topic=record['topic'],
+                              seen_at=record['epoch_ms'] / 1000)
+            continue
         
-        # 提取數據
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        temperature = data_dict.get('temperature', data_dict.get('temp', 0))
-        humidity = data_dict.get('humidity', data_dict.get('humi', 0))
-        light_status = data_dict.get('light_status', data_dict.get('light', '未知'))
+        # 儲存到裝置的歷史數據（容量滿時自動覆蓋最舊的一筆）
+        # columnar / csv 沒有裝置欄位：其他裝置不保存歷史數據，seq 為 None
+        seq = None
+        if keeps_history(record['device']):
+            seq = histories.get(record['device'], create=True).append(
+                record['epoch_ms'], record['temperature'], record['humidity'], record['light_status'])
         
         # 更新最新數據
         latest_data = {
-            'light_status': light_status,
-            'temperature': temperature,
-            'humidity': humidity,
-            'timestamp': timestamp
-        }
-        
-        # 儲存到列表
-        sensor_data.append(latest_data.copy())
-        
-        # 只保留最近 100 筆
-        if len(sensor_data) > 100:
-            sensor_data.pop(0)
-        
-        # 儲存到 CSV
-        csv_data = {
-            '時間戳記': timestamp,
-            '電燈狀態': light_status,
-            '溫度': temperature,
-            '濕度': humidity
+            'seq': seq,
+            'device': record['device'],
+            'light_status': record['light_status'],
+            'temperature': record['temperature'],
+            'humidity': record['humidity'],
+            'timestamp': record['timestamp']
         }
-        save_to_csv(csv_data)
+        updates.append(latest_data)
         
-        # 透過 WebSocket 推送到前端
-        socketio.emit('new_data', latest_data)
+        devices.update(record['device'], latest_data, topic=record['topic'], seen_at=record['epoch_ms'] / 1000)
         
-    except Exception as e:
-        print(f"處理訊息錯誤: {e}")
+        # 儲存到歷史數據檔案並更新彙總統計（分片模式已由工作程序完成）
+        if INGEST_MODE != 'sharded':
+            if seq is not None:
+                save_record(record)
+            rollups.add(record['device'], record['epoch_ms'], record['temperature'], record['humidity'],
+                        encode_light(record['light_status']))
+    return updates
+
+# 推送器、訊息處理管線與分片工作程序由 start_services() 建立
+# （app_async.py 匯入本模組時改用事件迴圈版本，共用相同的儲存與 API）
+emitter = None
+ingest = None
+sharded = None
+
+def emitter_meta():
+    """附加在每個 new_batch 事件中的狀態"""
+    return {'mqtt_connected': is_mqtt_connected(), 'total_records': len(histories)}
+
+def broadcast_message(updates):
+    """管線階段 3：透過 WebSocket 推送到前端（合併後送出）"""
+    for data in updates:
+        emitter.publish(data)
+
+def ingest_stages():
+    """訊息處理管線的階段（解碼 → 儲存 → 推送；分片模式由工作程序解碼，管線只負責更新即時狀態與推送）"""
+    stages = [
+        ('store', store_message),
+        ('broadcast', broadcast_message),
+    ]
+    if INGEST_MODE != 'sharded':
+        stages.insert(0, ('decode', decode_message))
+    return stages
+
+def forward_records(records):
+    """把工作程序回傳的數據放入管線（整批作為一個項目）"""
+    ingest.put(records)
+
+def start_sharded():
+    """分片模式：啟動工作程序，每個工作程序有自己的 MQTT 連線、解碼與儲存"""
+    global sharded
+    if INGEST_MODE != 'sharded':
+        return
+    sharded = ShardedIngest(
+        INGEST_WORKERS,
+        DATA_DIR,
+        MQTT_BROKER,
+        MQTT_PORT,
+        MQTT_TOPICS,
+        on_records=forward_records,
+        strategy=INGEST_SHARD_STRATEGY,
+        group=INGEST_SHARE_GROUP,
+        storage=partition_options,
+        rollup_flush_interval=ROLLUP_FLUSH_INTERVAL,
+        forward_interval=BROADCAST_WINDOW
+    )
+    sharded.start()
+    # 最先執行：工作程序寫入剩餘數據並回傳後，再清空管線
+    atexit.register(sharded.stop)
+
+def is_mqtt_connected():
+    """MQTT 連線狀態（分片模式為任一工作程序已連線）"""
+    return sharded.connected() if sharded is not None else mqtt_connected
+
+def on_message(client, userdata, message):
+    """MQTT 訊息回調（只放入佇列，不在網路執行緒中處理）"""
+    ingest.submit(message.topic, message.payload, time.time())
 
-# 啟動 MQTT 客戶端
+# MQTT 客戶端（執行緒版本由背景執行緒執行 loop_forever()，app_async.py 由事件迴圈驅動）
 mqtt_client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
 mqtt_client.on_connect = on_connect
 mqtt_client.on_message = on_message
@@ -148,32 +479,262 @@ def start_mqtt():
     except Exception as e:
         print(f"MQTT 錯誤: {e}")
 
-# 啟動前先載入歷史數據
-print("📂 載入歷史數據...")
-load_from_csv()
-
-# 在背景執行緒中啟動 MQTT
-mqtt_thread = threading.Thread(target=start_mqtt, daemon=True)
-mqtt_thread.start()
+def start_services():
+    """啟動執行緒版本的 WebSocket 推送器、訊息處理管線與 MQTT 接收"""
+    global emitter, ingest
+    
+    # WebSocket 合併推送器：時間窗內的更新合併為一個 new_batch 事件
+    emitter = CoalescingEmitter(socketio, event='new_batch', window=BROADCAST_WINDOW, meta=emitter_meta)
+    atexit.register(emitter.close)
+    
+    ingest = IngestPipeline(ingest_stages(), maxsize=INGEST_QUEUE_SIZE, overflow=INGEST_OVERFLOW)
+    ingest.start()
+    # atexit 依註冊的相反順序執行：先清空管線，再送出剩餘推送、關閉歷史數據寫入器
+    atexit.register(ingest.stop)
+    
+    start_sharded()
+    
+    # 在背景執行緒中啟動 MQTT（分片模式由工作程序連線）
+    if INGEST_MODE != 'sharded':
+        mqtt_thread = threading.Thread(target=start_mqtt, daemon=True)
+        mqtt_thread.start()
 
 @app.route('/')
 def index():
     """主頁"""
-    return render_template('index.html')
+    return render_template('index.html', default_device=DEFAULT_DEVICE)
 
 @app.route('/api/latest')
 def get_latest():
     """取得最新數據 API"""
     return jsonify({
         **latest_data,
-        'mqtt_connected': mqtt_connected,
-        'total_records': len(sensor_data)
+        'mqtt_connected': is_mqtt_connected(),
+        'total_records': len(histories)
     })
 
+def json_response(body):
+    """以已序列化的 JSON 字串建立回應（直接由欄位陣列序列化，不經過 jsonify）"""
+    return app.response_class(body, mimetype='application/json')
+
+def parse_fields(value):
+    """解析 fields 查詢參數（以逗號分隔），格式錯誤時回傳 None"""
+    if not value:
+        return RECORD_FIELDS
+    fields = tuple(f.strip() for f in value.split(',') if f.strip())
+    if not fields or any(f not in RECORD_FIELDS for f in fields):
+        return None
+    return fields
+
+def parse_time(value):
+    """解析 start / end 查詢參數（epoch 毫秒或 'YYYY-MM-DD HH:MM:SS'），沒有帶時回傳 None"""
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    return to_epoch_ms(value)
+
+def iter_history(device, start, end):
+    """
+    依 STORAGE_FORMAT 從數據檔案逐區塊讀取時間範圍（不會一次讀進整段時間）
+
+    分割儲存與欄位式檔案以區塊索引二分搜尋；CSV 沒有索引，逐批讀取整個檔案
+    """
+    if STORAGE_FORMAT == 'partitioned':
+        return data_writer.iter_read(device, start_ms=start, end_ms=end)
+    if STORAGE_FORMAT == 'columnar':
+        return data_writer.iter_read(start_ms=start, end_ms=end)
+    # CSV：先寫入緩衝區中的數據，再逐批讀取檔案
+    data_writer.flush()
+    return iter_csv_chunks(CSV_FILE, start_ms=start, end_ms=end)
+
+def history_etag(store):
+    """以啟動識別碼、儲存區的最新序號與查詢參數組成 ETag"""
+    return f"{BOOT_ID}-{store.last_seq}-{zlib.crc32(request.query_string):08x}"
+
 @app.route('/api/history')
 def get_history():
-    """取得歷史數據 API"""
-    return jsonify(sensor_data)
+    """
+    取得歷史數據 API
+    
+    查詢參數:
+        limit: 最多回傳幾筆
+        since: 只回傳序號大於 since 的新數據，回傳 {items, next_cursor, truncated}
+        fields: 以逗號分隔的欄位（seq,timestamp,light_status,temperature,humidity）
+        start / end: 時間範圍（epoch 毫秒或 'YYYY-MM-DD HH:MM:SS'）
+            範圍不完全在記憶體中（start 早於記憶體中最舊的數據，或只帶 end）時，
+            改從數據檔案讀取：以區塊索引二分搜尋，只解碼與範圍重疊的區塊
+        device: 裝置名稱（預設為 DEFAULT_DEVICE；只有分割儲存會區分裝置，其他儲存格式帶此參數時回傳 400）
+        max_points: 降採樣後最多回傳幾點
+        mode: 降採樣方式 lttb（預設）、minmax 或 avg
+        y: lttb / minmax 依據的欄位 temperature（預設）或 humidity
+    
+    數據沒有變化時，帶 If-None-Match 的請求會得到 304 Not Modified
+    """
+    fields = parse_fields(request.args.get('fields'))
+    if fields is None:
+        return jsonify({'error': f'fields 只能是 {",".join(RECORD_FIELDS)}'}), 400
+    since = request.args.get('since', type=int)
+    device = request.args.get('device')
+    if device is not None and STORAGE_FORMAT != 'partitioned':
+        return jsonify({'error': f'STORAGE_FORMAT = {STORAGE_FORMAT!r} 不區分裝置，不支援 device 參數'}), 400
+    device = device_id(device or DEFAULT_DEVICE)
+    # 記憶體中每個裝置各自一個緩衝區；沒有收過數據的裝置視為空的緩衝區
+    store = histories.get(device)
+    if store is None:
+        store = HistoryStore(1)
+    
+    # ETag 由裝置的最新序號與查詢參數組成，數據沒有新增就不需要重新序列化
+    etag = history_etag(store)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+    
+    max_points = request.args.get('max_points', type=int)
+    try:
+        start = parse_time(request.args.get('start'))
+        end = parse_time(request.args.get('end'))
+    except ValueError:
+        return jsonify({'error': 'start / end 格式錯誤'}), 400
+    
+    if max_points is not None or start is not None or end is not None:
+        # 時間範圍查詢，可搭配降採樣（不含 seq）
+        mode = request.args.get('mode', 'lttb')
+        y = request.args.get('y', 'temperature')
+        if mode not in DOWNSAMPLE_MODES or y not in VALUE_COLUMNS:
+            return jsonify({'error': f'mode 只能是 {DOWNSAMPLE_MODES}，y 只能是 {VALUE_COLUMNS}'}), 400
+        if start is None:
+            in_memory = end is None
+        else:
+            oldest = store.oldest_timestamp()
+            in_memory = oldest is not None and start >= oldest
+        if in_memory:
+            columns = store.columns(start_ms=start, end_ms=end)
+        else:
+            columns = concat_columns(iter_history(device, start, end))
+        if max_points is not None:
+            columns = downsample(columns, max(max_points, 0), mode=mode, y=y)
+        response = json_response(encode_columns(columns, fields))
+    elif since is None:
+        limit = request.args.get('limit', default=HISTORY_API_LIMIT, type=int)
+        result = store.records_columns(limit=limit)
+        response = json_response(encode_columns(result['columns'], fields, result['first_seq']))
+    else:
+        limit = request.args.get('limit', default=HISTORY_SINCE_LIMIT, type=int)
+        result = store.since_columns(since, limit=min(limit, HISTORY_SINCE_LIMIT))
+        response = json_response(encode_since(result, fields))
+    response.set_etag(etag)
+    return response
+
+@app.route('/api/export')
+def export_history():
+    """
+    串流匯出歷史數據 API（直接從數據檔案逐區塊讀取，記憶體用量與時間範圍無關）
+    
+    查詢參數:
+        format: csv（預設）、xlsx 或 parquet（需要安裝 pyarrow）
+        start / end: 時間範圍（epoch 毫秒或 'YYYY-MM-DD HH:MM:SS'），不帶表示全部
+        device: 裝置名稱（預設為 DEFAULT_DEVICE；只有分割儲存會區分裝置，其他儲存格式帶此參數時回傳 400）
+    """
+    fmt = request.args.get('format', 'csv')
+    if 'device' in request.args and STORAGE_FORMAT != 'partitioned':
+        return jsonify({'error': f'STORAGE_FORMAT = {STORAGE_FORMAT!r} 不區分裝置，不支援 device 參數'}), 400
+    device = request.args.get('device', DEFAULT_DEVICE)
+    try:
+        check_format(fmt)
+        start = parse_time(request.args.get('start'))
+        end = parse_time(request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if STORAGE_FORMAT == 'partitioned' and device_id(device) not in data_writer.devices():
+        return jsonify({'error': f'找不到裝置: {device}'}), 404
+    
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = export_filename(device_id(device), fmt, start, end)
+    # 裝置名稱可能含中文：filename* 以 RFC 5987 格式編碼，filename 是給舊客戶端的 ASCII 名稱
+    fallback = filename if filename.isascii() else 'export' + extension
+    return app.response_class(
+        export_stream(iter_history(device, start, end), fmt),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"}
+    )
+
+@app.route('/api/devices')
+def get_devices():
+    """
+    取得所有裝置 API（依名稱排序）
+    
+    每個裝置含 status：online（最近收到讀數）、unchanged（只收到心跳，數值沒有變化）或 offline
+    
+    查詢參數:
+        latest: 1 表示包含各裝置的最新數據
+    """
+    include_latest = request.args.get('latest', '0') in ('1', 'true')
+    return jsonify(devices.list(include_latest=include_latest))
+
+@app.route('/api/devices/<device>/latest')
+def get_device_latest(device):
+    """取得單一裝置的最新數據 API"""
+    latest = devices.latest(device_id(device))
+    if latest is None:
+        return jsonify({'error': f'找不到裝置: {device}'}), 404
+    return jsonify(latest)
+
+@app.route('/api/stats')
+def get_stats():
+    """
+    取得彙總統計 API（直接由彙總區間回答，不讀取原始數據）
+    
+    查詢參數:
+        resolution: 區間長度 1m、1h（預設）或 1d
+        start / end: 時間範圍（epoch 毫秒或 'YYYY-MM-DD HH:MM:SS'）
+        device: 裝置名稱（預設為 DEFAULT_DEVICE）
+    
+    回傳:
+        summary: 整段時間的筆數、平均、最小、最大、最後值
+        buckets: 每個區間的統計（超過 STATS_MAX_BUCKETS 時只回傳最新的區間，truncated 為 true）
+    """
+    resolution = request.args.get('resolution', '1h')
+    if resolution not in ROLLUP_RESOLUTIONS:
+        return jsonify({'error': f'resolution 只能是 {",".join(ROLLUP_RESOLUTIONS)}'}), 400
+    device = request.args.get('device', DEFAULT_DEVICE)
+    
+    # 沒有保存歷史數據的裝置（columnar / csv 的其他裝置）沒有序號可用，不使用 ETag
+    store = histories.get(device_id(device))
+    etag = store is not None and history_etag(store)
+    if etag and request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+    
+    try:
+        start = parse_time(request.args.get('start'))
+        end = parse_time(request.args.get('end'))
+    except ValueError:
+        return jsonify({'error': 'start / end 格式錯誤'}), 400
+    
+    buckets = rollups.buckets(device, resolution, start_ms=start, end_ms=end)
+    summary = merge_buckets(buckets)
+    response = jsonify({
+        'device': device_id(device),
+        'resolution': resolution,
+        'summary': bucket_to_dict(summary) if summary is not None else None,
+        'buckets': [bucket_to_dict(b) for b in buckets[-STATS_MAX_BUCKETS:]],
+        'truncated': len(buckets) > STATS_MAX_BUCKETS
+    })
+    if etag:
+        response.set_etag(etag)
+    return response
+
+@app.route('/api/ingest')
+def get_ingest_stats():
+    """取得訊息處理管線統計（接收、丟棄、排隊中筆數；分片模式另含各工作程序的統計）"""
+    stats = ingest.stats()
+    stats['mode'] = INGEST_MODE
+    if sharded is not None:
+        stats['sharded'] = sharded.stats()
+    return jsonify(stats)
 
 if __name__ == '__main__':
     print("=" * 60)
@@ -181,8 +742,15 @@ if __name__ == '__main__':
     print("=" * 60)
     print(f" 啟動中...")
     print(f" MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}")
-    print(f" MQTT Topic: {MQTT_TOPIC}")
-    print(f" CSV 檔案: {CSV_FILE}")
+    print(f" MQTT Topics: {', '.join(MQTT_TOPICS)}")
+    print(f" 儲存格式: {STORAGE_FORMAT}")
+    print(f" 接收模式: {INGEST_MODE}" + (f"（{INGEST_WORKERS} 個工作程序）" if INGEST_MODE == 'sharded' else ""))
+    print(f" 數據檔案: {({'partitioned': DATA_DIR, 'columnar': DATA_FILE}).get(STORAGE_FORMAT, CSV_FILE)}")
+    print(f" 歷史數據容量: {HISTORY_CAPACITY} 筆")
     print("=" * 60)
     
+    # 收到 SIGTERM（例如 systemctl stop）時正常結束，讓 atexit 寫入剩餘數據
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    start_services()
     socketio.run(app, host='0.0.0.0', port=8081, debug=False, allow_unsafe_werkzeug=True)
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""
+以 asyncio 事件迴圈驅動的 paho-mqtt 客戶端
+不使用 loop_forever() 的背景執行緒：socket 可讀 / 可寫時由事件迴圈呼叫
+loop_read() / loop_write()，因此 on_connect、on_message 等回調都在事件迴圈中執行
+"""
+
+import asyncio
+import threading
+
+import paho.mqtt.client as mqtt
+
+# loop_misc()（送出 PING、檢查逾時）的呼叫間隔（秒）
+MISC_INTERVAL = 1.0
+
+
+class AsyncMQTTLoop:
+    """
+    把 paho-mqtt 的 socket 交給事件迴圈監看
+
+    連線（DNS 查詢與 TCP 連線）在執行緒池中進行，避免 broker 沒有回應時卡住事件迴圈；
+    連線中斷後依 reconnect_delay 逐步加倍的間隔重新連線。
+    """
+
+    def __init__(self, client, reconnect_delay=1.0, max_reconnect_delay=60.0):
+        """
+        Args:
+            client: paho.mqtt.client.Client（已設定 on_connect / on_message）
+            reconnect_delay: 第一次重新連線前等待的秒數
+            max_reconnect_delay: 重新連線間隔的上限（秒）
+        """
+        self.client = client
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self._loop = None
+        self._loop_thread = None
+        self._closed = None
+        self._misc = None
+        self._task = None
+        self._stopping = False
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def _call(self, func, *args):
+        """在事件迴圈中執行（connect() 在執行緒池中觸發的 socket 回調改由事件迴圈執行）"""
+        if threading.get_ident() == self._loop_thread:
+            func(*args)
+        else:
+            self._loop.call_soon_threadsafe(func, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call(self._watch, sock)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call(self._unwatch, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call(self._loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self._loop.remove_writer, sock)
+
+    def _watch(self, sock):
+        """開始監看 socket 並定期呼叫 loop_misc()"""
+        self._closed.clear()
+        self._loop.add_reader(sock, self.client.loop_read)
+        self._misc = self._loop.create_task(self._misc_loop())
+
+    def _unwatch(self, sock):
+        """停止監看 socket（連線已關閉）"""
+        self._loop.remove_reader(sock)
+        self._loop.remove_writer(sock)
+        if self._misc is not None:
+            self._misc.cancel()
+            self._misc = None
+        self._closed.set()
+
+    async def _misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(MISC_INTERVAL)
+
+    async def run(self, host, port=1883, keepalive=60):
+        """連線到 broker 並維持連線，直到呼叫 stop()"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._closed = asyncio.Event()
+        self._closed.set()
+
+        delay = self.reconnect_delay
+        while not self._stopping:
+            try:
+                await self._loop.run_in_executor(None, self.client.connect, host, port, keepalive)
+            except OSError as e:
+                print(f"MQTT 錯誤: {e}，{delay:.0f} 秒後重新連線")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+
+            delay = self.reconnect_delay
+            # 等待 _watch() 在事件迴圈中執行後，再等待連線關閉
+            await asyncio.sleep(0)
+            await self._closed.wait()
+            if not self._stopping:
+                print(f"⚠️  MQTT 連線中斷，{delay:.0f} 秒後重新連線")
+                await asyncio.sleep(delay)
+
+    def start(self, host, port=1883, keepalive=60):
+        """在目前的事件迴圈中啟動連線 task"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run(host, port, keepalive))
+
+    async def stop(self, timeout=1.0):
+        """送出 DISCONNECT 並停止重新連線"""
+        self._stopping = True
+        if self._closed is not None and not self._closed.is_set():
+            self.client.disconnect()
+            try:
+                await asyncio.wait_for(self._closed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
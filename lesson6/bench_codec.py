@@ -0,0 +1,104 @@
+"""
+訊息編碼 / 解碼效能測試
+比較：
+- 解碼：json.loads + .get 別名串接（舊做法） vs 各 JSON 後端 + PayloadSchema
+  （PayloadSchema 與 .get 串接的成本相近，差異主要來自 JSON 後端與直接解析 bytes）
+- 回應：HistoryStore.records() + json.dumps（jsonify 的做法） vs encode_columns() 直接序列化
+
+使用方式：
+    uv run python bench_codec.py [--messages 100000] [--rows 5000]
+"""
+
+import argparse
+import importlib
+import json
+import random
+import time
+import timeit
+
+from history_store import HistoryStore
+from sensor_codec import JSON_BACKEND, SENSOR_CODEC, SENSOR_SCHEMA, encode_columns
+
+
+def pico_payloads(count):
+    """產生與 Pico 發送格式相同的訊息（完整欄位名稱與簡短別名各半）"""
+    payloads = []
+    for i in range(count):
+        temperature = round(20 + random.uniform(0, 10), 2)
+        humidity = round(50 + random.uniform(0, 20), 2)
+        light = "開" if i % 2 == 0 else "關"
+        if i % 2:
+            data = {"temp": temperature, "humi": humidity, "light": light}
+        else:
+            data = {"temperature": temperature, "humidity": humidity, "light_status": light}
+        payloads.append(json.dumps(data).encode('utf-8'))
+    return payloads
+
+
+def legacy_decode(payload):
+    """舊做法：先轉成字串，再以 .get 串接別名"""
+    data_dict = json.loads(payload.decode('utf-8'))
+    return {
+        'temperature': data_dict.get('temperature', data_dict.get('temp', 0)),
+        'humidity': data_dict.get('humidity', data_dict.get('humi', 0)),
+        'light_status': data_dict.get('light_status', data_dict.get('light', '未知')),
+    }
+
+
+def available_backends():
+    """已安裝的 JSON 後端：{名稱: loads}"""
+    backends = {'json': lambda payload: json.loads(payload.decode('utf-8'))}
+    for name in ('ujson', 'orjson'):
+        try:
+            backends[name] = importlib.import_module(name).loads
+        except ImportError:
+            pass
+    return backends
+
+
+def bench(label, func, items, repeat):
+    """執行 func(item) 並印出每筆的平均時間"""
+    best = min(timeit.repeat(lambda: [func(item) for item in items], number=1, repeat=repeat))
+    per_item = best / len(items) * 1e6
+    print(f"  {label:<36} {per_item:8.2f} µs/筆   {len(items) / best:12,.0f} 筆/秒")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='訊息編碼 / 解碼效能測試')
+    parser.add_argument('--messages', type=int, default=100000, help='解碼測試的訊息筆數')
+    parser.add_argument('--rows', type=int, default=5000, help='回應測試的歷史數據筆數')
+    parser.add_argument('--repeat', type=int, default=5, help='重複次數（取最快的一次）')
+    args = parser.parse_args()
+
+    print(f"目前使用的 JSON 後端: {JSON_BACKEND}")
+    payloads = pico_payloads(args.messages)
+
+    print(f"\n解碼 {args.messages} 筆 Pico 訊息:")
+    bench('json + .get 串接（舊做法）', legacy_decode, payloads, args.repeat)
+    for name, loads in available_backends().items():
+        bench(f'{name} + PayloadSchema', lambda p, loads=loads: SENSOR_SCHEMA.parse(loads(p)), payloads, args.repeat)
+    bench(f'SENSOR_CODEC.decode（{JSON_BACKEND}）', SENSOR_CODEC.decode, payloads, args.repeat)
+
+    history = HistoryStore(args.rows)
+    start_ms = int(time.time() * 1000)
+    for i in range(args.rows):
+        history.append(start_ms + i * 1000, 20 + random.uniform(0, 10), 50 + random.uniform(0, 20),
+                       '開' if i % 2 else '關')
+
+    print(f"\n序列化 {args.rows} 筆歷史數據（/api/history）:")
+    dict_time = min(timeit.repeat(
+        lambda: json.dumps(history.records(), separators=(',', ':')), number=1, repeat=args.repeat))
+    print(f"  {'records() + json.dumps（jsonify）':<36} {dict_time * 1000:8.2f} ms")
+
+    def direct():
+        result = history.records_columns()
+        return encode_columns(result['columns'], first_seq=result['first_seq'])
+
+    column_time = min(timeit.repeat(direct, number=1, repeat=args.repeat))
+    print(f"  {'records_columns() + encode_columns()':<36} {column_time * 1000:8.2f} ms"
+          f"   （{dict_time / column_time:.1f} 倍）")
+
+
+if __name__ == '__main__':
+    main()
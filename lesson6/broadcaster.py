@@ -0,0 +1,149 @@
+"""
+合併推送的 Socket.IO 廣播器
+把一段時間窗內的所有更新合併成一個事件送出，
+避免每筆 MQTT 訊息都觸發一次廣播
+"""
+
+import asyncio
+import threading
+
+
+class CoalescingEmitter:
+    """
+    依時間窗合併的 Socket.IO 推送器
+
+    publish() 只把數據放進待送列表；第一筆數據進來後等待 window 秒，
+    再把這段期間累積的所有數據以單一事件送出：
+        {'items': [...], 'count': N, **meta()}
+    """
+
+    def __init__(self, socketio, event='new_batch', window=0.25, meta=None):
+        """
+        Args:
+            socketio: Flask-SocketIO 物件
+            event: 推送的事件名稱
+            window: 合併時間窗（秒），0 表示每筆立即推送
+            meta: 選用，回傳 dict 的函式，內容會附加在每個事件中
+        """
+        self.socketio = socketio
+        self.event = event
+        self.window = window
+        self.meta = meta
+
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self.batches_sent = 0
+
+        self._thread = threading.Thread(target=self._run, name="socketio-coalescer", daemon=True)
+        self._thread.start()
+
+    def publish(self, item):
+        """加入一筆要推送的數據"""
+        with self._lock:
+            self._pending.append(item)
+        self._wakeup.set()
+
+    def flush(self):
+        """立即送出目前累積的數據"""
+        with self._lock:
+            items, self._pending = self._pending, []
+        if not items:
+            return
+
+        payload = {'items': items, 'count': len(items)}
+        if self.meta is not None:
+            payload.update(self.meta())
+        self.socketio.emit(self.event, payload)
+        self.batches_sent += 1
+
+    def _run(self):
+        """背景執行緒：等待第一筆數據，時間窗結束後合併送出"""
+        while not self._stop_event.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self.window:
+                self._stop_event.wait(self.window)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"推送數據錯誤: {e}")
+
+    def close(self):
+        """停止背景執行緒並送出剩餘數據"""
+        self._stop_event.set()
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+
+class AsyncCoalescingEmitter:
+    """
+    事件迴圈版本的合併推送器（python-socketio AsyncServer，供 app_async.py 使用）
+
+    行為與 CoalescingEmitter 相同，但以工作 task 取代背景執行緒；
+    publish() 須在事件迴圈中呼叫。
+    """
+
+    def __init__(self, sio, event='new_batch', window=0.25, meta=None):
+        """
+        Args:
+            sio: socketio.AsyncServer 物件
+            event: 推送的事件名稱
+            window: 合併時間窗（秒），0 表示每筆立即推送
+            meta: 選用，回傳 dict 的函式，內容會附加在每個事件中
+        """
+        self.sio = sio
+        self.event = event
+        self.window = window
+        self.meta = meta
+
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task = None
+        self.batches_sent = 0
+
+    def start(self):
+        """在目前的事件迴圈中啟動推送 task"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def publish(self, item):
+        """加入一筆要推送的數據"""
+        self._pending.append(item)
+        self._wakeup.set()
+
+    async def flush(self):
+        """立即送出目前累積的數據"""
+        items, self._pending = self._pending, []
+        if not items:
+            return
+
+        payload = {'items': items, 'count': len(items)}
+        if self.meta is not None:
+            payload.update(self.meta())
+        await self.sio.emit(self.event, payload)
+        self.batches_sent += 1
+
+    async def _run(self):
+        """推送 task：等待第一筆數據，時間窗結束後合併送出"""
+        while not self._closing:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self.window and not self._closing:
+                await asyncio.sleep(self.window)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"推送數據錯誤: {e}")
+
+    async def close(self):
+        """停止推送 task 並送出剩餘數據"""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
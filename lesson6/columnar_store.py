@@ -0,0 +1,767 @@
+"""
+欄位式二進位時間序列檔案
+取代只能不斷附加的 sensor_data.csv
+
+檔案格式（little-endian）：
+    檔頭     FILE_HEADER   magic 'PTSC'、版本
+    區塊 0   CHUNK_HEADER  筆數、資料長度、CRC32、壓縮方式、旗標、
+                           時間 / 溫度 / 濕度的最小值與最大值
+             payload       timestamps int64[n] | temperature float32[n]
+                           | humidity float32[n] | light int8[n]
+    區塊 1   ...
+
+寫滿 chunk_rows 筆的區塊會「封存」（可選擇以 zlib 壓縮），
+最後一個未寫滿的區塊保持未壓縮並在每次 flush 時原地覆寫，
+因此少量數據也不會產生大量的小區塊
+（代價是 flush 寫到一半時當機，最多遺失這個未封存區塊中的數據）。
+讀取時以 mmap 映射檔案，依區塊的時間範圍只讀需要的區塊；
+以 gzip 整檔壓縮的 .pts.gz 檔案也可以直接讀取（解壓縮到記憶體）。
+
+區塊索引 sidecar（<檔名>.idx）：
+    檔頭     INDEX_HEADER  magic 'PTSI'、版本
+    每個已封存區塊一筆 INDEX_ENTRY（位置 + 區塊標頭的內容）
+寫入器每封存一個區塊就附加一筆，開啟檔案時直接讀索引，
+只需掃描索引之後（尚未封存）的區塊標頭，不必讀遍整個檔案；
+索引與檔案不一致（例如檔案被取代）時改為掃描全部區塊並重建索引。
+時間範圍查詢以二分搜尋找出可能重疊的區塊，不逐一檢查所有區塊。
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from functools import partial
+from itertools import accumulate, compress, islice
+import gzip
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+
+from csv_writer import DURABILITY_NONE, DURABILITY_FLUSH, DURABILITY_FSYNC, DURABILITY_LEVELS
+
+MAGIC = b'PTSC'
+VERSION = 1
+CHUNK_MAGIC = b'CHNK'
+
+# magic, 版本, 保留
+FILE_HEADER = struct.Struct('<4sH10x')
+# magic, 筆數, payload 長度, CRC32, 壓縮方式, 旗標, t_min, t_max, temp_min, temp_max, humi_min, humi_max
+CHUNK_HEADER = struct.Struct('<4sIIIBB2xqqffff')
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_CODES = {None: COMPRESSION_NONE, 'none': COMPRESSION_NONE, 'zlib': COMPRESSION_ZLIB}
+
+# 整檔 gzip 壓縮的檔案副檔名
+GZIP_SUFFIX = '.gz'
+
+# 區塊索引 sidecar
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'PTSI'
+# magic, 版本, 保留
+INDEX_HEADER = struct.Struct('<4sH10x')
+# 區塊位置, 筆數, payload 長度, CRC32, 壓縮方式, 旗標, t_min, t_max, temp_min, temp_max, humi_min, humi_max
+INDEX_ENTRY = struct.Struct('<QIIIBB2xqqffff')
+
+# 區塊旗標
+FLAG_SEALED = 0x01
+FLAG_SORTED = 0x02   # 區塊內的時間遞增（沒有此旗標時查詢會逐筆比對，例如含延遲送達的數據或舊版檔案）
+
+# 欄位名稱與 array 型別（順序即 payload 中的排列順序）
+COLUMNS = (
+    ('timestamps', 'q'),
+    ('temperature', 'f'),
+    ('humidity', 'f'),
+    ('light', 'b'),
+)
+
+_SWAP_BYTES = sys.byteorder != 'little'
+
+ChunkInfo = namedtuple('ChunkInfo', [
+    'offset', 'rows', 'payload_len', 'crc', 'compression', 'flags',
+    't_min', 't_max', 'temp_min', 'temp_max', 'humi_min', 'humi_max',
+])
+
+
+class CorruptChunkError(ValueError):
+    """區塊內容與 CRC 不符（通常是寫入到一半的區塊）"""
+
+
+def empty_columns():
+    """建立空的欄位陣列 dict"""
+    return {name: array(typecode) for name, typecode in COLUMNS}
+
+
+def concat_columns(parts):
+    """把多個欄位陣列 dict 依序串接"""
+    result = empty_columns()
+    for part in parts:
+        for name, _ in COLUMNS:
+            result[name].extend(part[name])
+    return result
+
+
+def merge_columns(parts):
+    """
+    合併多個各自依時間遞增的欄位陣列 dict（例如不同裝置或不同分片），結果依時間排序
+
+    Returns:
+        dict: timestamps / temperature / humidity / light 四個 array
+    """
+    parts = [part for part in parts if len(part['timestamps'])]
+    if len(parts) <= 1:
+        return parts[0] if parts else empty_columns()
+
+    # 已排序的片段串接後排序，Timsort 只需要合併各片段
+    return sort_columns(concat_columns(parts))
+
+
+def sort_columns(columns):
+    """依時間排序（穩定排序：相同時間保留原本的順序）"""
+    timestamps = columns['timestamps']
+    order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+    return {name: array(column.typecode, (column[i] for i in order)) for name, column in columns.items()}
+
+
+def slice_columns(columns, start, stop):
+    """取出各欄位 [start:stop] 的範圍"""
+    return {name: column[start:stop] for name, column in columns.items()}
+
+
+def is_sorted(timestamps):
+    """時間是否遞增（允許相同）"""
+    return all(a <= b for a, b in zip(timestamps, islice(timestamps, 1, None)))
+
+
+def range_columns(columns, start_ms=None, end_ms=None, ordered=None):
+    """
+    取出欄位陣列中 start_ms <= 時間 <= end_ms 的數據（結果依時間排序）
+
+    Args:
+        ordered: 時間是否遞增（None 表示自行檢查）；
+            遞增時以二分搜尋切出範圍，含延遲送達的數據時逐筆比對後再排序
+    """
+    timestamps = columns['timestamps']
+    if ordered is None:
+        ordered = is_sorted(timestamps)
+    if not ordered:
+        if start_ms is not None or end_ms is not None:
+            keep = [(start_ms is None or ts >= start_ms) and (end_ms is None or ts <= end_ms) for ts in timestamps]
+            columns = {name: array(column.typecode, compress(column, keep)) for name, column in columns.items()}
+        return sort_columns(columns)
+    if start_ms is None and end_ms is None:
+        return columns
+    lo = 0 if start_ms is None else bisect_left(timestamps, start_ms)
+    hi = len(timestamps) if end_ms is None else bisect_right(timestamps, end_ms)
+    return slice_columns(columns, lo, hi)
+
+
+def overlap_groups(ranges):
+    """
+    把依檔案順序排列的 (t_min, t_max) 分成時間互不重疊的群組
+
+    每個群組的數據都不晚於之後所有群組的數據；延遲送達的數據使區塊時間重疊時，
+    重疊的區塊（連同夾在中間的區塊）歸為同一個群組，合併後排序才能依時間產生
+
+    Returns:
+        list: 每個群組的 (開始, 結束) 索引
+    """
+    suffix_min = list(accumulate((t_min for t_min, _ in reversed(ranges)), min))
+    suffix_min.reverse()
+    groups = []
+    first = 0
+    latest = None
+    for i, (_, t_max) in enumerate(ranges):
+        latest = t_max if latest is None else max(latest, t_max)
+        if i + 1 == len(ranges) or latest <= suffix_min[i + 1]:
+            groups.append((first, i + 1))
+            first = i + 1
+    return groups
+
+
+def iter_parts(parts, start_ms=None, end_ms=None):
+    """
+    依時間順序產生多個區塊在時間範圍內的數據
+
+    Args:
+        parts: 依檔案順序排列的 (t_min, t_max, 是否遞增, 讀取函式)，讀取函式回傳欄位陣列
+
+    Yields:
+        dict: 一個區塊（或一組時間重疊的區塊合併排序後）在時間範圍內的數據，
+            前後產生的數據依時間遞增（不會產生空的區塊）
+    """
+    # 以截到查詢範圍內的時間分組：範圍外的重疊不影響順序
+    ranges = [(t_min if start_ms is None else max(t_min, start_ms),
+               t_max if end_ms is None else min(t_max, end_ms)) for t_min, t_max, _, _ in parts]
+    for first, last in overlap_groups(ranges):
+        if last - first == 1:
+            t_min, t_max, ordered, load = parts[first]
+            columns = load()
+            if not ordered or (start_ms is not None and t_min < start_ms) or (end_ms is not None and t_max > end_ms):
+                # 區塊跨越範圍的邊界或含延遲送達的數據：時間遞增時二分搜尋，否則逐筆比對後排序
+                columns = range_columns(columns, start_ms, end_ms, ordered=ordered)
+        else:
+            columns = sort_columns(concat_columns(
+                range_columns(load(), start_ms, end_ms, ordered=ordered) for _, _, ordered, load in parts[first:last]))
+        if len(columns['timestamps']):
+            yield columns
+
+
+def encode_payload(columns):
+    """將欄位陣列編碼為 payload bytes"""
+    parts = []
+    for name, _ in COLUMNS:
+        column = columns[name]
+        if _SWAP_BYTES:
+            column = array(column.typecode, column)
+            column.byteswap()
+        parts.append(column.tobytes())
+    return b''.join(parts)
+
+
+def decode_payload(payload, rows):
+    """將 payload bytes 解碼為欄位陣列"""
+    columns = {}
+    offset = 0
+    for name, typecode in COLUMNS:
+        column = array(typecode)
+        size = column.itemsize * rows
+        column.frombytes(payload[offset:offset + size])
+        if _SWAP_BYTES:
+            column.byteswap()
+        columns[name] = column
+        offset += size
+    return columns
+
+
+def _column_range(column, default=0.0):
+    """回傳 (最小值, 最大值)，空陣列時回傳預設值"""
+    if len(column) == 0:
+        return default, default
+    return min(column), max(column)
+
+
+def build_chunk(columns, compression=COMPRESSION_NONE, sealed=True):
+    """
+    把欄位陣列打包成一個完整的區塊（區塊標頭 + payload）
+
+    Returns:
+        bytes: 可直接寫入檔案的區塊
+    """
+    rows = len(columns['timestamps'])
+    payload = encode_payload(columns)
+    if compression == COMPRESSION_ZLIB:
+        payload = zlib.compress(payload, 6)
+
+    t_min, t_max = _column_range(columns['timestamps'], 0)
+    temp_min, temp_max = _column_range(columns['temperature'])
+    humi_min, humi_max = _column_range(columns['humidity'])
+    flags = (FLAG_SEALED if sealed else 0) | (FLAG_SORTED if is_sorted(columns['timestamps']) else 0)
+    header = CHUNK_HEADER.pack(
+        CHUNK_MAGIC, rows, len(payload), zlib.crc32(payload), compression, flags,
+        t_min, t_max, temp_min, temp_max, humi_min, humi_max
+    )
+    return header + payload
+
+
+def scan_chunks(buf, size, verify_last=True, offset=FILE_HEADER.size):
+    """
+    掃描檔案中的區塊標頭（只讀標頭，不讀 payload）
+
+    Args:
+        buf: 支援切片的檔案內容（mmap 或 bytes）
+        size: 檔案大小
+        verify_last: 是否檢查最後一個區塊的 CRC（寫入到一半的區塊會被忽略）
+        offset: 從哪個位置開始掃描（必須是區塊的開頭）
+
+    Returns:
+        tuple: (ChunkInfo 列表, 有效資料的結尾位置)
+    """
+    chunks = []
+    while offset + CHUNK_HEADER.size <= size:
+        fields = CHUNK_HEADER.unpack_from(buf, offset)
+        if fields[0] != CHUNK_MAGIC:
+            break
+        info = ChunkInfo(offset, *fields[1:])
+        end = offset + CHUNK_HEADER.size + info.payload_len
+        if end > size:
+            break
+        chunks.append(info)
+        offset = end
+
+    if verify_last and chunks:
+        last = chunks[-1]
+        start = last.offset + CHUNK_HEADER.size
+        if zlib.crc32(buf[start:start + last.payload_len]) != last.crc:
+            chunks.pop()
+            offset = last.offset
+    return chunks, offset
+
+
+def chunk_end(info):
+    """區塊結尾（下一個區塊開頭）的位置"""
+    return info.offset + CHUNK_HEADER.size + info.payload_len
+
+
+def index_path(path):
+    """取得區塊索引 sidecar 的路徑"""
+    return path + INDEX_SUFFIX
+
+
+def write_index(path, chunks):
+    """以已封存的區塊重建索引（先寫入暫存檔再取代）"""
+    tmp_path = index_path(path) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, VERSION))
+        for info in chunks:
+            f.write(INDEX_ENTRY.pack(*info))
+    os.replace(tmp_path, index_path(path))
+
+
+def append_index(path, info):
+    """在索引最後附加一個剛封存的區塊"""
+    with open(index_path(path), 'ab') as f:
+        if f.tell() == 0:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, VERSION))
+        f.write(INDEX_ENTRY.pack(*info))
+
+
+def load_index(path, buf, size):
+    """
+    讀取索引中與檔案內容一致的區塊
+
+    只保留從檔頭開始連續、結尾不超過 size 的區塊；
+    已封存的區塊不會再被改寫，因此只檢查最後一個區塊的標頭（含 CRC）是否與檔案相符
+
+    Returns:
+        list: ChunkInfo 列表（索引不存在或不一致時為空）
+    """
+    try:
+        with open(index_path(path), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return []
+    if len(data) < INDEX_HEADER.size or INDEX_HEADER.unpack_from(data, 0) != (INDEX_MAGIC, VERSION):
+        return []
+
+    # 忽略寫入到一半的最後一筆
+    usable = INDEX_HEADER.size + (len(data) - INDEX_HEADER.size) // INDEX_ENTRY.size * INDEX_ENTRY.size
+    chunks = []
+    offset = FILE_HEADER.size
+    for fields in INDEX_ENTRY.iter_unpack(data[INDEX_HEADER.size:usable]):
+        info = ChunkInfo(*fields)
+        if info.offset != offset or chunk_end(info) > size:
+            break
+        chunks.append(info)
+        offset = chunk_end(info)
+
+    if chunks:
+        last = chunks[-1]
+        # 不比較溫濕度範圍（可能是 NaN）
+        if CHUNK_HEADER.unpack_from(buf, last.offset)[:8] != (CHUNK_MAGIC,) + tuple(last[1:8]):
+            return []
+    return chunks
+
+
+def load_chunks(path, buf, size, use_index=True):
+    """
+    取得檔案中的區塊：先讀索引，只掃描索引之後的區塊標頭
+
+    Returns:
+        tuple: (ChunkInfo 列表, 有效資料的結尾位置, 來自索引的區塊數)
+    """
+    indexed = load_index(path, buf, size) if use_index else []
+    start = chunk_end(indexed[-1]) if indexed else FILE_HEADER.size
+    rest, end = scan_chunks(buf, size, offset=start)
+    return indexed + rest, end, len(indexed)
+
+
+def read_chunk_from(buf, info):
+    """從檔案內容讀出一個區塊的欄位陣列（會檢查 CRC）"""
+    start = info.offset + CHUNK_HEADER.size
+    payload = buf[start:start + info.payload_len]
+    if zlib.crc32(payload) != info.crc:
+        raise CorruptChunkError(f"區塊 CRC 錯誤 (offset={info.offset})")
+    if info.compression == COMPRESSION_ZLIB:
+        payload = zlib.decompress(payload)
+    return decode_payload(payload, info.rows)
+
+
+class ColumnarWriter:
+    """
+    欄位式時間序列檔案的寫入器（執行緒安全）
+
+    append() 把數據放進目前的區塊，寫滿 chunk_rows 筆時封存並寫入檔案；
+    flush() 則把未寫滿的區塊原地覆寫到檔案尾端。
+    """
+
+    def __init__(self, path, chunk_rows=4096, compression='zlib', flush_interval=1.0,
+                 durability=DURABILITY_FLUSH):
+        """
+        Args:
+            path: 檔案路徑（不存在時自動建立）
+            chunk_rows: 每個區塊的筆數
+            compression: 封存區塊的壓縮方式 None 或 'zlib'
+            flush_interval: 最長多少秒寫入一次（0 或 None 表示不定時寫入）
+            durability: 'none'、'flush' 或 'fsync'
+        """
+        if compression not in COMPRESSION_CODES:
+            raise ValueError(f"compression 必須是 {tuple(COMPRESSION_CODES)} 其中之一")
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"durability 必須是 {DURABILITY_LEVELS} 其中之一")
+
+        self.path = path
+        self.chunk_rows = max(1, int(chunk_rows))
+        self.compression = COMPRESSION_CODES[compression]
+        self.flush_interval = flush_interval
+        self.durability = durability
+
+        self._lock = threading.Lock()
+        self._buffer = empty_columns()
+        self._dirty = False
+        self._closed = False
+        self.rows_written = 0
+
+        self._file = self._open_file()
+
+        self._stop_event = threading.Event()
+        self._flush_thread = None
+        if flush_interval:
+            self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flush_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _open_file(self):
+        """開啟檔案，接續最後一個未封存的區塊，並截掉寫入到一半的殘留資料"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            f = open(self.path, 'w+b')
+            f.write(FILE_HEADER.pack(MAGIC, VERSION))
+            f.flush()
+            write_index(self.path, [])
+            self._tail_offset = FILE_HEADER.size
+            return f
+
+        f = open(self.path, 'r+b')
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version = FILE_HEADER.unpack_from(data, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} 不是欄位式時間序列檔案")
+            if version > VERSION:
+                raise ValueError(f"不支援的檔案版本: {version}")
+
+            size = len(data)
+            chunks, valid_end, indexed = load_chunks(self.path, data, size)
+            self._tail_offset = valid_end
+            if chunks and not chunks[-1].flags & FLAG_SEALED:
+                # 接續未寫滿的區塊
+                last = chunks.pop()
+                self._buffer = read_chunk_from(data, last)
+                self._tail_offset = last.offset
+            if indexed != len(chunks):
+                # 索引不存在、不一致，或缺少最後封存的區塊（例如附加索引前當機）
+                write_index(self.path, chunks)
+        except Exception:
+            data.close()
+            f.close()
+            raise
+        data.close()
+
+        if valid_end < size:
+            f.truncate(valid_end)
+        return f
+
+    def append(self, timestamp_ms, temperature, humidity, light):
+        """
+        新增一筆數據
+
+        Args:
+            timestamp_ms: epoch 毫秒
+            temperature: 溫度
+            humidity: 濕度
+            light: 電燈狀態代碼（history_store.LIGHT_*）
+        """
+        with self._lock:
+            if self._closed:
+                raise ValueError("寫入器已關閉")
+            buf = self._buffer
+            buf['timestamps'].append(int(timestamp_ms))
+            buf['temperature'].append(float(temperature))
+            buf['humidity'].append(float(humidity))
+            buf['light'].append(int(light))
+            self._dirty = True
+            self.rows_written += 1
+
+            if len(buf['timestamps']) >= self.chunk_rows:
+                self._write_tail(sealed=True)
+
+    def extend(self, columns):
+        """一次新增多筆數據（欄位陣列 dict）"""
+        with self._lock:
+            if self._closed:
+                raise ValueError("寫入器已關閉")
+            total = len(columns['timestamps'])
+            start = 0
+            while start < total:
+                room = self.chunk_rows - len(self._buffer['timestamps'])
+                stop = min(total, start + room)
+                for name, _ in COLUMNS:
+                    self._buffer[name].extend(columns[name][start:stop])
+                self._dirty = True
+                self.rows_written += stop - start
+                start = stop
+                if len(self._buffer['timestamps']) >= self.chunk_rows:
+                    self._write_tail(sealed=True)
+
+    def _write_tail(self, sealed):
+        """把目前的區塊寫到檔案尾端（呼叫前須持有鎖）"""
+        compression = self.compression if sealed else COMPRESSION_NONE
+        chunk = build_chunk(self._buffer, compression=compression, sealed=sealed)
+
+        self._file.seek(self._tail_offset)
+        self._file.write(chunk)
+        self._file.truncate()
+        if self.durability != DURABILITY_NONE:
+            self._file.flush()
+        if self.durability == DURABILITY_FSYNC:
+            os.fsync(self._file.fileno())
+
+        if sealed:
+            append_index(self.path, ChunkInfo(self._tail_offset, *CHUNK_HEADER.unpack_from(chunk)[1:]))
+            self._tail_offset += len(chunk)
+            self._buffer = empty_columns()
+        self._dirty = False
+
+    def snapshot(self):
+        """
+        取得目前的寫入狀態（供讀取仍在寫入中的檔案使用）
+
+        Returns:
+            tuple: (已封存區塊的結尾位置, 未封存區塊中數據的副本)
+                檔案中此位置之前的區塊不會再被改寫
+        """
+        with self._lock:
+            pending = {name: array(column.typecode, column) for name, column in self._buffer.items()}
+            return self._tail_offset, pending
+
+    def iter_read(self, start_ms=None, end_ms=None, use_mmap=True):
+        """
+        逐區塊讀出目前已寫入的數據（含未封存區塊），見 ColumnarReader.iter_read()
+
+        以呼叫時的 snapshot() 為準，之後新增的數據不會出現在結果中
+        """
+        sealed_end, pending = self.snapshot()
+        with ColumnarReader(self.path, limit=sealed_end, use_mmap=use_mmap) as reader:
+            parts = reader.parts(start_ms, end_ms)
+            timestamps = pending['timestamps']
+            if len(timestamps):
+                # 未封存的數據視為檔案最後一個區塊（可能與已封存的區塊時間重疊）
+                parts.append((min(timestamps), max(timestamps), is_sorted(timestamps), lambda: pending))
+            yield from iter_parts(parts, start_ms, end_ms)
+
+    def flush(self):
+        """把未寫滿的區塊寫入檔案"""
+        with self._lock:
+            if self._dirty and self._file is not None:
+                self._write_tail(sealed=False)
+
+    def _flush_loop(self):
+        """背景執行緒：定時寫入未寫滿的區塊"""
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  寫入時間序列檔案時發生錯誤: {e}")
+
+    def close(self):
+        """停止背景執行緒、寫入剩餘數據並關閉檔案"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        self._stop_event.set()
+        if self._flush_thread is not None and self._flush_thread is not threading.current_thread():
+            self._flush_thread.join()
+
+        with self._lock:
+            if self._dirty:
+                self._write_tail(sealed=False)
+            self._file.flush()
+            self._file.close()
+            self._file = None
+
+
+class ColumnarReader:
+    """
+    欄位式時間序列檔案的讀取器
+
+    以 mmap 映射整個檔案，開啟時讀取區塊索引（只掃描索引之後的區塊標頭），
+    查詢時以二分搜尋找出與時間範圍重疊的區塊，只解碼這些區塊。
+    """
+
+    def __init__(self, path, limit=None, use_mmap=True):
+        """
+        Args:
+            path: 檔案路徑（.gz 結尾時以 gzip 解壓縮）
+            limit: 只讀取檔案前 limit 個位元組，
+                用於讀取仍在寫入中的檔案（見 ColumnarWriter.snapshot）
+            use_mmap: 是否以 mmap 映射檔案；檔案可能同時被其他程序改寫時
+                設為 False，改為把檔案內容讀進記憶體
+        """
+        self.path = path
+        self.limit = limit
+        self.use_mmap = use_mmap
+        self._gzip = path.endswith(GZIP_SUFFIX)
+        self._file = None if self._gzip else open(path, 'rb')
+        self._mmap = None
+        self.chunks = []
+        self._max_t_max = array('q')   # 前 i 個區塊 t_max 的最大值（遞增）
+        self._min_t_min = array('q')   # 第 i 個之後區塊 t_min 的最小值（遞增）
+        self.refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return sum(info.rows for info in self.chunks)
+
+    def refresh(self):
+        """重新映射檔案並掃描區塊（檔案被附加新數據後呼叫）"""
+        self._release()
+
+        if self._gzip:
+            with gzip.open(self.path, 'rb') as f:
+                data = f.read()
+            size = len(data)
+        else:
+            size = os.fstat(self._file.fileno()).st_size
+        if self.limit is not None:
+            size = min(size, self.limit)
+        if size < FILE_HEADER.size:
+            self._set_chunks([])
+            return
+
+        if self._gzip:
+            self._mmap = data[:size]
+        elif not self.use_mmap:
+            self._file.seek(0)
+            self._mmap = self._file.read(size)
+        else:
+            # 只映射前 size 個位元組，寫入器改寫檔案尾端時不會影響已映射的範圍
+            self._mmap = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+        magic, version = FILE_HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} 不是欄位式時間序列檔案")
+        if version > VERSION:
+            raise ValueError(f"不支援的檔案版本: {version}")
+        # gzip 檔案已整個解壓縮到記憶體，直接掃描即可
+        chunks, _, _ = load_chunks(self.path, self._mmap, size, use_index=not self._gzip)
+        self._set_chunks(chunks)
+
+    def _set_chunks(self, chunks):
+        """
+        設定區塊列表並建立二分搜尋用的陣列
+
+        數據依時間寫入時各區塊不重疊，兩個陣列即為各區塊的 t_max / t_min；
+        延遲送達的數據使區塊時間重疊時，累計最大 / 最小值仍然遞增，找出的區塊範圍依然正確
+        （區塊內的數據是否遞增見 FLAG_SORTED，由 iter_read() 處理）
+        """
+        self.chunks = chunks
+        self._max_t_max = array('q', accumulate((info.t_max for info in chunks), max))
+        self._min_t_min = array('q', accumulate((info.t_min for info in reversed(chunks)), min))
+        self._min_t_min.reverse()
+
+    def chunk_range(self, start_ms=None, end_ms=None):
+        """
+        以二分搜尋找出可能與時間範圍重疊的區塊
+
+        Returns:
+            tuple: (開始, 結束) 區塊索引，範圍外的區塊必定不重疊
+        """
+        lo = 0 if start_ms is None else bisect_left(self._max_t_max, start_ms)
+        hi = len(self.chunks) if end_ms is None else bisect_right(self._min_t_min, end_ms)
+        return lo, max(lo, hi)
+
+    def read_chunk(self, info):
+        """讀出一個區塊的欄位陣列"""
+        return read_chunk_from(self._mmap, info)
+
+    def read(self, start_ms=None, end_ms=None):
+        """
+        讀出時間範圍內的數據
+
+        Args:
+            start_ms: 只保留時間 >= start_ms 的數據（None 表示不限制）
+            end_ms: 只保留時間 <= end_ms 的數據（None 表示不限制）
+
+        Returns:
+            dict: timestamps / temperature / humidity / light 四個 array
+        """
+        return concat_columns(self.iter_read(start_ms, end_ms))
+
+    def iter_read(self, start_ms=None, end_ms=None):
+        """
+        與 read() 相同，但逐區塊產生欄位陣列（一次只解碼一個區塊，供串流匯出使用）
+
+        延遲送達的數據使區塊時間重疊時，重疊的區塊合併排序後一起產生（見 iter_parts）
+
+        Yields:
+            dict: 一個區塊在時間範圍內的數據，依時間遞增（不會產生空的區塊）
+        """
+        return iter_parts(self.parts(start_ms, end_ms), start_ms, end_ms)
+
+    def parts(self, start_ms=None, end_ms=None):
+        """
+        與時間範圍重疊的區塊（iter_parts() 的輸入）
+
+        Returns:
+            list: (t_min, t_max, 是否遞增, 讀取函式)，依檔案順序
+        """
+        lo, hi = self.chunk_range(start_ms, end_ms)
+        return [
+            (info.t_min, info.t_max, bool(info.flags & FLAG_SORTED), partial(self.read_chunk, info))
+            for info in self.chunks[lo:hi]
+            if (start_ms is None or info.t_max >= start_ms) and (end_ms is None or info.t_min <= end_ms)
+        ]
+
+    def tail(self, n):
+        """
+        讀出最後 n 筆數據（只讀檔案尾端需要的區塊）
+
+        Returns:
+            dict: timestamps / temperature / humidity / light 四個 array
+        """
+        parts = []
+        remaining = n
+        for info in reversed(self.chunks):
+            if remaining <= 0:
+                break
+            columns = self.read_chunk(info)
+            if info.rows > remaining:
+                columns = slice_columns(columns, info.rows - remaining, info.rows)
+            parts.append(columns)
+            remaining -= info.rows
+        parts.reverse()
+        return concat_columns(parts)
+
+    def _release(self):
+        """釋放目前的檔案映射"""
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._mmap = None
+
+    def close(self):
+        self._release()
+        if self._file is not None:
+            self._file.close()
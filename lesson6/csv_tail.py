@@ -0,0 +1,159 @@
+"""
+CSV 檔案尾端讀取
+從檔案結尾往回分塊讀取，只解析最後 N 筆完整的資料列，
+啟動時不需要解析整個 CSV 檔案
+
+另外在 CSV 旁邊保存一個 sidecar 檔案（<檔名>.idx，JSON 格式），
+記錄標題列以及關閉時最後 N 筆資料的起始位置；
+檔案沒有被修改過時，重新啟動可以直接從該位置讀取
+
+注意：假設資料欄位中不含換行字元（本專案的感測器數據皆如此）
+"""
+
+import csv
+import json
+import os
+
+SIDECAR_SUFFIX = '.idx'
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+
+def sidecar_path(path):
+    """取得 sidecar 檔案路徑"""
+    return path + SIDECAR_SUFFIX
+
+
+def _read_header(f, encoding):
+    """
+    讀取標題列
+
+    Returns:
+        tuple: (欄位名稱列表, 標題列結尾的位置)
+    """
+    f.seek(0)
+    line = f.readline()
+    if not line.endswith(b'\n'):
+        return None, len(line)
+    fieldnames = next(csv.reader([line.decode(encoding).lstrip('\ufeff')]))
+    return fieldnames, len(line)
+
+
+def find_tail_offset(f, file_size, n, header_end, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    從 EOF 往回分塊讀取，找出最後 n 筆完整資料列的位置
+
+    最後一個換行字元之後的殘缺資料列（例如寫到一半時當機）會被忽略
+
+    Returns:
+        tuple: (起始位置, 結尾位置)
+    """
+    end = None
+    found = 0
+    pos = file_size
+    while pos > header_end:
+        read_size = min(block_size, pos - header_end)
+        pos -= read_size
+        f.seek(pos)
+        block = f.read(read_size)
+
+        idx = len(block)
+        while True:
+            idx = block.rfind(b'\n', 0, idx)
+            if idx < 0:
+                break
+            if end is None:
+                end = pos + idx + 1
+                continue
+            found += 1
+            if found == n:
+                return pos + idx + 1, end
+
+    if end is None:
+        return header_end, header_end
+    return header_end, end
+
+
+def _parse_rows(data, fieldnames, encoding):
+    """解析一段 CSV 資料列"""
+    lines = data.decode(encoding).splitlines()
+    return [dict(zip(fieldnames, values)) for values in csv.reader(lines) if values]
+
+
+def _load_sidecar(path, file_size, mtime_ns):
+    """讀取 sidecar，檔案已被修改或 sidecar 不存在時回傳 None"""
+    try:
+        with open(sidecar_path(path), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('size') != file_size or meta.get('mtime_ns') != mtime_ns:
+        return None
+    return meta
+
+
+def tail_rows(path, n, block_size=DEFAULT_BLOCK_SIZE, encoding='utf-8'):
+    """
+    讀取 CSV 檔案最後 n 筆資料列
+
+    Args:
+        path: CSV 檔案路徑
+        n: 要讀取的筆數
+        block_size: 每次往回讀取的位元組數
+        encoding: 檔案編碼
+
+    Returns:
+        list: 每筆資料為 dict（鍵為標題列欄位，值為字串），由舊到新
+    """
+    if n <= 0 or not os.path.exists(path):
+        return []
+
+    stat = os.stat(path)
+    meta = _load_sidecar(path, stat.st_size, stat.st_mtime_ns)
+
+    with open(path, 'rb') as f:
+        if meta is not None and meta.get('rows', 0) >= n:
+            # 檔案沒有變動：直接從上次記錄的位置讀取
+            fieldnames = meta['header']
+            start, end = meta['tail_offset'], meta['end']
+        else:
+            fieldnames, header_end = _read_header(f, encoding)
+            if fieldnames is None:
+                return []
+            start, end = find_tail_offset(f, stat.st_size, n, header_end, block_size)
+
+        f.seek(start)
+        rows = _parse_rows(f.read(end - start), fieldnames, encoding)
+
+    return rows[-n:]
+
+
+def save_sidecar(path, n, block_size=DEFAULT_BLOCK_SIZE, encoding='utf-8'):
+    """
+    記錄標題列與最後 n 筆資料的位置（在 CSV 檔案關閉後呼叫）
+
+    Args:
+        path: CSV 檔案路徑
+        n: 下次啟動要讀取的筆數
+    """
+    if not os.path.exists(path):
+        return
+
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        fieldnames, header_end = _read_header(f, encoding)
+        if fieldnames is None:
+            return
+        start, end = find_tail_offset(f, stat.st_size, n, header_end, block_size)
+
+    meta = {
+        'header': fieldnames,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'tail_offset': start,
+        'end': end,
+        'rows': n,
+    }
+    tmp_path = sidecar_path(path) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, sidecar_path(path))
@@ -0,0 +1,136 @@
+"""
+批次緩衝的 CSV 寫入器
+持續持有檔案並依筆數或時間間隔批次寫入，
+取代每筆訊息都開檔、寫入、關檔的作法
+"""
+
+import csv
+import os
+import threading
+
+# 寫入後的持久化等級
+DURABILITY_NONE = 'none'    # 交給 Python / 作業系統緩衝
+DURABILITY_FLUSH = 'flush'  # 每批寫入後 flush 到作業系統
+DURABILITY_FSYNC = 'fsync'  # 每批寫入後 fsync 到磁碟
+DURABILITY_LEVELS = (DURABILITY_NONE, DURABILITY_FLUSH, DURABILITY_FSYNC)
+
+
+class BufferedCSVWriter:
+    """
+    執行緒安全的批次 CSV 寫入器
+
+    write() 只把數據放進記憶體緩衝區，累積到 batch_size 筆
+    或超過 flush_interval 秒時才真正寫入檔案。
+    可以直接在 MQTT 回調執行緒中呼叫，關閉前務必呼叫 close()。
+    """
+
+    def __init__(self, path, fieldnames, batch_size=100, flush_interval=1.0,
+                 durability=DURABILITY_FLUSH, encoding='utf-8'):
+        """
+        Args:
+            path: CSV 檔案路徑
+            fieldnames: 欄位名稱列表
+            batch_size: 累積多少筆時立即寫入
+            flush_interval: 最長多少秒寫入一次（0 或 None 表示不定時寫入）
+            durability: 'none'、'flush' 或 'fsync'
+            encoding: 檔案編碼
+        """
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"durability 必須是 {DURABILITY_LEVELS} 其中之一")
+
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.encoding = encoding
+
+        self._buffer = []
+        self._buffer_lock = threading.Lock()   # 保護緩衝區
+        self._io_lock = threading.Lock()       # 保護檔案寫入
+        self._file = None
+        self._writer = None
+        self._closed = False
+
+        self.rows_written = 0
+
+        self._stop_event = threading.Event()
+        self._flush_thread = None
+        if flush_interval:
+            self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flush_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _open(self):
+        """開啟檔案（若為新檔案則寫入標題列，呼叫前須持有 _io_lock）"""
+        need_header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, 'a', newline='', encoding=self.encoding)
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames)
+        if need_header:
+            self._writer.writeheader()
+
+    def write(self, row):
+        """
+        加入一筆數據到緩衝區
+
+        Args:
+            row: dict，鍵為 fieldnames 中的欄位
+        """
+        with self._buffer_lock:
+            if self._closed:
+                raise ValueError("CSV 寫入器已關閉")
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.batch_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """把緩衝區的數據寫入檔案"""
+        # 先取得 _io_lock 再取出緩衝區：先取出的一批一定先寫入，數據順序與 write() 相同
+        with self._io_lock:
+            with self._buffer_lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return
+            if self._file is None:
+                self._open()
+            self._writer.writerows(rows)
+            self.rows_written += len(rows)
+            if self.durability != DURABILITY_NONE:
+                self._file.flush()
+            if self.durability == DURABILITY_FSYNC:
+                os.fsync(self._file.fileno())
+
+    def _flush_loop(self):
+        """背景執行緒：定時寫入緩衝區"""
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  寫入 CSV 檔案時發生錯誤: {e}")
+
+    def close(self):
+        """停止背景執行緒、寫入剩餘數據並關閉檔案"""
+        with self._buffer_lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        self._stop_event.set()
+        if self._flush_thread is not None and self._flush_thread is not threading.current_thread():
+            self._flush_thread.join()
+
+        self.flush()
+        with self._io_lock:
+            if self._file is not None:
+                if self.durability == DURABILITY_NONE:
+                    self._file.flush()
+                self._file.close()
+                self._file = None
+                self._writer = None
@@ -0,0 +1,144 @@
+"""
+裝置登錄表
+保存每個裝置的最新數據與統計（第一次 / 最後一次收到數據的時間、訊息筆數）
+
+以 dict 依裝置名稱直接查詢，另外維護排序好的裝置名稱列表，
+列出裝置時不需要每次重新排序。
+
+裝置狀態（status）：
+- online    最近收到讀數
+- unchanged 最近只收到心跳（deadband 模式的 Pico 數值沒有變化時不發送讀數）
+- offline   超過時限沒有收到任何訊息：有心跳的裝置為 心跳間隔 × heartbeat_grace，
+            其餘為 offline_after 秒
+"""
+
+from bisect import insort
+import threading
+import time
+
+
+class DeviceRegistry:
+    """裝置登錄表（執行緒安全）"""
+
+    def __init__(self, offline_after=60, heartbeat_grace=1.5):
+        """
+        Args:
+            offline_after: 沒有心跳的裝置超過幾秒沒有訊息視為離線
+            heartbeat_grace: 有心跳的裝置超過 心跳間隔 × heartbeat_grace 秒沒有訊息視為離線
+        """
+        self._devices = {}   # 裝置 -> 狀態 dict
+        self._ids = []       # 排序好的裝置名稱
+        self._lock = threading.Lock()
+        self.offline_after = offline_after
+        self.heartbeat_grace = heartbeat_grace
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, device):
+        return device in self._devices
+
+    def update(self, device, latest, topic=None, seen_at=None):
+        """
+        更新裝置的最新數據
+
+        Args:
+            device: 裝置名稱
+            latest: 最新數據 dict
+            topic: 收到數據的主題
+            seen_at: 收到數據的時間（epoch 秒，預設為現在）
+        """
+        seen_at = time.time() if seen_at is None else seen_at
+        with self._lock:
+            state = self._state(device, seen_at, topic)
+            state['latest'] = latest
+            state['last_reading'] = seen_at
+            state['last_seen'] = max(state['last_seen'], seen_at)
+            state['message_count'] += 1
+
+    def heartbeat(self, device, interval, topic=None, seen_at=None):
+        """
+        記錄裝置的心跳（沒有讀數，最新數據不變）
+
+        Args:
+            device: 裝置名稱
+            interval: 裝置的最長靜默秒數（超過 interval × heartbeat_grace 沒有訊息視為離線）
+            topic: 收到心跳的主題
+            seen_at: 收到心跳的時間（epoch 秒，預設為現在）
+        """
+        seen_at = time.time() if seen_at is None else seen_at
+        with self._lock:
+            state = self._state(device, seen_at, topic)
+            state['heartbeat_interval'] = interval
+            state['last_heartbeat'] = seen_at
+            state['last_seen'] = max(state['last_seen'], seen_at)
+            state['heartbeat_count'] += 1
+
+    def _state(self, device, seen_at, topic):
+        """取得（或建立）裝置狀態並更新主題，呼叫時須持有鎖"""
+        state = self._devices.get(device)
+        if state is None:
+            state = self._devices[device] = {
+                'device': device,
+                'first_seen': seen_at,
+                'last_seen': seen_at,
+                'last_reading': None,
+                'message_count': 0,
+                'heartbeat_count': 0,
+                'heartbeat_interval': None,
+                'last_heartbeat': None,
+                'topic': topic,
+                'latest': None,
+            }
+            insort(self._ids, device)
+        if topic is not None:
+            state['topic'] = topic
+        return state
+
+    def _status(self, state, now):
+        """裝置狀態：online / unchanged / offline"""
+        interval = state['heartbeat_interval']
+        timeout = interval * self.heartbeat_grace if interval else self.offline_after
+        if now - state['last_seen'] > timeout:
+            return 'offline'
+        if state['last_heartbeat'] is not None and (
+                state['last_reading'] is None or state['last_heartbeat'] > state['last_reading']):
+            return 'unchanged'
+        return 'online'
+
+    def latest(self, device):
+        """取得裝置的最新數據，裝置不存在時回傳 None"""
+        state = self._devices.get(device)
+        return None if state is None else state['latest']
+
+    def get(self, device):
+        """取得裝置狀態的副本（含 status），裝置不存在時回傳 None"""
+        with self._lock:
+            state = self._devices.get(device)
+            if state is None:
+                return None
+            result = dict(state)
+            result['status'] = self._status(state, time.time())
+            return result
+
+    def list(self, include_latest=False):
+        """
+        列出所有裝置（依名稱排序）
+
+        Args:
+            include_latest: 是否包含最新數據
+
+        Returns:
+            list: 每個裝置為 dict（device, topic, status, first_seen, last_seen, last_reading,
+                  message_count, heartbeat_interval, last_heartbeat, heartbeat_count[, latest]）
+        """
+        now = time.time()
+        with self._lock:
+            result = []
+            for device in self._ids:
+                state = dict(self._devices[device])
+                state['status'] = self._status(state, now)
+                if not include_latest:
+                    state.pop('latest', None)
+                result.append(state)
+            return result
@@ -0,0 +1,230 @@
+"""
+時間序列降採樣
+提供 Largest-Triangle-Three-Buckets（LTTB）與 min/max/avg 分桶兩種方式，
+讓圖表只需要少量的點就能保留數據的形狀
+
+輸入為欄位陣列 dict（timestamps / temperature / humidity / light），
+有安裝 numpy 時以向量化方式計算，否則使用純 Python 版本
+"""
+
+from array import array
+
+# 嘗試導入 numpy（用於向量化計算）
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+MODE_LTTB = 'lttb'
+MODE_MINMAX = 'minmax'
+MODE_AVG = 'avg'
+MODES = (MODE_LTTB, MODE_MINMAX, MODE_AVG)
+
+# 可以作為降採樣依據的欄位
+VALUE_COLUMNS = ('temperature', 'humidity')
+
+
+def bucket_edges(n, buckets):
+    """
+    將 n 筆數據平均切成 buckets 個區間
+
+    Returns:
+        list: 長度為 buckets + 1 的邊界索引
+    """
+    return [i * n // buckets for i in range(buckets + 1)]
+
+
+def lttb_indices(x, y, max_points):
+    """
+    Largest-Triangle-Three-Buckets 降採樣
+
+    保留第一點與最後一點，中間每個區間選出與「上一個選中點」及
+    「下一個區間平均點」構成最大三角形面積的點
+
+    Args:
+        x: 時間（遞增）
+        y: 數值
+        max_points: 最多保留幾點
+
+    Returns:
+        list: 選中點的索引（遞增）
+    """
+    n = len(x)
+    if max_points >= n or n <= 2:
+        return list(range(n))
+    if max_points < 3:
+        return [0, n - 1][:max(max_points, 0)]
+
+    if HAS_NUMPY:
+        return _lttb_numpy(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), max_points)
+
+    # 中間的 n - 2 點切成 max_points - 2 個區間
+    edges = [1 + e for e in bucket_edges(n - 2, max_points - 2)]
+    selected = [0]
+    a = 0
+    for b in range(max_points - 2):
+        start, end = edges[b], edges[b + 1]
+
+        # 下一個區間的平均點（最後一個區間以最後一點代替）
+        if b + 1 < max_points - 2:
+            next_start, next_end = edges[b + 1], edges[b + 2]
+        else:
+            next_start, next_end = n - 1, n
+        count = next_end - next_start
+        avg_x = sum(x[next_start:next_end]) / count
+        avg_y = sum(y[next_start:next_end]) / count
+
+        ax, ay = x[a], y[a]
+        best, best_area = start, -1.0
+        for i in range(start, end):
+            area = abs((ax - avg_x) * (y[i] - ay) - (ax - x[i]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = i, area
+        selected.append(best)
+        a = best
+
+    selected.append(n - 1)
+    return selected
+
+
+def _lttb_numpy(x, y, max_points):
+    """LTTB 的 numpy 版本：每個區間內的面積以向量運算一次算完"""
+    n = len(x)
+    edges = 1 + np.array(bucket_edges(n - 2, max_points - 2))
+
+    # 預先算好每個區間的平均點
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x[1:] / counts[1:], x[-1])
+    avg_y = np.append(sums_y[1:] / counts[1:], y[-1])
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for b in range(max_points - 2):
+        start, end = edges[b], edges[b + 1]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - avg_x[b]) * (y[start:end] - ay) - (ax - x[start:end]) * (avg_y[b] - ay))
+        a = start + int(np.argmax(area))
+        selected[b + 1] = a
+    return selected.tolist()
+
+
+def minmax_indices(y, max_points):
+    """
+    min/max 分桶降採樣：每個區間保留最小值與最大值兩點
+
+    Args:
+        y: 數值
+        max_points: 最多保留幾點（區間數為 max_points // 2）
+
+    Returns:
+        list: 選中點的索引（遞增）
+    """
+    n = len(y)
+    buckets = max_points // 2
+    if max_points >= n or buckets < 1:
+        return list(range(n)) if max_points >= n else []
+
+    edges = bucket_edges(n, buckets)
+    selected = []
+    if HAS_NUMPY:
+        values = np.asarray(y, dtype=np.float64)
+        for start, end in zip(edges[:-1], edges[1:]):
+            chunk = values[start:end]
+            lo = start + int(np.argmin(chunk))
+            hi = start + int(np.argmax(chunk))
+            selected.extend(sorted({lo, hi}))
+        return selected
+
+    for start, end in zip(edges[:-1], edges[1:]):
+        lo = hi = start
+        for i in range(start + 1, end):
+            if y[i] < y[lo]:
+                lo = i
+            if y[i] > y[hi]:
+                hi = i
+        selected.extend(sorted({lo, hi}))
+    return selected
+
+
+def take(columns, indices):
+    """依索引取出各欄位的值（保持原本的 array 型別）"""
+    if HAS_NUMPY:
+        positions = np.asarray(indices, dtype=np.int64)
+        return {
+            name: array(column.typecode, np.frombuffer(column, dtype=column.typecode)[positions].tobytes())
+            for name, column in columns.items()
+        }
+    return {
+        name: array(column.typecode, (column[i] for i in indices))
+        for name, column in columns.items()
+    }
+
+
+def bucket_average(columns, max_points):
+    """
+    平均分桶降採樣：每個區間輸出一點，時間與數值取平均，電燈狀態取區間最後一筆
+
+    Returns:
+        dict: 與輸入相同欄位的 array
+    """
+    n = len(columns['timestamps'])
+    if max_points >= n:
+        return columns
+    if max_points < 1:
+        return {name: array(column.typecode) for name, column in columns.items()}
+
+    edges = bucket_edges(n, max_points)
+    result = {}
+    if HAS_NUMPY:
+        starts = np.array(edges[:-1])
+        counts = np.diff(edges)
+        for name, column in columns.items():
+            values = np.frombuffer(column, dtype=column.typecode)
+            if name == 'light':
+                averaged = values[np.array(edges[1:]) - 1]
+            else:
+                averaged = np.add.reduceat(values.astype(np.float64), starts) / counts
+            result[name] = array(column.typecode, averaged.astype(column.typecode).tobytes())
+        return result
+
+    for name, column in columns.items():
+        if name == 'light':
+            values = (column[end - 1] for end in edges[1:])
+        elif column.typecode in 'bhilq':
+            values = (sum(column[s:e]) // (e - s) for s, e in zip(edges[:-1], edges[1:]))
+        else:
+            values = (sum(column[s:e]) / (e - s) for s, e in zip(edges[:-1], edges[1:]))
+        result[name] = array(column.typecode, values)
+    return result
+
+
+def downsample(columns, max_points, mode=MODE_LTTB, y='temperature'):
+    """
+    對欄位陣列降採樣
+
+    Args:
+        columns: dict，必須包含 timestamps 與 y 指定的欄位
+        max_points: 最多保留幾點
+        mode: 'lttb'、'minmax' 或 'avg'
+        y: lttb / minmax 選點時依據的數值欄位
+
+    Returns:
+        dict: 與輸入相同欄位的 array
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode 必須是 {MODES} 其中之一")
+    if y not in VALUE_COLUMNS:
+        raise ValueError(f"y 必須是 {VALUE_COLUMNS} 其中之一")
+
+    if len(columns['timestamps']) <= max_points:
+        return columns
+    if mode == MODE_AVG:
+        return bucket_average(columns, max_points)
+    if mode == MODE_MINMAX:
+        return take(columns, minmax_indices(columns[y], max_points))
+    return take(columns, lttb_indices(columns['timestamps'], columns[y], max_points))
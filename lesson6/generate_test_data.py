@@ -7,12 +7,9 @@ import csv
 from datetime import datetime, timedelta
 import random
 
-# 嘗試導入 openpyxl（用於 Excel）
-try:
-    from openpyxl import Workbook
-    HAS_OPENPYXL = True
-except ImportError:
-    HAS_OPENPYXL = False
+from history_export import HAS_OPENPYXL, EXPORT_HEADERS, write_xlsx
+
+if not HAS_OPENPYXL:
     print("⚠️  未安裝 openpyxl，將只生成 CSV 檔案")
 
 def generate_test_data(count=50):
@@ -64,8 +61,7 @@ def generate_test_data(count=50):
 def save_to_csv(data, filename='sensor_data.csv'):
     """儲存為 CSV 檔案"""
     with open(filename, 'w', newline='', encoding='utf-8') as f:
-        fieldnames = ['時間戳記', '電燈狀態', '溫度', '濕度']
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer = csv.DictWriter(f, fieldnames=EXPORT_HEADERS)
         writer.writeheader()
         writer.writerows(data)
     print(f"✅ CSV 檔案已建立: {filename}")
@@ -77,37 +73,8 @@ def save_to_excel(data, filename='sensor_data.xlsx'):
         print("❌ 無法建立 Excel 檔案（需要 openpyxl）")
         return
     
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "感測器數據"
-    
-    # 寫入標題
-    headers = ['時間戳記', '電燈狀態', '溫度', '濕度']
-    ws.append(headers)
-    
-    # 設定標題樣式
-    from openpyxl.styles import Font, PatternFill
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        cell.font = Font(color="FFFFFF", bold=True)
-    
-    # 寫入數據
-    for row in data:
-        ws.append([
-            row['時間戳記'],
-            row['電燈狀態'],
-            row['溫度'],
-            row['濕度']
-        ])
-    
-    # 調整欄寬
-    ws.column_dimensions['A'].width = 20
-    ws.column_dimensions['B'].width = 12
-    ws.column_dimensions['C'].width = 10
-    ws.column_dimensions['D'].width = 10
-    
-    wb.save(filename)
+    # write-only 模式逐列寫入（與 history_export 的匯出格式相同）
+    write_xlsx((tuple(row[h] for h in EXPORT_HEADERS) for row in data), filename)
     print(f"✅ Excel 檔案已建立: {filename}")
     print(f"   包含 {len(data)} 筆數據")
 
@@ -0,0 +1,327 @@
+"""
+歷史數據串流匯出（CSV / Excel / Parquet）
+直接從儲存區逐區塊讀取（PartitionedStore.iter_read() 等），邊讀邊寫，
+不會先把整段時間的數據讀進記憶體，也不建立 DataFrame：
+    csv      逐區塊寫出，可以直接作為 HTTP 回應串流
+    xlsx     openpyxl 的 write-only 模式（列直接寫入暫存檔，不保留儲存格物件）
+    parquet  pyarrow 的 ParquetWriter，每個區塊寫成一個 row group（選用）
+xlsx 與 parquet 必須寫完才是完整的檔案，串流時先寫入暫存檔再分段送出。
+
+命令列：
+    python history_export.py -o living_room.xlsx --device living_room --start "2025-01-01 00:00:00"
+"""
+
+import argparse
+import csv
+from functools import partial
+import io
+import os
+import tempfile
+import time
+
+from columnar_store import is_sorted, iter_parts, slice_columns
+from history_store import LIGHT_LABELS, format_timestamp, to_epoch_ms
+from migrate_to_columnar import iter_batches
+
+# 嘗試導入 openpyxl（用於 Excel）
+try:
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill
+    HAS_OPENPYXL = True
+except ImportError:
+    HAS_OPENPYXL = False
+
+# 嘗試導入 pyarrow（用於 Parquet）
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# 匯出的欄位（與 sensor_data.csv 相同）
+EXPORT_HEADERS = ('時間戳記', '電燈狀態', '溫度', '濕度')
+EXPORT_WIDTHS = (20, 12, 10, 10)
+
+# 格式 -> (MIME 類型, 副檔名)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', '.csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', '.xlsx'),
+    'parquet': ('application/vnd.apache.parquet', '.parquet'),
+}
+
+# 每個工作表最多的數據列數（Excel 上限 1,048,576 列，扣掉標題列），超過時接續到新的工作表
+XLSX_MAX_ROWS = 1048575
+
+# 串流暫存檔時每次送出的大小
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# CSV 來源每次讀取的筆數
+CSV_BATCH_ROWS = 4096
+
+
+def available_formats():
+    """目前環境可以使用的匯出格式"""
+    formats = ['csv']
+    if HAS_OPENPYXL:
+        formats.append('xlsx')
+    if HAS_PYARROW:
+        formats.append('parquet')
+    return formats
+
+
+def check_format(fmt):
+    """檢查格式是否支援（不支援或缺少套件時拋出 ValueError）"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format 只能是 {', '.join(EXPORT_FORMATS)}")
+    if fmt not in available_formats():
+        raise ValueError(f"匯出 {fmt} 需要安裝 {'openpyxl' if fmt == 'xlsx' else 'pyarrow'}")
+
+
+def iter_csv_chunks(path, start_ms=None, end_ms=None, batch_rows=CSV_BATCH_ROWS):
+    """
+    逐批讀取 sensor_data.csv 的時間範圍
+
+    CSV 沒有索引，且延遲送達的數據會寫在較新的數據之後：第一次讀完整個檔案記下每批的時間範圍，
+    第二次讀取時間範圍內的批次，時間重疊的批次合併排序（見 columnar_store.iter_parts）
+
+    Yields:
+        dict: timestamps / temperature / humidity / light 四個 array，依時間遞增
+    """
+    wanted = {}     # 批次索引 -> 第一次讀取時的筆數（讀取期間檔案可能繼續增加）
+    parts = []
+    for i, (columns, _) in enumerate(iter_batches(path, batch_rows)):
+        timestamps = columns['timestamps']
+        if not len(timestamps):
+            continue
+        t_min, t_max = min(timestamps), max(timestamps)
+        if (start_ms is None or t_max >= start_ms) and (end_ms is None or t_min <= end_ms):
+            wanted[i] = len(timestamps)
+            parts.append((t_min, t_max, is_sorted(timestamps)))
+
+    # iter_parts 依檔案順序呼叫每個讀取函式一次，可以共用同一個逐批讀取的迭代器
+    batches = (slice_columns(columns, 0, wanted[i])
+               for i, (columns, _) in enumerate(iter_batches(path, batch_rows)) if i in wanted)
+    load = partial(next, batches)
+    yield from iter_parts([part + (load,) for part in parts], start_ms, end_ms)
+
+
+def iter_rows(chunks):
+    """把欄位陣列轉換為匯出的列（時間戳記, 電燈狀態, 溫度, 濕度）"""
+    for columns in chunks:
+        for timestamp, light, temperature, humidity in zip(columns['timestamps'], columns['light'],
+                                                           columns['temperature'], columns['humidity']):
+            yield (format_timestamp(timestamp), LIGHT_LABELS.get(light, '未知'),
+                   round(temperature, 2), round(humidity, 2))
+
+
+def iter_csv(chunks, headers=EXPORT_HEADERS):
+    """
+    以 CSV 串流輸出（UTF-8 含 BOM，Excel 開啟時中文不會亂碼）
+
+    Yields:
+        bytes: 標題列，之後每個區塊一段
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(headers)
+    for columns in chunks:
+        writer.writerows(iter_rows([columns]))
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def write_csv(chunks, file):
+    """寫入 CSV 到二進位檔案物件"""
+    for data in iter_csv(chunks):
+        file.write(data)
+
+
+def _header_row(sheet, headers):
+    """標題列（白色粗體字、藍色底）"""
+    row = []
+    for header in headers:
+        cell = WriteOnlyCell(sheet, value=header)
+        cell.font = Font(color="FFFFFF", bold=True)
+        cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        row.append(cell)
+    return row
+
+
+def write_xlsx(rows, file, headers=EXPORT_HEADERS, title="感測器數據", widths=EXPORT_WIDTHS):
+    """
+    以 openpyxl write-only 模式寫入 Excel
+
+    Args:
+        rows: 列的 iterable（例如 iter_rows(chunks)）
+        file: 檔案路徑或二進位檔案物件
+        headers: 標題列
+        title: 工作表名稱（超過 XLSX_MAX_ROWS 列時接續到「名稱 (2)」...）
+        widths: 各欄的欄寬（None 表示不設定）
+
+    Returns:
+        int: 寫入的列數
+    """
+    if not HAS_OPENPYXL:
+        raise ValueError("匯出 xlsx 需要安裝 openpyxl")
+
+    workbook = Workbook(write_only=True)
+
+    def new_sheet(index):
+        sheet = workbook.create_sheet(title if index == 1 else f"{title} ({index})")
+        if widths:
+            for i, width in enumerate(widths):
+                sheet.column_dimensions[chr(ord('A') + i)].width = width
+        sheet.append(_header_row(sheet, headers))
+        return sheet
+
+    sheets = 1
+    sheet = new_sheet(sheets)
+    count = 0
+    for row in rows:
+        if count and count % XLSX_MAX_ROWS == 0:
+            sheets += 1
+            sheet = new_sheet(sheets)
+        sheet.append(row)
+        count += 1
+    workbook.save(file)
+    return count
+
+
+def _arrow_column(column, arrow_type):
+    """array 欄位轉換為 Arrow 陣列（直接使用 array 的記憶體，不逐筆轉換）"""
+    return pa.Array.from_buffers(arrow_type, len(column), [None, pa.py_buffer(column)])
+
+
+def write_parquet(chunks, file):
+    """
+    寫入 Parquet（timestamp 為 UTC 毫秒，light 為電燈狀態代碼：1 開、0 關、-1 未知）
+
+    每個區塊寫成一個 row group，記憶體用量以一個區塊為上限
+
+    Returns:
+        int: 寫入的筆數
+    """
+    if not HAS_PYARROW:
+        raise ValueError("匯出 parquet 需要安裝 pyarrow")
+
+    schema = pa.schema([
+        ('timestamp', pa.timestamp('ms', tz='UTC')),
+        ('temperature', pa.float32()),
+        ('humidity', pa.float32()),
+        ('light', pa.int8()),
+    ])
+    count = 0
+    with pq.ParquetWriter(file, schema) as writer:
+        for columns in chunks:
+            writer.write_table(pa.Table.from_arrays([
+                _arrow_column(columns['timestamps'], schema.field('timestamp').type),
+                _arrow_column(columns['temperature'], pa.float32()),
+                _arrow_column(columns['humidity'], pa.float32()),
+                _arrow_column(columns['light'], pa.int8()),
+            ], schema=schema))
+            count += len(columns['timestamps'])
+    return count
+
+
+def export_file(chunks, fmt, file):
+    """
+    匯出到檔案
+
+    Args:
+        chunks: 欄位陣列的 iterable（例如 PartitionedStore.iter_read()）
+        fmt: 'csv'、'xlsx' 或 'parquet'
+        file: 檔案路徑或二進位檔案物件
+    """
+    check_format(fmt)
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'wb') as f:
+            return export_file(chunks, fmt, f)
+    if fmt == 'csv':
+        write_csv(chunks, file)
+    elif fmt == 'xlsx':
+        write_xlsx(iter_rows(chunks), file)
+    else:
+        write_parquet(chunks, file)
+
+
+def _stream_via_tempfile(chunks, fmt):
+    """寫入暫存檔後分段送出（暫存檔在送完或中斷時刪除）"""
+    with tempfile.TemporaryFile() as f:
+        export_file(chunks, fmt, f)
+        f.seek(0)
+        while True:
+            block = f.read(STREAM_BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+
+
+def export_stream(chunks, fmt):
+    """
+    匯出為 bytes 串流（例如作為 Flask 的 Response）
+
+    格式不支援時立即拋出 ValueError（不會等到開始讀取串流才發生）
+
+    Returns:
+        generator: 產生 bytes
+    """
+    check_format(fmt)
+    if fmt == 'csv':
+        return iter_csv(chunks)
+    return _stream_via_tempfile(chunks, fmt)
+
+
+def export_filename(device, fmt, start_ms=None, end_ms=None):
+    """下載用的檔案名稱，例如 living_room_20250101-20250131.csv"""
+    parts = [device]
+    if start_ms is not None or end_ms is not None:
+        start = time.strftime('%Y%m%d', time.localtime(start_ms / 1000)) if start_ms is not None else ''
+        end = time.strftime('%Y%m%d', time.localtime(end_ms / 1000)) if end_ms is not None else ''
+        parts.append(f"{start}-{end}")
+    return '_'.join(parts) + EXPORT_FORMATS[fmt][1]
+
+
+def parse_time(value):
+    """解析 epoch 毫秒或 'YYYY-MM-DD HH:MM:SS'（None 表示不限制）"""
+    if value is None:
+        return None
+    return int(value) if value.isdigit() else to_epoch_ms(value)
+
+
+def main():
+    """主程式"""
+    from partitioned_store import PartitionedStore
+
+    parser = argparse.ArgumentParser(description="從分割儲存匯出歷史數據（CSV / XLSX / Parquet）")
+    parser.add_argument('-o', '--output', required=True, help="輸出檔案，依副檔名決定格式（.csv / .xlsx / .parquet）")
+    parser.add_argument('--data-dir', default='data', help="分割儲存的資料目錄（預設 data）")
+    parser.add_argument('--device', default='living_room', help="裝置名稱（預設 living_room）")
+    parser.add_argument('--start', help="開始時間（epoch 毫秒或 'YYYY-MM-DD HH:MM:SS'）")
+    parser.add_argument('--end', help="結束時間（epoch 毫秒或 'YYYY-MM-DD HH:MM:SS'）")
+    parser.add_argument('--granularity', default='day', choices=('day', 'hour'), help="分區大小（預設 day）")
+    args = parser.parse_args()
+
+    fmt = os.path.splitext(args.output)[1].lstrip('.').lower()
+    try:
+        check_format(fmt)
+        start, end = parse_time(args.start), parse_time(args.end)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+
+    store = PartitionedStore(args.data_dir, granularity=args.granularity, maintenance_interval=0, shared=True)
+    try:
+        export_file(store.iter_read(args.device, start, end), fmt, args.output)
+    finally:
+        store.close()
+    print(f"✅ 已匯出 {args.output}（{os.path.getsize(args.output)} bytes）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+感測器歷史數據儲存區
+以固定容量的環形緩衝區（ring buffer）保存歷史數據
+每個欄位使用緊湊的 array 欄位陣列，新增與淘汰最舊數據皆為 O(1)
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+import threading
+
+from columnar_store import range_columns
+
+# 時間戳記字串格式（與 CSV 檔案一致）
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 電燈狀態代碼
+LIGHT_UNKNOWN = -1
+LIGHT_OFF = 0
+LIGHT_ON = 1
+
+LIGHT_CODES = {
+    'on': LIGHT_ON,
+    '開': LIGHT_ON,
+    'off': LIGHT_OFF,
+    '關': LIGHT_OFF,
+}
+LIGHT_LABELS = {
+    LIGHT_ON: '開',
+    LIGHT_OFF: '關',
+    LIGHT_UNKNOWN: '未知',
+}
+
+# records() / since() 可選擇回傳的欄位
+RECORD_FIELDS = ('seq', 'timestamp', 'light_status', 'temperature', 'humidity')
+
+
+def encode_light(light_status):
+    """將電燈狀態字串轉換為代碼（無法辨識時為 LIGHT_UNKNOWN）"""
+    if isinstance(light_status, str):
+        return LIGHT_CODES.get(light_status.strip().lower(), LIGHT_UNKNOWN)
+    if isinstance(light_status, bool):
+        return LIGHT_ON if light_status else LIGHT_OFF
+    return LIGHT_UNKNOWN
+
+
+def to_epoch_ms(value):
+    """
+    將時間轉換為 epoch 毫秒
+
+    Args:
+        value: datetime、時間戳記字串（TIMESTAMP_FORMAT）或 epoch 秒數
+
+    Returns:
+        int: epoch 毫秒
+    """
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    if isinstance(value, str):
+        return int(datetime.strptime(value, TIMESTAMP_FORMAT).timestamp() * 1000)
+    return int(value * 1000)
+
+
+def format_timestamp(epoch_ms):
+    """將 epoch 毫秒轉換為時間戳記字串"""
+    return datetime.fromtimestamp(epoch_ms / 1000).strftime(TIMESTAMP_FORMAT)
+
+
+class HistoryStore:
+    """
+    固定容量的歷史數據儲存區
+
+    數據以欄位陣列保存：
+        timestamps   -> array('q')  epoch 毫秒
+        temperature  -> array('f')  溫度
+        humidity     -> array('f')  濕度
+        light        -> array('b')  電燈狀態代碼
+
+    容量滿時新數據會覆蓋最舊的數據，不需要搬移整個列表。
+    每筆數據有一個遞增的序號（seq，從 1 開始且連續），
+    可用 since(cursor) 只取得某個序號之後的新數據。
+    數據依接收順序保存；延遲送達（時間早於前一筆）的數據仍在緩衝區中時，
+    時間範圍查詢改為逐筆比對，不使用二分搜尋。
+    所有公開方法皆以鎖保護，可由 MQTT 執行緒與 Flask 執行緒同時存取。
+    """
+
+    def __init__(self, capacity=10000):
+        """
+        Args:
+            capacity: 最多保留的數據筆數
+        """
+        if capacity <= 0:
+            raise ValueError("capacity 必須大於 0")
+
+        self.capacity = capacity
+        self._timestamps = array('q', bytes(8 * capacity))
+        self._temperature = array('f', bytes(4 * capacity))
+        self._humidity = array('f', bytes(4 * capacity))
+        self._light = array('b', bytes(capacity))
+
+        self._head = 0       # 下一筆數據寫入的位置
+        self._size = 0       # 目前保存的筆數
+        self._next_seq = 1   # 下一筆數據的序號
+        self._late_seq = 0   # 最後一筆時間早於前一筆的數據序號（0 表示沒有）
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def last_seq(self):
+        """最新一筆數據的序號（沒有數據時為 0）"""
+        return self._next_seq - 1
+
+    def append(self, timestamp_ms, temperature, humidity, light_status):
+        """
+        新增一筆數據（容量已滿時覆蓋最舊的一筆）
+
+        Args:
+            timestamp_ms: epoch 毫秒
+            temperature: 溫度
+            humidity: 濕度
+            light_status: 電燈狀態字串或代碼
+
+        Returns:
+            int: 這筆數據的序號
+        """
+        light = light_status if isinstance(light_status, int) and not isinstance(light_status, bool) \
+            else encode_light(light_status)
+
+        with self._lock:
+            i = self._head
+            if self._size and timestamp_ms < self._timestamps[i - 1]:
+                self._late_seq = self._next_seq
+            self._timestamps[i] = int(timestamp_ms)
+            self._temperature[i] = float(temperature)
+            self._humidity[i] = float(humidity)
+            self._light[i] = light
+
+            self._head = (i + 1) % self.capacity
+            if self._size < self.capacity:
+                self._size += 1
+
+            seq = self._next_seq
+            self._next_seq += 1
+            return seq
+
+    def extend_columns(self, columns):
+        """
+        一次新增多筆數據（欄位陣列 dict：timestamps / temperature / humidity / light）
+
+        Returns:
+            int: 最後一筆數據的序號
+        """
+        with self._lock:
+            for ts, temp, humi, light in zip(columns['timestamps'], columns['temperature'],
+                                             columns['humidity'], columns['light']):
+                i = self._head
+                if self._size and ts < self._timestamps[i - 1]:
+                    self._late_seq = self._next_seq
+                self._timestamps[i] = ts
+                self._temperature[i] = temp
+                self._humidity[i] = humi
+                self._light[i] = light
+                self._head = (i + 1) % self.capacity
+                if self._size < self.capacity:
+                    self._size += 1
+                self._next_seq += 1
+            return self._next_seq - 1
+
+    def clear(self):
+        """清除所有數據（序號不會重設）"""
+        with self._lock:
+            self._head = 0
+            self._size = 0
+
+    def _ordered(self):
+        """緩衝區中的數據是否依時間遞增（呼叫前須持有鎖）"""
+        # 延遲的那一筆成為最舊的一筆（前一筆已被淘汰）時，剩下的數據又是遞增的
+        return self._late_seq <= self._next_seq - self._size
+
+    def _spans(self, skip, count):
+        """跳過最舊的 skip 筆後，由舊到新回傳 count 筆數據的索引範圍（呼叫前須持有鎖）"""
+        start = (self._head - self._size + skip) % self.capacity
+        if start + count <= self.capacity:
+            return [range(start, start + count)]
+        return [range(start, self.capacity), range(0, (start + count) - self.capacity)]
+
+    def _record(self, i, seq, fields=RECORD_FIELDS):
+        """將索引 i 的數據轉換為字典（呼叫前須持有鎖）"""
+        record = {}
+        for field in fields:
+            if field == 'seq':
+                record['seq'] = seq
+            elif field == 'timestamp':
+                record['timestamp'] = format_timestamp(self._timestamps[i])
+            elif field == 'light_status':
+                record['light_status'] = LIGHT_LABELS.get(self._light[i], '未知')
+            elif field == 'temperature':
+                record['temperature'] = round(self._temperature[i], 2)
+            elif field == 'humidity':
+                record['humidity'] = round(self._humidity[i], 2)
+        return record
+
+    def _collect(self, skip, count, fields):
+        """取得跳過 skip 筆後的 count 筆數據（呼叫前須持有鎖）"""
+        seq = self._next_seq - self._size + skip
+        result = []
+        for span in self._spans(skip, count):
+            for i in span:
+                result.append(self._record(i, seq, fields))
+                seq += 1
+        return result
+
+    def oldest_timestamp(self):
+        """最舊一筆數據的時間（epoch 毫秒），沒有數據時回傳 None"""
+        with self._lock:
+            if self._size == 0:
+                return None
+            if not self._ordered():
+                return min(self._slice_columns(0, self._size)['timestamps'])
+            return self._timestamps[(self._head - self._size) % self.capacity]
+
+    def latest(self):
+        """取得最新一筆數據，沒有數據時回傳 None"""
+        with self._lock:
+            if self._size == 0:
+                return None
+            return self._record((self._head - 1) % self.capacity, self._next_seq - 1)
+
+    def records(self, limit=None, fields=RECORD_FIELDS):
+        """
+        取得歷史數據（由舊到新）
+
+        Args:
+            limit: 只回傳最近的 limit 筆，None 表示全部
+            fields: 要回傳的欄位（RECORD_FIELDS 的子集合）
+
+        Returns:
+            list: 每筆數據為 dict（seq, timestamp, light_status, temperature, humidity）
+        """
+        with self._lock:
+            count = self._size if limit is None else max(0, min(limit, self._size))
+            return self._collect(self._size - count, count, fields)
+
+    def since(self, cursor, limit=None, fields=RECORD_FIELDS):
+        """
+        取得序號大於 cursor 的新數據（由舊到新），成本只與新數據筆數有關
+
+        Args:
+            cursor: 上次取得的最後序號（0 表示從最舊的數據開始）
+            limit: 最多回傳幾筆（由最舊的新數據開始），None 表示全部
+            fields: 要回傳的欄位
+
+        Returns:
+            dict:
+                items: 數據列表
+                next_cursor: 下次查詢要帶入的序號
+                    （小於帶入的 cursor 表示序號已重新開始，例如伺服器重新啟動）
+                truncated: cursor 之後有部分數據已被淘汰
+        """
+        with self._lock:
+            skip, count, next_cursor, truncated = self._since_bounds(cursor, limit)
+            return {
+                'items': self._collect(skip, count, fields),
+                'next_cursor': next_cursor,
+                'truncated': truncated,
+            }
+
+    def _since_bounds(self, cursor, limit):
+        """計算 since() 要跳過與回傳的筆數（呼叫前須持有鎖）"""
+        oldest_seq = self._next_seq - self._size
+        truncated = cursor + 1 < oldest_seq
+        skip = max(0, cursor + 1 - oldest_seq)
+        count = max(0, self._size - skip)
+        if limit is not None:
+            count = min(count, max(0, limit))
+
+        if count:
+            next_cursor = oldest_seq + skip + count - 1
+        else:
+            next_cursor = min(cursor, self._next_seq - 1)
+        return skip, count, next_cursor, truncated
+
+    def _slice_columns(self, skip, count):
+        """以欄位陣列取得跳過 skip 筆後的 count 筆數據（呼叫前須持有鎖）"""
+        spans = self._spans(skip, count) if count else []
+        result = {}
+        for name, column in (('timestamps', self._timestamps),
+                             ('temperature', self._temperature),
+                             ('humidity', self._humidity),
+                             ('light', self._light)):
+            part = array(column.typecode)
+            for span in spans:
+                part.extend(column[span.start:span.stop])
+            result[name] = part
+        return result
+
+    def records_columns(self, limit=None):
+        """
+        與 records() 相同，但以欄位陣列回傳（供直接序列化，不建立 dict）
+
+        Returns:
+            dict: first_seq（第一筆的序號）/ columns
+        """
+        with self._lock:
+            count = self._size if limit is None else max(0, min(limit, self._size))
+            skip = self._size - count
+            return {
+                'first_seq': self._next_seq - self._size + skip,
+                'columns': self._slice_columns(skip, count),
+            }
+
+    def since_columns(self, cursor, limit=None):
+        """
+        與 since() 相同，但以欄位陣列回傳
+
+        Returns:
+            dict: first_seq / columns / next_cursor / truncated
+        """
+        with self._lock:
+            skip, count, next_cursor, truncated = self._since_bounds(cursor, limit)
+            return {
+                'first_seq': self._next_seq - self._size + skip,
+                'columns': self._slice_columns(skip, count),
+                'next_cursor': next_cursor,
+                'truncated': truncated,
+            }
+
+    def columns(self, limit=None, start_ms=None, end_ms=None):
+        """
+        以欄位陣列形式取得歷史數據（依時間由舊到新，回傳的是副本）
+
+        Args:
+            limit: 只取最近的 limit 筆，None 表示全部
+            start_ms: 只保留時間 >= start_ms 的數據
+            end_ms: 只保留時間 <= end_ms 的數據
+
+        Returns:
+            dict: timestamps / temperature / humidity / light 四個 array
+        """
+        with self._lock:
+            count = self._size if limit is None else max(0, min(limit, self._size))
+            result = self._slice_columns(self._size - count, count)
+            ordered = self._ordered()
+
+        if not ordered:
+            # 含延遲送達的數據：逐筆比對後依時間排序（緩衝區中依接收順序排列）
+            return range_columns(result, start_ms, end_ms, ordered=False)
+        if start_ms is None and end_ms is None:
+            return result
+
+        timestamps = result['timestamps']
+        # 數據依時間遞增，可用二分搜尋找出時間範圍
+        lo = 0 if start_ms is None else bisect_left(timestamps, start_ms)
+        hi = len(timestamps) if end_ms is None else bisect_right(timestamps, end_ms)
+        return {name: column[lo:hi] for name, column in result.items()}
+
+
+def columns_to_records(columns):
+    """
+    將欄位陣列轉換為與 HistoryStore.records() 相同格式的字典列表（不含 seq）
+
+    Args:
+        columns: dict，timestamps / temperature / humidity / light 四個 array
+
+    Returns:
+        list: 每筆數據為 dict（timestamp, light_status, temperature, humidity）
+    """
+    return [
+        {
+            'timestamp': format_timestamp(ts),
+            'light_status': LIGHT_LABELS.get(light, '未知'),
+            'temperature': round(temp, 2),
+            'humidity': round(humi, 2),
+        }
+        for ts, temp, humi, light in zip(
+            columns['timestamps'], columns['temperature'], columns['humidity'], columns['light'])
+    ]
+
+
+class DeviceHistories:
+    """
+    每個裝置各自一個 HistoryStore（各自的容量與序號），第一次收到該裝置的數據時才建立
+
+    多個裝置的數據不會交錯在同一個序列中，since(cursor) 的序號也只在同一個裝置內連續。
+    """
+
+    def __init__(self, capacity=10000):
+        """
+        Args:
+            capacity: 每個裝置最多保留的數據筆數
+        """
+        self.capacity = capacity
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """所有裝置的數據筆數"""
+        with self._lock:
+            stores = list(self._stores.values())
+        return sum(len(store) for store in stores)
+
+    def get(self, device, create=False):
+        """
+        取得裝置的儲存區
+
+        Args:
+            device: 裝置名稱（呼叫前須先正規化，例如 partitioned_store.device_id()）
+            create: 不存在時是否建立
+
+        Returns:
+            HistoryStore: 不存在且 create 為 False 時回傳 None
+        """
+        with self._lock:
+            store = self._stores.get(device)
+            if store is None and create:
+                store = self._stores[device] = HistoryStore(self.capacity)
+            return store
+
+    def devices(self):
+        """有歷史數據的裝置（依名稱排序）"""
+        with self._lock:
+            return sorted(self._stores)
@@ -0,0 +1,357 @@
+"""
+MQTT 訊息接收管線
+MQTT 回調只負責把原始訊息放進有界佇列，
+解碼、儲存與推送由各階段的背景執行緒依序處理，
+避免磁碟或瀏覽器太慢時卡住 MQTT 網路執行緒
+
+AsyncIngestPipeline 是事件迴圈版本（app_async.py），各階段改由 asyncio task 執行
+"""
+
+import asyncio
+import inspect
+import queue
+import threading
+
+# 佇列已滿時的處理方式
+OVERFLOW_BLOCK = 'block'              # 等待佇列有空位（會卡住呼叫者）
+OVERFLOW_DROP_OLDEST = 'drop_oldest'  # 丟棄佇列中最舊的一筆
+OVERFLOW_DROP_NEWEST = 'drop_newest'  # 丟棄這次要放入的一筆
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+# 通知工作執行緒結束的標記
+_STOP = object()
+
+# 事件迴圈版本：每個階段連續處理幾筆後讓出事件迴圈（避免積壓時卡住 WebSocket 與 MQTT）
+_YIELD_EVERY = 64
+
+
+class BoundedQueue:
+    """
+    有界佇列，依 overflow 設定處理佇列已滿的情況，並記錄丟棄筆數
+    """
+
+    def __init__(self, maxsize, overflow=OVERFLOW_DROP_OLDEST):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow 必須是 {OVERFLOW_POLICIES} 其中之一")
+        self.overflow = overflow
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def put(self, item):
+        """
+        放入一筆數據
+
+        Returns:
+            bool: 是否成功放入（drop_newest 丟棄時為 False）
+        """
+        with self._lock:
+            self.submitted += 1
+
+        if self.overflow == OVERFLOW_BLOCK:
+            self._queue.put(item)
+        elif self.overflow == OVERFLOW_DROP_NEWEST:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+                return False
+        else:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        with self._lock:
+                            self.dropped += 1
+                    except queue.Empty:
+                        pass
+        return True
+
+    def put_stop(self):
+        """放入結束標記（不受容量與丟棄規則限制地等待）"""
+        self._queue.put(_STOP)
+
+    def get(self):
+        return self._queue.get()
+
+
+class IngestPipeline:
+    """
+    多階段訊息處理管線
+
+    stages 為 (名稱, 函式) 的列表，每個階段由一個背景執行緒執行：
+    函式接收上一階段的輸出，回傳值交給下一階段；回傳 None 表示不再往下傳。
+    第一個佇列套用 overflow 設定，階段之間的佇列已滿時則等待（背壓）。
+    """
+
+    def __init__(self, stages, maxsize=10000, overflow=OVERFLOW_DROP_OLDEST, stage_maxsize=None):
+        """
+        Args:
+            stages: [(名稱, 函式), ...]
+            maxsize: 接收佇列的容量
+            overflow: 接收佇列已滿時的處理方式
+            stage_maxsize: 階段之間佇列的容量（預設與 maxsize 相同）
+        """
+        if not stages:
+            raise ValueError("至少需要一個處理階段")
+
+        self.stages = list(stages)
+        self._queues = [BoundedQueue(maxsize, overflow)]
+        for _ in self.stages[1:]:
+            self._queues.append(BoundedQueue(stage_maxsize or maxsize, OVERFLOW_BLOCK))
+
+        self._lock = threading.Lock()
+        self._processed = {name: 0 for name, _ in self.stages}
+        self._errors = {name: 0 for name, _ in self.stages}
+        self._threads = []
+        self._running = False
+
+    def start(self):
+        """啟動各階段的工作執行緒"""
+        if self._running:
+            return
+        self._running = True
+        for index, (name, func) in enumerate(self.stages):
+            thread = threading.Thread(
+                target=self._worker,
+                args=(index, name, func),
+                name=f"ingest-{name}",
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, topic, payload, recv_time):
+        """
+        放入一筆原始 MQTT 訊息（供 MQTT 回調呼叫，不做任何解析）
+
+        Returns:
+            bool: 是否成功放入佇列
+        """
+        return self._queues[0].put((topic, payload, recv_time))
+
+    def put(self, item):
+        """
+        放入一筆已經過處理的項目（例如其他程序解碼好的數據，第一階段須能處理這種項目）
+
+        Returns:
+            bool: 是否成功放入佇列
+        """
+        return self._queues[0].put(item)
+
+    def _worker(self, index, name, func):
+        """單一階段的工作迴圈"""
+        inbox = self._queues[index]
+        outbox = self._queues[index + 1] if index + 1 < len(self._queues) else None
+
+        while True:
+            item = inbox.get()
+            if item is _STOP:
+                if outbox is not None:
+                    outbox.put_stop()
+                return
+
+            try:
+                result = func(item)
+            except Exception as e:
+                with self._lock:
+                    self._errors[name] += 1
+                print(f"處理訊息錯誤 ({name}): {e}")
+                continue
+
+            with self._lock:
+                self._processed[name] += 1
+
+            if outbox is not None and result is not None:
+                outbox.put(result)
+
+    def stop(self, timeout=5.0):
+        """處理完佇列中剩餘的訊息後停止所有工作執行緒"""
+        if not self._running:
+            return
+        self._running = False
+        self._queues[0].put_stop()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        """
+        取得管線統計數據
+
+        Returns:
+            dict: received / dropped / queued / 各階段處理與錯誤筆數
+        """
+        with self._lock:
+            return {
+                'received': self._queues[0].submitted,
+                'dropped': self._queues[0].dropped,
+                'queued': sum(len(q) for q in self._queues),
+                'overflow': self._queues[0].overflow,
+                'processed': dict(self._processed),
+                'errors': dict(self._errors),
+            }
+
+
+class AsyncIngestPipeline:
+    """
+    事件迴圈版本的多階段訊息處理管線（介面與 IngestPipeline 相同，stop() 為協程）
+
+    每個階段由一個 asyncio task 執行，階段函式可以是一般函式或協程函式；
+    會阻塞的階段（例如寫入檔案）列在 blocking 中，改在執行緒池中執行，不會卡住事件迴圈。
+    接收佇列已滿時依 overflow 丟棄（事件迴圈中不能等待，因此不支援 'block'），
+    階段之間的佇列已滿時等待（背壓）。
+    submit() / put() 可以從其他執行緒呼叫（例如分片模式的接收執行緒），
+    會透過 call_soon_threadsafe 交給事件迴圈。
+    """
+
+    def __init__(self, stages, maxsize=10000, overflow=OVERFLOW_DROP_OLDEST, stage_maxsize=None,
+                 blocking=(), executor=None):
+        """
+        Args:
+            stages: [(名稱, 函式), ...]
+            maxsize: 接收佇列的容量
+            overflow: 接收佇列已滿時的處理方式（'drop_oldest' 或 'drop_newest'）
+            stage_maxsize: 階段之間佇列的容量（預設與 maxsize 相同）
+            blocking: 在執行緒池中執行的階段名稱（同一個階段一次只處理一個項目，順序不變）
+            executor: blocking 階段使用的執行緒池（None 表示事件迴圈的預設執行緒池）
+        """
+        if not stages:
+            raise ValueError("至少需要一個處理階段")
+        if overflow not in (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST):
+            raise ValueError(f"overflow 必須是 {OVERFLOW_DROP_OLDEST} 或 {OVERFLOW_DROP_NEWEST}")
+
+        self.stages = list(stages)
+        self.blocking = frozenset(blocking)
+        self.executor = executor
+        self.overflow = overflow
+        self._maxsize = maxsize
+        self._stage_maxsize = stage_maxsize or maxsize
+        self._queues = []
+        self._processed = {name: 0 for name, _ in self.stages}
+        self._errors = {name: 0 for name, _ in self.stages}
+        self._tasks = []
+        self._loop = None
+        self._loop_thread = None
+        self._running = False
+        self.submitted = 0
+        self.dropped = 0
+
+    def start(self):
+        """在目前的事件迴圈中啟動各階段的 task"""
+        if self._running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._queues = [asyncio.Queue(self._maxsize)]
+        for _ in self.stages[1:]:
+            self._queues.append(asyncio.Queue(self._stage_maxsize))
+        self._running = True
+        for index, (name, func) in enumerate(self.stages):
+            self._tasks.append(self._loop.create_task(self._worker(index, name, func), name=f"ingest-{name}"))
+
+    def submit(self, topic, payload, recv_time):
+        """
+        放入一筆原始 MQTT 訊息（供 MQTT 回調呼叫，不做任何解析）
+
+        Returns:
+            bool: 是否成功放入佇列（從其他執行緒呼叫時一律為 True）
+        """
+        return self.put((topic, payload, recv_time))
+
+    def put(self, item):
+        """
+        放入一筆項目（第一階段須能處理這種項目）
+
+        Returns:
+            bool: 是否成功放入佇列（從其他執行緒呼叫時一律為 True）
+        """
+        if self._loop is None:
+            return False
+        if threading.get_ident() != self._loop_thread:
+            self._loop.call_soon_threadsafe(self._put, item)
+            return True
+        return self._put(item)
+
+    def _put(self, item):
+        """在事件迴圈中放入接收佇列，已滿時依 overflow 丟棄"""
+        if not self._running:
+            return False
+        self.submitted += 1
+        inbox = self._queues[0]
+        if inbox.full():
+            self.dropped += 1
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                return False
+            inbox.get_nowait()
+        inbox.put_nowait(item)
+        return True
+
+    async def _worker(self, index, name, func):
+        """單一階段的工作迴圈"""
+        inbox = self._queues[index]
+        outbox = self._queues[index + 1] if index + 1 < len(self._queues) else None
+
+        handled = 0
+        while True:
+            item = await inbox.get()
+            if item is _STOP:
+                if outbox is not None:
+                    await outbox.put(_STOP)
+                return
+
+            handled += 1
+            if handled % _YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+
+            try:
+                if name in self.blocking:
+                    result = await self._loop.run_in_executor(self.executor, func, item)
+                else:
+                    result = func(item)
+                if inspect.isawaitable(result):
+                    result = await result
+            except Exception as e:
+                self._errors[name] += 1
+                print(f"處理訊息錯誤 ({name}): {e}")
+                continue
+
+            self._processed[name] += 1
+
+            if outbox is not None and result is not None:
+                await outbox.put(result)
+
+    async def stop(self, timeout=5.0):
+        """處理完佇列中剩餘的訊息後停止所有 task"""
+        if not self._running:
+            return
+        self._running = False
+        await self._queues[0].put(_STOP)
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        self._tasks = []
+
+    def stats(self):
+        """
+        取得管線統計數據（可以從其他執行緒呼叫）
+
+        Returns:
+            dict: received / dropped / queued / 各階段處理與錯誤筆數
+        """
+        return {
+            'received': self.submitted,
+            'dropped': self.dropped,
+            'queued': sum(q.qsize() for q in self._queues),
+            'overflow': self.overflow,
+            'processed': dict(self._processed),
+            'errors': dict(self._errors),
+        }
@@ -0,0 +1,162 @@
+"""
+歷史數據轉換工具
+將 generate_test_data.py / app_flask.py 產生的 CSV 或 XLSX 檔案
+一次轉換為欄位式時間序列檔案（sensor_data.pts）
+
+用法:
+    uv run python migrate_to_columnar.py
+    uv run python migrate_to_columnar.py sensor_data.xlsx -o sensor_data.pts
+"""
+
+import argparse
+import csv
+import os
+
+from columnar_store import ColumnarWriter, ColumnarReader, empty_columns
+from history_store import to_epoch_ms, encode_light
+
+# 嘗試導入 openpyxl（用於 Excel）
+try:
+    from openpyxl import load_workbook
+    HAS_OPENPYXL = True
+except ImportError:
+    HAS_OPENPYXL = False
+
+FIELDNAMES = ['時間戳記', '電燈狀態', '溫度', '濕度']
+
+
+def iter_csv_rows(path):
+    """逐列讀取 CSV 檔案（不一次載入整個檔案）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            yield row['時間戳記'], row['電燈狀態'], row['溫度'], row['濕度']
+
+
+def iter_xlsx_rows(path):
+    """逐列讀取 Excel 檔案（openpyxl 唯讀模式）"""
+    if not HAS_OPENPYXL:
+        raise RuntimeError("需要 openpyxl 才能讀取 Excel 檔案")
+
+    wb = load_workbook(path, read_only=True)
+    try:
+        ws = wb.active
+        rows = ws.iter_rows(values_only=True)
+        header = [str(h) if h is not None else '' for h in next(rows)]
+        index = [header.index(name) for name in FIELDNAMES]
+        for row in rows:
+            if row is None or row[index[0]] is None:
+                continue
+            yield tuple(row[i] for i in index)
+    finally:
+        wb.close()
+
+
+def iter_batches(source, batch_rows=4096):
+    """
+    逐批讀取 CSV 或 XLSX 檔案並轉換為欄位陣列
+
+    Args:
+        source: CSV 或 XLSX 檔案路徑
+        batch_rows: 每批最多幾筆
+
+    Yields:
+        tuple: (欄位陣列 dict, 這一批略過的錯誤列數)
+    """
+    if source.lower().endswith(('.xlsx', '.xlsm')):
+        rows = iter_xlsx_rows(source)
+    else:
+        rows = iter_csv_rows(source)
+
+    skipped = 0
+    batch = empty_columns()
+    for timestamp, light_status, temperature, humidity in rows:
+        try:
+            batch['timestamps'].append(to_epoch_ms(timestamp))
+            batch['temperature'].append(float(temperature))
+            batch['humidity'].append(float(humidity))
+            batch['light'].append(encode_light(light_status))
+        except (TypeError, ValueError):
+            # 欄位不完整的列：移除已加入的部分欄位
+            size = len(batch['light'])
+            for column in batch.values():
+                del column[size:]
+            skipped += 1
+            continue
+
+        if len(batch['timestamps']) >= batch_rows:
+            yield batch, skipped
+            batch = empty_columns()
+            skipped = 0
+
+    if len(batch['timestamps']) or skipped:
+        yield batch, skipped
+
+
+def migrate(source, output, chunk_rows=4096, compression='zlib'):
+    """
+    轉換單一檔案
+
+    Args:
+        source: CSV 或 XLSX 檔案路徑
+        output: 欄位式檔案路徑（已存在時會接在後面）
+        chunk_rows: 每個區塊的筆數
+        compression: 封存區塊的壓縮方式
+
+    Returns:
+        tuple: (轉換筆數, 略過的錯誤列數)
+    """
+    converted = 0
+    skipped = 0
+    with ColumnarWriter(output, chunk_rows=chunk_rows, compression=compression, flush_interval=0) as writer:
+        for batch, bad_rows in iter_batches(source, chunk_rows):
+            writer.extend(batch)
+            converted += len(batch['timestamps'])
+            skipped += bad_rows
+
+    return converted, skipped
+
+
+def main():
+    """主程式"""
+    parser = argparse.ArgumentParser(description="將 CSV / XLSX 歷史數據轉換為欄位式時間序列檔案")
+    parser.add_argument('sources', nargs='*', default=['sensor_data.csv'], help="CSV 或 XLSX 檔案（依時間順序）")
+    parser.add_argument('-o', '--output', default='sensor_data.pts', help="輸出檔案（預設 sensor_data.pts）")
+    parser.add_argument('--chunk-rows', type=int, default=4096, help="每個區塊的筆數")
+    parser.add_argument('--no-compress', action='store_true', help="封存區塊不壓縮")
+    parser.add_argument('--force', action='store_true', help="輸出檔案已存在時覆蓋")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(" 歷史數據轉換工具")
+    print("=" * 60)
+
+    if os.path.exists(args.output):
+        if not args.force:
+            print(f"❌ {args.output} 已存在，如要覆蓋請加上 --force")
+            return
+        os.remove(args.output)
+
+    for source in args.sources:
+        if not os.path.exists(source):
+            print(f"⚠️  找不到檔案: {source}")
+            continue
+        converted, skipped = migrate(
+            source,
+            args.output,
+            chunk_rows=args.chunk_rows,
+            compression=None if args.no_compress else 'zlib'
+        )
+        print(f"✅ {source}: 已轉換 {converted} 筆" + (f"，略過 {skipped} 筆格式錯誤的數據" if skipped else ""))
+
+    if os.path.exists(args.output):
+        with ColumnarReader(args.output) as reader:
+            total = len(reader)
+            chunks = len(reader.chunks)
+        print()
+        print(f"📦 輸出檔案: {args.output}")
+        print(f"   總筆數: {total}，區塊數: {chunks}，檔案大小: {os.path.getsize(args.output)} bytes")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+"""
+依裝置與日期分割的時間序列儲存區
+取代單一、不斷變大的歷史數據檔案
+
+目錄結構：
+    <root>/<裝置>/<YYYY-MM-DD>.pts       每個裝置每天一個欄位式檔案（columnar_store）
+    <root>/<裝置>/<YYYY-MM-DD>.pts.gz    已關閉並以 gzip 壓縮的分區（選用）
+    <root>/<裝置>/<YYYY-MM-DD>.pts.idx   分區的區塊索引（見 columnar_store）
+以小時分割時檔名為 <YYYY-MM-DD_HH>.pts
+
+數據時間進入新的一天（或小時）時自動切換到新的分區；
+背景維護執行緒會關閉已結束的分區、壓縮已關閉的分區，
+並刪除超過保留天數的分區。
+時間範圍查詢只開啟與查詢範圍重疊的分區。
+"""
+
+from datetime import datetime, timedelta
+import gzip
+import os
+import re
+import shutil
+import threading
+import time
+
+from columnar_store import ColumnarWriter, ColumnarReader, concat_columns, slice_columns, index_path, GZIP_SUFFIX
+from csv_writer import DURABILITY_FLUSH
+
+GRANULARITY_DAY = 'day'
+GRANULARITY_HOUR = 'hour'
+GRANULARITIES = (GRANULARITY_DAY, GRANULARITY_HOUR)
+
+# 分區檔名格式（本地時間）
+PARTITION_FORMATS = {
+    GRANULARITY_DAY: '%Y-%m-%d',
+    GRANULARITY_HOUR: '%Y-%m-%d_%H',
+}
+PARTITION_LENGTHS = {
+    GRANULARITY_DAY: timedelta(days=1),
+    GRANULARITY_HOUR: timedelta(hours=1),
+}
+PARTITION_SUFFIX = '.pts'
+
+_UNSAFE_CHARS = re.compile(r'[^\w\-]')
+
+
+def device_id(name):
+    """將裝置名稱（例如 MQTT 主題的第一層）轉換為可當作目錄名稱的字串"""
+    name = _UNSAFE_CHARS.sub('_', str(name).strip())
+    return name.strip('_') or 'default'
+
+
+def partition_key(timestamp_ms, granularity=GRANULARITY_DAY):
+    """取得某個時間所屬的分區名稱"""
+    return datetime.fromtimestamp(timestamp_ms / 1000).strftime(PARTITION_FORMATS[granularity])
+
+
+def partition_bounds(key, granularity=GRANULARITY_DAY):
+    """
+    取得分區涵蓋的時間範圍
+
+    Returns:
+        tuple: (開始 epoch 毫秒, 結束 epoch 毫秒)，包含開始、不包含結束
+    """
+    start = datetime.strptime(key, PARTITION_FORMATS[granularity])
+    end = start + PARTITION_LENGTHS[granularity]
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+
+class PartitionedStore:
+    """
+    依裝置與日期（或小時）分割的欄位式時間序列儲存區（執行緒安全）
+
+    每個裝置同時最多保持 open_partitions 個寫入中的分區；
+    append() 的時間屬於其他分區時開啟該分區，超過上限時關閉最久沒有寫入的分區
+    （延遲送達的數據與新數據交錯寫入兩個分區時，不會反覆關閉與開啟檔案）。
+    """
+
+    def __init__(self, root, granularity=GRANULARITY_DAY, retention_days=None, gzip_closed=False,
+                 chunk_rows=4096, compression='zlib', flush_interval=1.0, durability=DURABILITY_FLUSH,
+                 maintenance_interval=60.0, shared=False, open_partitions=2):
+        """
+        Args:
+            root: 資料目錄（不存在時自動建立）
+            granularity: 'day' 或 'hour'
+            retention_days: 保留天數，超過的分區會被刪除（None 表示永久保留）
+            gzip_closed: 是否以 gzip 壓縮已關閉的分區
+            chunk_rows: 每個區塊的筆數
+            compression: 封存區塊的壓縮方式 None 或 'zlib'
+            flush_interval: 最長多少秒寫入一次
+            durability: 'none'、'flush' 或 'fsync'
+            maintenance_interval: 維護（關閉 / 壓縮 / 刪除分區）的間隔秒數，0 或 None 表示不自動執行
+            shared: 分區是否同時由其他程序寫入（讀取時不使用 mmap，避免檔案被截短時讀到無效的映射）
+            open_partitions: 每個裝置最多同時開啟幾個寫入中的分區
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity 必須是 {GRANULARITIES} 其中之一")
+
+        self.root = root
+        self.granularity = granularity
+        self.retention_days = retention_days
+        self.gzip_closed = gzip_closed
+        self.shared = shared
+        self.open_partitions = max(1, open_partitions)
+        self.writer_options = {
+            'chunk_rows': chunk_rows,
+            'compression': compression,
+            'flush_interval': flush_interval,
+            'durability': durability,
+        }
+        os.makedirs(root, exist_ok=True)
+
+        self._writers = {}   # (裝置, 分區名稱) -> ColumnarWriter，依最近寫入的順序排列
+        self._lock = threading.RLock()
+        self._closed = False
+
+        self.maintenance_interval = maintenance_interval
+        self._stop_event = threading.Event()
+        self._maintenance_thread = None
+        if maintenance_interval:
+            self._maintenance_thread = threading.Thread(target=self._maintenance_loop, daemon=True)
+            self._maintenance_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ---- 分區檔案 ----
+
+    def _path(self, device, key, suffix=PARTITION_SUFFIX):
+        return os.path.join(self.root, device, key + suffix)
+
+    def devices(self):
+        """列出所有裝置"""
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isdir(os.path.join(self.root, name))
+        )
+
+    def partitions(self, device, start_ms=None, end_ms=None):
+        """
+        列出裝置與時間範圍重疊的分區（由舊到新）
+
+        同一個分區同時有 .pts 與 .pts.gz 時（壓縮到一半被中斷）以 .pts 為準
+
+        Returns:
+            list: (分區名稱, 檔案路徑)
+        """
+        directory = os.path.join(self.root, device_id(device))
+        if not os.path.isdir(directory):
+            return []
+
+        found = {}
+        for name in os.listdir(directory):
+            if name.endswith(PARTITION_SUFFIX):
+                key = name[:-len(PARTITION_SUFFIX)]
+            elif name.endswith(PARTITION_SUFFIX + GZIP_SUFFIX):
+                key = name[:-len(PARTITION_SUFFIX + GZIP_SUFFIX)]
+                if key in found:
+                    continue
+            else:
+                continue
+            try:
+                first, last = partition_bounds(key, self.granularity)
+            except ValueError:
+                continue
+            if start_ms is not None and last <= start_ms:
+                continue
+            if end_ms is not None and first > end_ms:
+                continue
+            found[key] = os.path.join(directory, name)
+        return sorted(found.items())
+
+    # ---- 寫入 ----
+
+    def _writer_for(self, device, key):
+        """取得裝置在某個分區的寫入器，必要時開啟分區（呼叫前須持有鎖）"""
+        if self._closed:
+            raise ValueError("儲存區已關閉")
+        writer = self._writers.pop((device, key), None)
+        if writer is None:
+            writer = self._open_writer(device, key)
+        # 重新放到最後：最久沒有寫入的分區排在最前面
+        self._writers[(device, key)] = writer
+        return writer
+
+    def _open_writer(self, device, key):
+        """開啟分區的寫入器，裝置開啟的分區已達上限時先關閉最久沒有寫入的（呼叫前須持有鎖）"""
+        opened = [item for item in self._writers if item[0] == device]
+        for item in opened[:len(opened) - self.open_partitions + 1]:
+            self._close_writer(item)
+
+        os.makedirs(os.path.join(self.root, device), exist_ok=True)
+        path = self._path(device, key)
+        gz_path = path + GZIP_SUFFIX
+        if not os.path.exists(path) and os.path.exists(gz_path):
+            # 寫入已壓縮的分區（例如延遲送達的數據）：先解壓縮回來
+            with gzip.open(gz_path, 'rb') as src, open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(gz_path)
+
+        return ColumnarWriter(path, **self.writer_options)
+
+    def _close_writer(self, item):
+        """關閉寫入中的分區（item 為 (裝置, 分區名稱)，呼叫前須持有鎖）"""
+        self._writers.pop(item).close()
+
+    def append(self, device, timestamp_ms, temperature, humidity, light):
+        """
+        新增一筆數據
+
+        Args:
+            device: 裝置名稱
+            timestamp_ms: epoch 毫秒
+            temperature: 溫度
+            humidity: 濕度
+            light: 電燈狀態代碼（history_store.LIGHT_*）
+        """
+        device = device_id(device)
+        key = partition_key(timestamp_ms, self.granularity)
+        with self._lock:
+            self._writer_for(device, key).append(timestamp_ms, temperature, humidity, light)
+
+    def extend(self, device, columns):
+        """
+        一次新增多筆數據（欄位陣列 dict），依分區切開後寫入
+
+        時間不必遞增（例如含延遲送達的數據）：逐筆檢查時間所屬的分區，
+        連續屬於同一個分區的數據一起寫入，每一筆都寫進時間範圍包含它的分區
+        """
+        device = device_id(device)
+        runs = []   # [分區名稱, 開始, 結束]
+        first = end = None
+        for i, timestamp in enumerate(columns['timestamps']):
+            if first is not None and first <= timestamp < end:
+                runs[-1][2] = i + 1
+                continue
+            key = partition_key(timestamp, self.granularity)
+            first, end = partition_bounds(key, self.granularity)
+            runs.append([key, i, i + 1])
+        with self._lock:
+            for key, start, stop in runs:
+                self._writer_for(device, key).extend(slice_columns(columns, start, stop))
+
+    def flush(self):
+        """把所有寫入中的分區寫入檔案"""
+        with self._lock:
+            for writer in self._writers.values():
+                writer.flush()
+
+    # ---- 讀取 ----
+
+    def _current_writer(self, device, key):
+        """裝置的分區 key 寫入中時回傳其寫入器，否則回傳 None"""
+        with self._lock:
+            return self._writers.get((device, key))
+
+    def _tail_partition(self, device, key, path, tail):
+        """讀取單一分區的最後 tail 筆；寫入中的分區只讀已封存的區塊，再加上寫入器中的數據"""
+        writer = self._current_writer(device, key)
+        if writer is None:
+            with ColumnarReader(path, use_mmap=not self.shared) as reader:
+                return reader.tail(tail)
+
+        sealed_end, pending = writer.snapshot()
+        with ColumnarReader(path, limit=sealed_end) as reader:
+            columns = concat_columns([reader.tail(max(0, tail - len(pending['timestamps']))), pending])
+        size = len(columns['timestamps'])
+        return slice_columns(columns, max(0, size - tail), size)
+
+    def _iter_partition(self, device, key, path, start_ms=None, end_ms=None):
+        """逐區塊讀取單一分區的時間範圍"""
+        writer = self._current_writer(device, key)
+        if writer is not None:
+            yield from writer.iter_read(start_ms, end_ms)
+            return
+        with ColumnarReader(path, use_mmap=not self.shared) as reader:
+            yield from reader.iter_read(start_ms, end_ms)
+
+    def read(self, device, start_ms=None, end_ms=None):
+        """
+        讀出裝置在時間範圍內的數據（只開啟重疊的分區）
+
+        Args:
+            device: 裝置名稱
+            start_ms: 只保留時間 >= start_ms 的數據（None 表示不限制）
+            end_ms: 只保留時間 <= end_ms 的數據（None 表示不限制）
+
+        Returns:
+            dict: timestamps / temperature / humidity / light 四個 array
+        """
+        return concat_columns(self.iter_read(device, start_ms, end_ms))
+
+    def iter_read(self, device, start_ms=None, end_ms=None):
+        """
+        與 read() 相同，但逐區塊產生欄位陣列（由舊到新），記憶體用量與時間範圍長度無關
+
+        Yields:
+            dict: timestamps / temperature / humidity / light 四個 array
+        """
+        device = device_id(device)
+        for key, path in self.partitions(device, start_ms, end_ms):
+            yield from self._iter_partition(device, key, path, start_ms, end_ms)
+
+    def tail(self, device, n):
+        """
+        讀出裝置最後 n 筆數據（從最新的分區往回讀）
+
+        Returns:
+            dict: timestamps / temperature / humidity / light 四個 array
+        """
+        device = device_id(device)
+        parts = []
+        remaining = n
+        for key, path in reversed(self.partitions(device)):
+            if remaining <= 0:
+                break
+            columns = self._tail_partition(device, key, path, remaining)
+            parts.append(columns)
+            remaining -= len(columns['timestamps'])
+        parts.reverse()
+        return concat_columns(parts)
+
+    # ---- 維護 ----
+
+    def close_expired(self, now_ms=None):
+        """關閉時間已經結束的寫入中分區（裝置停止傳送數據時不會自動切換）"""
+        now_key = partition_key(now_ms if now_ms is not None else time.time() * 1000, self.granularity)
+        with self._lock:
+            for item in list(self._writers):
+                if item[1] < now_key:
+                    self._close_writer(item)
+
+    def compress_closed(self):
+        """
+        以 gzip 壓縮所有已關閉的分區
+
+        Returns:
+            int: 壓縮的分區數量
+        """
+        with self._lock:
+            open_paths = {self._path(device, key) for device, key in self._writers}
+
+        compressed = 0
+        for device in self.devices():
+            for key, path in self.partitions(device):
+                if path.endswith(GZIP_SUFFIX) or path in open_paths:
+                    continue
+                tmp_path = path + GZIP_SUFFIX + '.tmp'
+                before = os.stat(path)
+                with open(path, 'rb') as src, gzip.open(tmp_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                with self._lock:
+                    after = os.stat(path)
+                    if (device, key) in self._writers or \
+                            (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+                        # 壓縮期間又寫入了這個分區：下次維護時再壓縮
+                        os.remove(tmp_path)
+                        continue
+                    os.replace(tmp_path, path + GZIP_SUFFIX)
+                    os.remove(path)
+                    # 壓縮的分區整個解壓縮後讀取，不使用區塊索引
+                    if os.path.exists(index_path(path)):
+                        os.remove(index_path(path))
+                compressed += 1
+        return compressed
+
+    def apply_retention(self, now_ms=None):
+        """
+        刪除超過保留天數的分區
+
+        Returns:
+            int: 刪除的分區數量
+        """
+        if self.retention_days is None:
+            return 0
+        now_ms = now_ms if now_ms is not None else time.time() * 1000
+        cutoff = now_ms - self.retention_days * 86400 * 1000
+
+        removed = 0
+        with self._lock:
+            for device in self.devices():
+                for key, path in self.partitions(device, end_ms=cutoff):
+                    if partition_bounds(key, self.granularity)[1] > cutoff:
+                        continue
+                    if (device, key) in self._writers:
+                        self._close_writer((device, key))
+                    path = self._path(device, key)
+                    for stale in (path, path + GZIP_SUFFIX, index_path(path)):
+                        if os.path.exists(stale):
+                            os.remove(stale)
+                    removed += 1
+        return removed
+
+    def maintain(self, now_ms=None):
+        """執行一次維護：關閉已結束的分區、壓縮（選用）、刪除過期分區"""
+        self.close_expired(now_ms)
+        if self.gzip_closed:
+            self.compress_closed()
+        self.apply_retention(now_ms)
+
+    def _maintenance_loop(self):
+        """背景執行緒：定時維護分區"""
+        while not self._stop_event.wait(self.maintenance_interval):
+            try:
+                self.maintain()
+            except Exception as e:
+                print(f"⚠️  維護分區檔案時發生錯誤: {e}")
+
+    def close(self):
+        """停止背景執行緒並關閉所有寫入中的分區"""
+        self._stop_event.set()
+        if self._maintenance_thread is not None and self._maintenance_thread is not threading.current_thread():
+            self._maintenance_thread.join()
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for item in list(self._writers):
+                self._close_writer(item)
@@ -0,0 +1,422 @@
+"""
+增量彙總（rollup）引擎
+在接收數據時就累計每個裝置每分鐘 / 每小時 / 每天的統計值，
+長時間範圍的圖表與統計不需要再讀取原始數據
+
+每個時間區間保存：筆數、溫度與濕度的總和 / 最小值 / 最大值 / 最後值、
+電燈開啟的筆數、最後的電燈狀態與最後一筆數據的時間
+（「最後」以數據時間為準，延遲送達或來自不同分片的數據不會覆蓋較新的最後值）
+
+彙總結果保存在原始數據旁邊（<root>/<裝置>/rollup_<解析度>.v2.bin），
+每個區間一筆固定長度的紀錄，依時間遞增；
+最後一筆是尚未結束的區間，flush 時原地覆寫
+"""
+
+from bisect import bisect_left, bisect_right
+import os
+import struct
+import threading
+import time
+
+from history_store import LIGHT_ON, LIGHT_UNKNOWN, LIGHT_LABELS, format_timestamp
+from partitioned_store import device_id
+
+# 解析度名稱 -> 區間長度（毫秒）
+RESOLUTIONS = {
+    '1m': 60 * 1000,
+    '1h': 60 * 60 * 1000,
+    '1d': 24 * 60 * 60 * 1000,
+}
+
+# 區間開始時間, 筆數, 溫度總和/最小/最大/最後, 濕度總和/最小/最大/最後, 開燈筆數, 最後電燈狀態,
+# 最後一筆數據的時間
+ROLLUP_RECORD = struct.Struct('<qIdfffdfffIb3xq')
+ROLLUP_PREFIX = 'rollup_'
+# 舊格式（.bin）沒有最後一筆數據的時間，不再讀取（非分片模式啟動時由 backfill 從原始數據重建）
+ROLLUP_SUFFIX = '.v2.bin'
+
+
+def bucket_start(timestamp_ms, width_ms):
+    """取得時間所屬區間的開始時間（以本地時間對齊，例如每天從 00:00 開始）"""
+    offset = time.localtime(timestamp_ms / 1000).tm_gmtoff * 1000
+    return (timestamp_ms + offset) // width_ms * width_ms - offset
+
+
+def new_bucket(start_ms):
+    """建立空的區間（list，欄位順序同 ROLLUP_RECORD）"""
+    return [start_ms, 0,
+            0.0, float('inf'), float('-inf'), 0.0,
+            0.0, float('inf'), float('-inf'), 0.0,
+            0, LIGHT_UNKNOWN, -1]
+
+
+def add_to_bucket(bucket, timestamp_ms, temperature, humidity, light):
+    """把一筆數據累計到區間中（比區間中最後一筆還舊的數據不更新最後值）"""
+    bucket[1] += 1
+    bucket[2] += temperature
+    if temperature < bucket[3]:
+        bucket[3] = temperature
+    if temperature > bucket[4]:
+        bucket[4] = temperature
+    bucket[6] += humidity
+    if humidity < bucket[7]:
+        bucket[7] = humidity
+    if humidity > bucket[8]:
+        bucket[8] = humidity
+    if light == LIGHT_ON:
+        bucket[10] += 1
+    if timestamp_ms >= bucket[12]:
+        bucket[5] = temperature
+        bucket[9] = humidity
+        bucket[11] = light
+        bucket[12] = timestamp_ms
+
+
+def bucket_to_dict(bucket):
+    """將區間轉換為 API 回傳的字典"""
+    start, count = bucket[0], bucket[1]
+    return {
+        'start': start,
+        'timestamp': format_timestamp(start),
+        'count': count,
+        'temperature_avg': round(bucket[2] / count, 2) if count else None,
+        'temperature_min': round(bucket[3], 2) if count else None,
+        'temperature_max': round(bucket[4], 2) if count else None,
+        'temperature_last': round(bucket[5], 2) if count else None,
+        'humidity_avg': round(bucket[6] / count, 2) if count else None,
+        'humidity_min': round(bucket[7], 2) if count else None,
+        'humidity_max': round(bucket[8], 2) if count else None,
+        'humidity_last': round(bucket[9], 2) if count else None,
+        'light_on_ratio': round(bucket[10] / count, 3) if count else None,
+        'light_status': LIGHT_LABELS.get(bucket[11], '未知'),
+    }
+
+
+def merge_buckets(buckets):
+    """
+    把多個區間合併為一個（用於計算整段時間的統計，或合併各分片中相同開始時間的區間）
+
+    最後值取自最後一筆數據時間最新的區間，與區間的順序無關
+
+    Returns:
+        list: 合併後的區間，開始時間為第一個區間的開始時間；沒有區間時回傳 None
+    """
+    merged = None
+    for bucket in buckets:
+        if not bucket[1]:
+            continue
+        if merged is None:
+            merged = list(bucket)
+            continue
+        merged[1] += bucket[1]
+        merged[2] += bucket[2]
+        merged[3] = min(merged[3], bucket[3])
+        merged[4] = max(merged[4], bucket[4])
+        merged[6] += bucket[6]
+        merged[7] = min(merged[7], bucket[7])
+        merged[8] = max(merged[8], bucket[8])
+        merged[10] += bucket[10]
+        if bucket[12] >= merged[12]:
+            merged[5] = bucket[5]
+            merged[9] = bucket[9]
+            merged[11] = bucket[11]
+            merged[12] = bucket[12]
+    return merged
+
+
+class _RecordStarts:
+    """以序列的方式存取檔案中每筆紀錄的開始時間（給 bisect 使用，不載入整個檔案）"""
+
+    def __init__(self, f, count):
+        self._f = f
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        self._f.seek(i * ROLLUP_RECORD.size)
+        return struct.unpack('<q', self._f.read(8))[0]
+
+
+def read_rollup_file(path, width_ms, start_ms=None, end_ms=None):
+    """
+    直接讀取彙總檔案中時間範圍內的區間（檔案可能同時由其他程序寫入）
+
+    最後一筆是寫入時尚未結束的區間，內容為該程序最後一次 flush 時的狀態
+
+    Returns:
+        list: 區間（list，欄位順序同 ROLLUP_RECORD）
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        count = os.fstat(f.fileno()).st_size // ROLLUP_RECORD.size
+        starts = _RecordStarts(f, count)
+        lo = 0 if start_ms is None else bisect_left(starts, bucket_start(start_ms, width_ms))
+        hi = count if end_ms is None else bisect_right(starts, end_ms)
+        if lo >= hi:
+            return []
+        f.seek(lo * ROLLUP_RECORD.size)
+        data = f.read((hi - lo) * ROLLUP_RECORD.size)
+    return [list(record) for record in ROLLUP_RECORD.iter_unpack(data) if record[1]]
+
+
+class RollupSeries:
+    """
+    單一裝置、單一解析度的彙總序列
+
+    已結束的區間依序寫入檔案，查詢時以二分搜尋找出時間範圍；
+    尚未結束的區間保留在記憶體中，並寫在檔案最後一筆。
+    """
+
+    def __init__(self, path, width_ms):
+        self.path = path
+        self.width_ms = width_ms
+        self._current = None    # 尚未結束的區間
+        self._dirty = False
+
+        if not os.path.exists(path):
+            open(path, 'wb').close()
+        self._file = open(path, 'r+b')
+
+        # 最後一筆完整的紀錄是尚未結束的區間，截掉寫入到一半的殘留資料
+        size = os.fstat(self._file.fileno()).st_size
+        count = size // ROLLUP_RECORD.size
+        if size != count * ROLLUP_RECORD.size:
+            self._file.truncate(count * ROLLUP_RECORD.size)
+        self._open_offset = 0
+        if count:
+            self._open_offset = (count - 1) * ROLLUP_RECORD.size
+            self._file.seek(self._open_offset)
+            self._current = list(ROLLUP_RECORD.unpack(self._file.read(ROLLUP_RECORD.size)))
+
+    def _write_current(self):
+        """把尚未結束的區間寫到檔案最後一筆"""
+        self._file.seek(self._open_offset)
+        self._file.write(ROLLUP_RECORD.pack(*self._current))
+        self._dirty = False
+
+    def add(self, timestamp_ms, temperature, humidity, light):
+        """累計一筆數據"""
+        start = bucket_start(timestamp_ms, self.width_ms)
+        current = self._current
+        if current is None or start > current[0]:
+            if current is not None:
+                # 上一個區間已結束：寫入檔案後開始新的區間
+                self._write_current()
+                self._open_offset += ROLLUP_RECORD.size
+            current = self._current = new_bucket(start)
+        elif start < current[0]:
+            self._add_late(start, timestamp_ms, temperature, humidity, light)
+            return
+        add_to_bucket(current, timestamp_ms, temperature, humidity, light)
+        self._dirty = True
+
+    def _add_late(self, start, timestamp_ms, temperature, humidity, light):
+        """
+        累計延遲送達的數據（例如 Pico 補送的離線讀數）到檔案中已結束的區間
+
+        區間不存在時（離線期間沒有收到任何數據）在對應的位置插入新的區間
+        """
+        count = self._open_offset // ROLLUP_RECORD.size
+        starts = _RecordStarts(self._file, count)
+        i = bisect_left(starts, start)
+        if i < count and starts[i] == start:
+            self._file.seek(i * ROLLUP_RECORD.size)
+            bucket = list(ROLLUP_RECORD.unpack(self._file.read(ROLLUP_RECORD.size)))
+            add_to_bucket(bucket, timestamp_ms, temperature, humidity, light)
+            self._file.seek(i * ROLLUP_RECORD.size)
+            self._file.write(ROLLUP_RECORD.pack(*bucket))
+            return
+        bucket = new_bucket(start)
+        add_to_bucket(bucket, timestamp_ms, temperature, humidity, light)
+        self._insert(i, bucket)
+
+    def _insert(self, i, bucket):
+        """在第 i 筆紀錄之前插入區間，之後的紀錄（含尚未結束的區間）往後移一筆"""
+        offset = i * ROLLUP_RECORD.size
+        self._file.seek(offset)
+        rest = self._file.read()
+        self._file.seek(offset)
+        self._file.write(ROLLUP_RECORD.pack(*bucket) + rest)
+        self._open_offset += ROLLUP_RECORD.size
+
+    def query(self, start_ms=None, end_ms=None):
+        """
+        取得時間範圍內的區間（區間開始時間介於 start_ms 與 end_ms 之間）
+
+        Returns:
+            list: 區間（list，欄位順序同 ROLLUP_RECORD）
+        """
+        count = self._open_offset // ROLLUP_RECORD.size
+        starts = _RecordStarts(self._file, count)
+        lo = 0 if start_ms is None else bisect_left(starts, bucket_start(start_ms, self.width_ms))
+        hi = count if end_ms is None else bisect_right(starts, end_ms)
+
+        buckets = []
+        if lo < hi:
+            self._file.seek(lo * ROLLUP_RECORD.size)
+            data = self._file.read((hi - lo) * ROLLUP_RECORD.size)
+            buckets = [list(record) for record in ROLLUP_RECORD.iter_unpack(data)]
+
+        current = self._current
+        if current is not None and current[1] \
+                and (start_ms is None or current[0] + self.width_ms > start_ms) \
+                and (end_ms is None or current[0] <= end_ms):
+            buckets.append(list(current))
+        return buckets
+
+    def flush(self):
+        """把尚未結束的區間寫入檔案"""
+        if self._dirty:
+            self._write_current()
+            self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class RollupEngine:
+    """
+    多裝置、多解析度的增量彙總（執行緒安全）
+
+    add() 由接收數據的管線呼叫，每筆數據只更新每個解析度目前的區間，
+    查詢成本只與回傳的區間數量有關，與原始數據筆數無關。
+    """
+
+    def __init__(self, root, resolutions=tuple(RESOLUTIONS), flush_interval=5.0):
+        """
+        Args:
+            root: 資料目錄（與 PartitionedStore 相同，彙總檔案放在各裝置的目錄下）
+            resolutions: 要維護的解析度（RESOLUTIONS 的鍵）
+            flush_interval: 最長多少秒把尚未結束的區間寫入檔案（0 或 None 表示不定時寫入）
+        """
+        for resolution in resolutions:
+            if resolution not in RESOLUTIONS:
+                raise ValueError(f"resolution 必須是 {tuple(RESOLUTIONS)} 其中之一")
+
+        self.root = root
+        self.resolutions = tuple(resolutions)
+        self.flush_interval = flush_interval
+        os.makedirs(root, exist_ok=True)
+
+        self._series = {}   # (裝置, 解析度) -> RollupSeries
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._stop_event = threading.Event()
+        self._flush_thread = None
+        if flush_interval:
+            self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flush_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def path(self, device, resolution):
+        """取得彙總檔案路徑"""
+        return os.path.join(self.root, device_id(device), ROLLUP_PREFIX + resolution + ROLLUP_SUFFIX)
+
+    def has_device(self, device):
+        """裝置是否已經有彙總檔案"""
+        return all(os.path.exists(self.path(device, r)) for r in self.resolutions)
+
+    def _get_series(self, device, resolution):
+        """取得（必要時開啟）彙總序列（呼叫前須持有鎖）"""
+        key = (device, resolution)
+        series = self._series.get(key)
+        if series is None:
+            if self._closed:
+                raise ValueError("彙總引擎已關閉")
+            os.makedirs(os.path.join(self.root, device), exist_ok=True)
+            series = self._series[key] = RollupSeries(self.path(device, resolution), RESOLUTIONS[resolution])
+        return series
+
+    def add(self, device, timestamp_ms, temperature, humidity, light):
+        """
+        累計一筆數據到所有解析度
+
+        Args:
+            device: 裝置名稱
+            timestamp_ms: epoch 毫秒
+            temperature: 溫度
+            humidity: 濕度
+            light: 電燈狀態代碼（history_store.LIGHT_*）
+        """
+        device = device_id(device)
+        temperature = float(temperature)
+        humidity = float(humidity)
+        with self._lock:
+            for resolution in self.resolutions:
+                self._get_series(device, resolution).add(timestamp_ms, temperature, humidity, light)
+
+    def extend(self, device, columns):
+        """一次累計多筆數據（欄位陣列 dict，時間須遞增），用於從原始數據重建彙總"""
+        device = device_id(device)
+        with self._lock:
+            for resolution in self.resolutions:
+                series = self._get_series(device, resolution)
+                for ts, temp, humi, light in zip(columns['timestamps'], columns['temperature'],
+                                                 columns['humidity'], columns['light']):
+                    series.add(ts, temp, humi, light)
+
+    def query(self, device, resolution, start_ms=None, end_ms=None):
+        """
+        取得時間範圍內的彙總區間
+
+        Returns:
+            list: 每個區間為 dict（見 bucket_to_dict）
+        """
+        return [bucket_to_dict(b) for b in self.buckets(device, resolution, start_ms, end_ms)]
+
+    def buckets(self, device, resolution, start_ms=None, end_ms=None):
+        """取得時間範圍內的原始區間（list，欄位順序同 ROLLUP_RECORD）"""
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution 必須是 {tuple(RESOLUTIONS)} 其中之一")
+        device = device_id(device)
+        if (device, resolution) not in self._series and not os.path.exists(self.path(device, resolution)):
+            return []
+        with self._lock:
+            return self._get_series(device, resolution).query(start_ms, end_ms)
+
+    def summary(self, device, resolution, start_ms=None, end_ms=None):
+        """
+        整段時間範圍的統計（筆數、平均、最小、最大、最後值）
+
+        Returns:
+            dict: 格式同 bucket_to_dict；沒有數據時回傳 None
+        """
+        merged = merge_buckets(self.buckets(device, resolution, start_ms, end_ms))
+        return bucket_to_dict(merged) if merged is not None else None
+
+    def flush(self):
+        """把所有尚未結束的區間寫入檔案"""
+        with self._lock:
+            for series in self._series.values():
+                series.flush()
+
+    def _flush_loop(self):
+        """背景執行緒：定時寫入尚未結束的區間"""
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  寫入彙總檔案時發生錯誤: {e}")
+
+    def close(self):
+        """停止背景執行緒並關閉所有彙總檔案"""
+        self._stop_event.set()
+        if self._flush_thread is not None and self._flush_thread is not threading.current_thread():
+            self._flush_thread.join()
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for series in self._series.values():
+                series.close()
+            self._series.clear()
@@ -0,0 +1,347 @@
+"""
+感測器訊息編碼 / 解碼
+- JSON 後端：有安裝 orjson 或 ujson 時自動使用，否則使用標準函式庫的 json（解碼的加速來自這裡）
+- PayloadSchema：共用的欄位定義，別名（temp / temperature、humi / humidity）與預設值集中在一處，
+  解析成本與手寫的 .get() 串接相近
+- 編碼器登錄表：依名稱取得編碼器（'json' 與 'binary'）
+- 二進位感測器訊息（Pico 的 lesson7/sensor_packet.py 產生），依主題後綴或開頭的魔術位元組自動辨識
+- encode_columns()：把欄位陣列直接序列化為 JSON，不建立中間的 dict 列表
+"""
+
+import json
+import struct
+import time
+
+from history_store import LIGHT_LABELS, LIGHT_UNKNOWN, RECORD_FIELDS, encode_light
+
+# 嘗試導入較快的 JSON 函式庫（依序使用 orjson、ujson、標準函式庫）
+try:
+    import orjson
+
+    JSON_BACKEND = 'orjson'
+
+    def loads(payload):
+        """解析 JSON（接受 bytes 或 str）"""
+        return orjson.loads(payload)
+
+    def dumps(value):
+        """序列化為 JSON bytes"""
+        return orjson.dumps(value)
+except ImportError:
+    try:
+        import ujson
+
+        JSON_BACKEND = 'ujson'
+
+        def loads(payload):
+            """解析 JSON（接受 bytes 或 str）"""
+            return ujson.loads(payload)
+
+        def dumps(value):
+            """序列化為 JSON bytes"""
+            return ujson.dumps(value, ensure_ascii=False).encode('utf-8')
+    except ImportError:
+        JSON_BACKEND = 'json'
+
+        def loads(payload):
+            """解析 JSON（接受 bytes 或 str；先轉成 str 比讓 json 自行偵測編碼快）"""
+            if isinstance(payload, (bytes, bytearray)):
+                payload = payload.decode('utf-8')
+            return json.loads(payload)
+
+        def dumps(value):
+            """序列化為 JSON bytes"""
+            return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class PayloadSchema:
+    """
+    訊息欄位定義（lesson6 與 metest 共用）
+
+    fields 依序為 {標準欄位: ((別名, ...), 預設值)}，別名依優先順序排列。
+    parse(data) 依序以 in / [] 判斷別名，找到第一個就停止
+    """
+
+    def __init__(self, fields):
+        """
+        Args:
+            fields: {標準欄位: ((別名, ...), 預設值)}
+        """
+        self.fields = tuple((name, tuple(aliases), default) for name, (aliases, default) in fields.items())
+
+    def parse(self, data):
+        """
+        解析訊息欄位
+
+        Args:
+            data: 已解析的 JSON
+
+        Returns:
+            dict: {標準欄位: 值}（沒有任何別名時為預設值）
+
+        Raises:
+            ValueError: data 不是 JSON 物件
+        """
+        if type(data) is not dict:
+            raise ValueError(f"訊息必須是 JSON 物件，收到 {type(data).__name__}")
+        result = {}
+        for name, aliases, default in self.fields:
+            for key in aliases:
+                if key in data:
+                    result[name] = data[key]
+                    break
+            else:
+                result[name] = default
+        return result
+
+
+class JSONCodec:
+    """
+    JSON 訊息編碼器：以 schema 解析欄位
+
+    批次訊息（Pico 的 SensorBatch.to_json()）的各欄位為陣列，並含 age_ms 陣列：
+        {"age_ms": [...], "temperature": [...], "humidity": [...], "light_status": [...]}
+    心跳訊息（Pico 的 deadband 模式，數值沒有變化時定期發送）只有最長靜默秒數：
+        {"heartbeat": 300}
+    """
+
+    name = 'json'
+
+    def __init__(self, schema):
+        self.schema = schema
+
+    def decode(self, payload):
+        """將原始訊息（bytes）解碼為標準欄位 dict"""
+        return self.schema.parse(loads(payload))
+
+    def decode_batch(self, payload):
+        """
+        將原始訊息解碼為多筆讀數（單筆訊息回傳一筆）
+
+        Returns:
+            list: 標準欄位 dict，批次讀數另含 age_ms（由舊到新）；
+                  心跳訊息回傳 [{'heartbeat': 最長靜默秒數}]
+        """
+        data = loads(payload)
+        fields = self.schema.parse(data)
+        if 'heartbeat' in data:
+            return [{'heartbeat': int(data['heartbeat'])}]
+        ages = data.get('age_ms')
+        if not isinstance(ages, list):
+            return [fields]
+
+        readings = []
+        for i, age in enumerate(ages):
+            reading = {'age_ms': age}
+            for name, value in fields.items():
+                reading[name] = value[i] if isinstance(value, list) else value
+            readings.append(reading)
+        return readings
+
+    def encode(self, values):
+        """將標準欄位 dict 編碼為訊息（bytes）"""
+        return dumps(values)
+
+
+# 感測器訊息欄位（Pico 可能使用簡短的別名）
+SENSOR_SCHEMA = PayloadSchema({
+    'temperature': (('temperature', 'temp'), 0),
+    'humidity': (('humidity', 'humi'), 0),
+    'light_status': (('light_status', 'light'), '未知'),
+})
+
+# 編碼器登錄表
+CODECS = {}
+
+
+def register_codec(codec):
+    """登錄編碼器（依 codec.name）"""
+    CODECS[codec.name] = codec
+    return codec
+
+
+def get_codec(name):
+    """依名稱取得編碼器"""
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"codec 必須是 {tuple(CODECS)} 其中之一") from None
+
+
+SENSOR_CODEC = register_codec(JSONCodec(SENSOR_SCHEMA))
+
+
+# 二進位感測器訊息（little-endian，須與 lesson7/sensor_packet.py 一致）
+# 單筆（版本 1，共 9 bytes）：
+#   magic    B  BINARY_MAGIC（JSON 訊息的第一個字元不會是這個值）
+#   version  B  格式版本
+#   seq      H  Pico 的發送序號（0-65535 循環），可用來找出遺失的訊息
+#   temp     h  溫度 × 100
+#   humi     H  濕度 × 100
+#   light    b  電燈狀態代碼（1 開、0 關、-1 未知）
+# 批次（版本 2）：magic、version、seq、筆數(B) 共 5 bytes，
+#   接著每筆 age_ms(I，距離發送的毫秒數) temp(h) humi(H) light(b) 共 9 bytes
+# 心跳（版本 3，共 6 bytes）：magic、version、seq、最長靜默秒數(H)
+BINARY_MAGIC = 0xA7
+BINARY_VERSION = 1
+BINARY_FORMAT = struct.Struct('<BBHhHb')
+BINARY_BATCH_VERSION = 2
+BINARY_BATCH_HEADER = struct.Struct('<BBHB')
+BINARY_BATCH_READING = struct.Struct('<IhHb')
+BINARY_HEARTBEAT_VERSION = 3
+BINARY_HEARTBEAT = struct.Struct('<BBHH')
+# 使用這個後綴的主題一律視為二進位訊息（例如 living_room/sensor/bin）
+BINARY_TOPIC_SUFFIX = '/bin'
+_BINARY_PREFIX = bytes((BINARY_MAGIC,))
+
+
+class BinaryCodec:
+    """二進位感測器訊息編碼器（固定欄位，struct 直接解開，不需要解析文字）"""
+
+    name = 'binary'
+
+    def decode(self, payload):
+        """將原始訊息（bytes）解碼為標準欄位 dict（另含 Pico 的發送序號 seq）"""
+        if len(payload) != BINARY_FORMAT.size:
+            raise ValueError(f"二進位訊息長度必須是 {BINARY_FORMAT.size} bytes，收到 {len(payload)}")
+        magic, version, seq, temperature, humidity, light = BINARY_FORMAT.unpack(payload)
+        if magic != BINARY_MAGIC:
+            raise ValueError(f"二進位訊息的開頭錯誤: 0x{magic:02X}")
+        if version != BINARY_VERSION:
+            raise ValueError(f"不支援的二進位訊息版本: {version}")
+        return {
+            'temperature': temperature / 100,
+            'humidity': humidity / 100,
+            'light_status': LIGHT_LABELS.get(light, LIGHT_LABELS[LIGHT_UNKNOWN]),
+            'seq': seq,
+        }
+
+    def decode_batch(self, payload):
+        """
+        將原始訊息解碼為多筆讀數（版本 1 的單筆訊息回傳一筆）
+
+        Returns:
+            list: 標準欄位 dict（含 seq），批次讀數另含 age_ms（由舊到新）；
+                  心跳訊息回傳 [{'heartbeat': 最長靜默秒數, 'seq': seq}]
+        """
+        version = payload[1] if len(payload) > 1 else None
+        if version == BINARY_HEARTBEAT_VERSION:
+            if len(payload) != BINARY_HEARTBEAT.size:
+                raise ValueError(f"二進位心跳訊息長度必須是 {BINARY_HEARTBEAT.size} bytes，收到 {len(payload)}")
+            magic, _, seq, interval = BINARY_HEARTBEAT.unpack(payload)
+            if magic != BINARY_MAGIC:
+                raise ValueError(f"二進位訊息的開頭錯誤: 0x{magic:02X}")
+            return [{'heartbeat': interval, 'seq': seq}]
+        if version != BINARY_BATCH_VERSION:
+            return [self.decode(payload)]
+
+        if len(payload) < BINARY_BATCH_HEADER.size:
+            raise ValueError("二進位批次訊息長度不足")
+        magic, _, seq, count = BINARY_BATCH_HEADER.unpack_from(payload)
+        if magic != BINARY_MAGIC:
+            raise ValueError(f"二進位訊息的開頭錯誤: 0x{magic:02X}")
+        expected = BINARY_BATCH_HEADER.size + count * BINARY_BATCH_READING.size
+        if len(payload) != expected:
+            raise ValueError(f"二進位批次訊息長度必須是 {expected} bytes，收到 {len(payload)}")
+
+        unknown = LIGHT_LABELS[LIGHT_UNKNOWN]
+        return [
+            {
+                'age_ms': age,
+                'temperature': temperature / 100,
+                'humidity': humidity / 100,
+                'light_status': LIGHT_LABELS.get(light, unknown),
+                'seq': seq,
+            }
+            for age, temperature, humidity, light
+            in BINARY_BATCH_READING.iter_unpack(payload[BINARY_BATCH_HEADER.size:])
+        ]
+
+    def encode(self, values):
+        """將標準欄位 dict 編碼為訊息（bytes，seq 預設為 0）"""
+        return BINARY_FORMAT.pack(
+            BINARY_MAGIC,
+            BINARY_VERSION,
+            values.get('seq', 0) & 0xFFFF,
+            round(values['temperature'] * 100),
+            round(values['humidity'] * 100),
+            encode_light(values['light_status'])
+        )
+
+
+BINARY_CODEC = register_codec(BinaryCodec())
+
+
+def detect_codec(topic, payload):
+    """依主題後綴或訊息開頭的魔術位元組選擇編碼器（其餘視為 JSON）"""
+    if topic.endswith(BINARY_TOPIC_SUFFIX) or payload[:1] == _BINARY_PREFIX:
+        return BINARY_CODEC
+    return SENSOR_CODEC
+
+
+# 電燈狀態的 JSON 字串（與 Flask jsonify 相同，非 ASCII 字元以 \u 跳脫）
+_LIGHT_JSON = {code: json.dumps(label) for code, label in LIGHT_LABELS.items()}
+_UNKNOWN_JSON = _LIGHT_JSON[LIGHT_UNKNOWN]
+
+
+def _json_timestamps(timestamps):
+    """
+    把 epoch 毫秒轉換為 JSON 時間戳記字串（與 format_timestamp 相同）
+
+    同一分鐘內的數據共用 'YYYY-MM-DD HH:MM:' 前綴，只需要補上秒數
+    """
+    result = []
+    minute = None
+    prefix = ''
+    for ts in timestamps:
+        seconds = int(ts) // 1000
+        if seconds // 60 != minute:
+            minute = seconds // 60
+            prefix = time.strftime('"%Y-%m-%d %H:%M:', time.localtime(seconds))
+        result.append('%s%02d"' % (prefix, seconds % 60))
+    return result
+
+
+def _json_column(field, columns, first_seq):
+    """把一個欄位轉換為 JSON 片段列表"""
+    if field == 'seq':
+        return [str(seq) for seq in range(first_seq, first_seq + len(columns['timestamps']))]
+    if field == 'timestamp':
+        return _json_timestamps(columns['timestamps'])
+    if field == 'light_status':
+        return [_LIGHT_JSON.get(light, _UNKNOWN_JSON) for light in columns['light']]
+    return [repr(round(value, 2)) for value in columns[field]]
+
+
+def encode_columns(columns, fields=RECORD_FIELDS, first_seq=None):
+    """
+    將欄位陣列直接序列化為 JSON 陣列（格式與 HistoryStore.records() 經 jsonify 相同）
+
+    Args:
+        columns: dict，timestamps / temperature / humidity / light 四個 array
+        fields: 要輸出的欄位（RECORD_FIELDS 的子集合）
+        first_seq: 第一筆的序號；None 表示沒有序號（略過 seq 欄位）
+
+    Returns:
+        str: JSON 陣列
+    """
+    if first_seq is None:
+        fields = tuple(f for f in fields if f != 'seq')
+    if not fields or not len(columns['timestamps']):
+        return '[' + ','.join('{}' for _ in columns['timestamps']) + ']'
+
+    template = '{' + ','.join('"%s":%%s' % field for field in fields) + '}'
+    values = zip(*(_json_column(field, columns, first_seq) for field in fields))
+    return '[' + ','.join([template % row for row in values]) + ']'
+
+
+def encode_since(result, fields=RECORD_FIELDS):
+    """
+    將 HistoryStore.since_columns() 的結果序列化為 {items, next_cursor, truncated}
+
+    Returns:
+        str: JSON 物件
+    """
+    items = encode_columns(result['columns'], fields, result['first_seq'])
+    return '{"items":%s,"next_cursor":%d,"truncated":%s}' % (
+        items, result['next_cursor'], 'true' if result['truncated'] else 'false')
@@ -0,0 +1,69 @@
+"""
+感測器訊息解碼
+把 MQTT 感測器訊息（JSON 或二進位）轉換為數據記錄，
+供 app_flask.py 的處理管線與 sharded_ingest.py 的工作程序共用
+"""
+
+from datetime import datetime
+
+from history_store import to_epoch_ms, TIMESTAMP_FORMAT
+from partitioned_store import device_id
+from sensor_codec import detect_codec
+
+
+def device_from_topic(topic, wildcards):
+    """取得裝置名稱：第一個被萬用字元符合的層級，沒有萬用字元時為主題的第一層"""
+    return device_id(wildcards[0] if wildcards else topic.split('/')[0])
+
+
+def is_heartbeat(record):
+    """是否為心跳記錄（裝置仍在線上但數值沒有變化，沒有讀數）"""
+    return 'heartbeat' in record
+
+
+def decode_sensor(topic, wildcards, payload, recv_time):
+    """
+    感測器主題的處理函式（TopicRouter 的 handler）：解析 JSON 或二進位訊息並取出裝置名稱
+
+    Pico 的批次訊息會拆成多筆數據，每筆的時間為收到訊息的時間減去 age_ms
+
+    Args:
+        topic: MQTT 主題
+        wildcards: 被萬用字元符合的層級
+        payload: 原始訊息 bytes
+        recv_time: 收到訊息的時間（epoch 秒）
+
+    Returns:
+        list: 數據記錄（由舊到新），每筆為 dict：
+            topic / device / epoch_ms / timestamp / temperature / humidity / light_status
+            （二進位訊息另含 Pico 的發送序號 packet_seq）
+            心跳訊息沒有讀數，記錄為 topic / device / epoch_ms / timestamp / heartbeat（最長靜默秒數），
+            可用 is_heartbeat() 判斷
+    """
+    # 依主題後綴或開頭的魔術位元組選擇 JSON 或二進位解碼
+    codec = detect_codec(topic, payload)
+    if codec.name == 'json':
+        print(f"📨 收到訊息: {payload.decode('utf-8', 'replace')}")
+    else:
+        print(f"📨 收到二進位訊息: {payload.hex()}")
+    
+    device = device_from_topic(topic, wildcards)
+    records = []
+    for fields in codec.decode_batch(payload):
+        received_at = datetime.fromtimestamp(recv_time - fields.get('age_ms', 0) / 1000)
+        record = {
+            'topic': topic,
+            'device': device,
+            'epoch_ms': to_epoch_ms(received_at),
+            'timestamp': received_at.strftime(TIMESTAMP_FORMAT),
+        }
+        if 'heartbeat' in fields:
+            record['heartbeat'] = fields['heartbeat']
+        else:
+            record['temperature'] = fields['temperature']
+            record['humidity'] = fields['humidity']
+            record['light_status'] = fields['light_status']
+        if 'seq' in fields:
+            record['packet_seq'] = fields['seq']
+        records.append(record)
+    return records
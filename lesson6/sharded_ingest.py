@@ -0,0 +1,370 @@
+"""
+多程序分片接收
+單一 paho 網路執行緒加上 GIL 只能用到一個 CPU 核心；
+分片模式啟動 N 個工作程序，每個程序有自己的 MQTT 連線、解碼與儲存，
+網頁程序只負責推送與查詢
+
+分配訊息的方式：
+    shared  MQTT 5 共享訂閱（$share/<群組>/<主題>），由 broker 輪流分配給各工作程序
+    hash    每個工作程序都訂閱全部主題，只處理裝置名稱雜湊到自己的訊息
+            （同一裝置固定由同一程序處理，但 broker 會把每則訊息送給所有程序）
+
+每個工作程序寫入自己的分片目錄（<root>/shard-00、shard-01 ...，結構同 PartitionedStore），
+解碼後的數據每隔 forward_interval 秒批次送回網頁程序更新即時狀態；
+網頁程序以 ShardedReader 跨分片查詢。
+"""
+
+import argparse
+import json
+from multiprocessing.connection import Client, Listener
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+from columnar_store import merge_columns, slice_columns
+from history_store import encode_light
+from partitioned_store import PartitionedStore, device_id, partition_bounds
+from rollup import RollupEngine, RESOLUTIONS, ROLLUP_PREFIX, ROLLUP_SUFFIX, read_rollup_file, merge_buckets
+from sensor_message import decode_sensor, device_from_topic, is_heartbeat
+from topic_router import TopicRouter
+
+STRATEGY_SHARED = 'shared'
+STRATEGY_HASH = 'hash'
+STRATEGIES = (STRATEGY_SHARED, STRATEGY_HASH)
+
+
+def shard_root(root, shard):
+    """分片的資料目錄"""
+    return os.path.join(root, f'shard-{shard:02d}')
+
+
+def shard_of(device, shards):
+    """裝置所屬的分片（以 CRC32 雜湊，跨程序與重新啟動都固定）"""
+    return zlib.crc32(device.encode('utf-8')) % shards
+
+
+def run_worker(shard, shards, config, conn):
+    """
+    工作程序：連線 MQTT、解碼並寫入自己的分片，批次回傳解碼後的數據
+
+    Args:
+        shard: 分片編號
+        shards: 分片數量
+        config: ShardedIngest.config
+        conn: 與網頁程序之間的連線（multiprocessing.connection），收到任何訊息或連線中斷時結束
+    """
+    import paho.mqtt.client as mqtt
+
+    strategy = config['strategy']
+    root = shard_root(config['root'], shard)
+    store = PartitionedStore(root, **config['storage'])
+    rollups = RollupEngine(root, flush_interval=config['rollup_flush_interval'])
+
+    router = TopicRouter()
+    for topic in config['topics']:
+        router.add(topic, decode_sensor)
+
+    pending = []
+    stats = {'connected': False, 'received': 0, 'heartbeats': 0, 'skipped': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def on_connect(client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            print(f"❌ [分片 {shard}] MQTT 連線失敗: {reason_code}")
+            return
+        stats['connected'] = True
+        if strategy == STRATEGY_SHARED:
+            topics = [(f"$share/{config['group']}/{topic}", 1) for topic in config['topics']]
+        else:
+            topics = [(topic, 1) for topic in config['topics']]
+        client.subscribe(topics)
+        print(f"✅ [分片 {shard}] 已訂閱主題: {', '.join(t for t, _ in topics)}")
+
+    def on_disconnect(client, userdata, flags, reason_code, properties):
+        stats['connected'] = False
+
+    def on_message(client, userdata, message):
+        recv_time = time.time()
+        matches = router.match(message.topic)
+        if not matches:
+            return
+        handler, wildcards = matches[0]
+        if strategy == STRATEGY_HASH and shard_of(device_from_topic(message.topic, wildcards), shards) != shard:
+            stats['skipped'] += 1
+            return
+        try:
+            records = handler(message.topic, wildcards, message.payload, recv_time)
+            heartbeats = 0
+            for record in records:
+                # 心跳沒有讀數，只送回網頁程序更新裝置狀態
+                if is_heartbeat(record):
+                    heartbeats += 1
+                    continue
+                light = encode_light(record['light_status'])
+                store.append(record['device'], record['epoch_ms'], record['temperature'], record['humidity'], light)
+                rollups.add(record['device'], record['epoch_ms'], record['temperature'], record['humidity'], light)
+        except Exception as e:
+            stats['errors'] += 1
+            print(f"[分片 {shard}] 處理訊息錯誤: {e}")
+            return
+        stats['received'] += len(records) - heartbeats
+        stats['heartbeats'] += heartbeats
+        with lock:
+            pending.extend(records)
+
+    def forward():
+        """把累積的數據與統計批次送回網頁程序"""
+        with lock:
+            records = pending[:]
+            del pending[:]
+        conn.send((shard, records, dict(stats)))
+
+    protocol = mqtt.MQTTv5 if strategy == STRATEGY_SHARED else mqtt.MQTTv311
+    client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+                         client_id=f"{config['group']}-{shard}-{os.getpid()}", protocol=protocol)
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    client.on_message = on_message
+    try:
+        client.connect_async(config['broker'], config['port'], 60)
+        client.loop_start()
+        # 網頁程序送來任何訊息（或連線中斷）時結束
+        while not conn.poll(config['forward_interval']):
+            forward()
+    except (EOFError, OSError):
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        rollups.close()
+        store.close()
+        try:
+            forward()
+        except (EOFError, OSError):
+            pass
+        conn.close()
+
+
+class ShardedIngest:
+    """
+    管理分片工作程序
+
+    工作程序以獨立的 Python 程序執行本檔案（不會重新載入網頁程序的模組），
+    透過 multiprocessing.connection 連回網頁程序；
+    回傳的數據由背景執行緒交給 on_records(records)，
+    用來更新網頁程序的即時狀態（最新數據、記憶體中的歷史數據、WebSocket 推送）。
+    """
+
+    def __init__(self, shards, root, broker, port, topics, on_records=None, strategy=STRATEGY_SHARED,
+                 group='pico-ingest', storage=None, rollup_flush_interval=5.0, forward_interval=0.25):
+        """
+        Args:
+            shards: 工作程序數量
+            root: 資料目錄（各分片在其下的 shard-XX 目錄）
+            broker: MQTT broker 位址
+            port: MQTT broker 連接埠
+            topics: 訂閱的主題樣式（支援 + 與 #）
+            on_records: 收到工作程序回傳的數據列表時呼叫的函式
+            strategy: 'shared'（MQTT 5 共享訂閱）或 'hash'（依裝置名稱雜湊）
+            group: 共享訂閱的群組名稱
+            storage: PartitionedStore 的參數（granularity、retention_days 等）
+            rollup_flush_interval: 彙總檔案的寫入間隔（秒）
+            forward_interval: 工作程序回傳數據的間隔（秒）
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"strategy 必須是 {STRATEGIES} 其中之一")
+        if shards < 1:
+            raise ValueError("shards 必須大於 0")
+
+        self.shards = shards
+        self.on_records = on_records
+        self.config = {
+            'root': os.path.abspath(root),
+            'broker': broker,
+            'port': port,
+            'topics': list(topics),
+            'strategy': strategy,
+            'group': group,
+            'storage': dict(storage or {}),
+            'rollup_flush_interval': rollup_flush_interval,
+            'forward_interval': forward_interval,
+        }
+
+        self._processes = []
+        self._connections = []
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.forwarded = 0
+
+    def start(self):
+        """啟動工作程序，並為每個程序啟動接收回傳數據的背景執行緒"""
+        if self._processes:
+            return
+        authkey = secrets.token_bytes(16)
+        with Listener(('127.0.0.1', 0), authkey=authkey) as listener:
+            host, port = listener.address
+            env = dict(os.environ, INGEST_AUTHKEY=authkey.hex())
+            for shard in range(self.shards):
+                self._processes.append(subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__),
+                     '--shard', str(shard), '--shards', str(self.shards),
+                     '--address', f'{host}:{port}', '--config', json.dumps(self.config)],
+                    env=env
+                ))
+            for _ in range(self.shards):
+                self._connections.append(listener.accept())
+
+        for conn in self._connections:
+            thread = threading.Thread(target=self._receive_loop, args=(conn,), name="ingest-forward", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _receive_loop(self, conn):
+        """背景執行緒：接收一個工作程序回傳的數據"""
+        while True:
+            try:
+                shard, records, stats = conn.recv()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                self._stats[shard] = stats
+                self.forwarded += len(records)
+            if records and self.on_records is not None:
+                try:
+                    self.on_records(records)
+                except Exception as e:
+                    print(f"處理分片數據錯誤: {e}")
+
+    def connected(self):
+        """是否有任何工作程序已連線到 MQTT broker"""
+        with self._lock:
+            return any(stats.get('connected') for stats in self._stats.values())
+
+    def stop(self, timeout=10.0):
+        """通知工作程序結束（寫入剩餘數據後關閉），並等待回傳最後的數據"""
+        if not self._processes:
+            return
+        for conn in self._connections:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process in self._processes:
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                process.terminate()
+        for thread in self._threads:
+            thread.join(timeout)
+        for conn in self._connections:
+            conn.close()
+        self._processes = []
+        self._connections = []
+        self._threads = []
+
+    def stats(self):
+        """
+        取得各分片的統計
+
+        Returns:
+            dict: workers / strategy / forwarded / 各分片的 connected、received、heartbeats、skipped、errors 與是否仍在執行
+        """
+        with self._lock:
+            return {
+                'workers': self.shards,
+                'strategy': self.config['strategy'],
+                'forwarded': self.forwarded,
+                'shards': {
+                    shard: {**self._stats.get(shard, {}), 'alive': process.poll() is None}
+                    for shard, process in enumerate(self._processes)
+                },
+            }
+
+
+class ShardedReader:
+    """
+    跨分片查詢（介面與 PartitionedStore / RollupEngine 的讀取方法相同）
+
+    同一裝置的數據可能分散在多個分片（共享訂閱時），
+    查詢時合併各分片的結果並依時間排序；彙總區間則依區間開始時間合併。
+    """
+
+    def __init__(self, root, shards, granularity='day'):
+        self.root = root
+        self.shards = shards
+        self.granularity = granularity
+        self.stores = [
+            PartitionedStore(shard_root(root, shard), granularity=granularity, maintenance_interval=0, shared=True)
+            for shard in range(shards)
+        ]
+
+    def devices(self):
+        """列出所有分片中的裝置"""
+        found = set()
+        for store in self.stores:
+            found.update(store.devices())
+        return sorted(found)
+
+    def read(self, device, start_ms=None, end_ms=None):
+        """讀出裝置在時間範圍內的數據（依時間排序）"""
+        return merge_columns([store.read(device, start_ms, end_ms) for store in self.stores])
+
+    def iter_read(self, device, start_ms=None, end_ms=None):
+        """
+        逐分區讀出裝置在時間範圍內的數據（依時間排序）
+
+        每次只合併各分片中同一個分區的數據，記憶體用量以一個分區為上限
+        """
+        keys = sorted({key for store in self.stores for key, _ in store.partitions(device, start_ms, end_ms)})
+        for key in keys:
+            first, last = partition_bounds(key, self.granularity)
+            lo = first if start_ms is None else max(first, start_ms)
+            hi = last - 1 if end_ms is None else min(last - 1, end_ms)
+            columns = merge_columns([store.read(device, lo, hi) for store in self.stores])
+            if len(columns['timestamps']):
+                yield columns
+
+    def tail(self, device, n):
+        """讀出裝置最後 n 筆數據"""
+        columns = merge_columns([store.tail(device, n) for store in self.stores])
+        size = len(columns['timestamps'])
+        return slice_columns(columns, max(0, size - n), size)
+
+    def buckets(self, device, resolution, start_ms=None, end_ms=None):
+        """取得時間範圍內的彙總區間（各分片中相同開始時間的區間合併為一個）"""
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution 必須是 {tuple(RESOLUTIONS)} 其中之一")
+        device = device_id(device)
+        by_start = {}
+        for shard in range(self.shards):
+            path = os.path.join(shard_root(self.root, shard), device, ROLLUP_PREFIX + resolution + ROLLUP_SUFFIX)
+            for bucket in read_rollup_file(path, RESOLUTIONS[resolution], start_ms, end_ms):
+                by_start.setdefault(bucket[0], []).append(bucket)
+        return [merge_buckets(by_start[start]) for start in sorted(by_start)]
+
+    def close(self):
+        for store in self.stores:
+            store.close()
+
+
+def main():
+    """工作程序進入點（由 ShardedIngest.start() 啟動）"""
+    parser = argparse.ArgumentParser(description="分片接收工作程序")
+    parser.add_argument('--shard', type=int, required=True)
+    parser.add_argument('--shards', type=int, required=True)
+    parser.add_argument('--address', required=True, help="網頁程序的 host:port")
+    parser.add_argument('--config', required=True, help="JSON 格式的設定")
+    args = parser.parse_args()
+
+    host, port = args.address.rsplit(':', 1)
+    conn = Client((host, int(port)), authkey=bytes.fromhex(os.environ['INGEST_AUTHKEY']))
+    run_worker(args.shard, args.shards, json.loads(args.config), conn)
+
+
+if __name__ == "__main__":
+    main()
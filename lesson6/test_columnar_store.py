@@ -0,0 +1,88 @@
+"""
+欄位式時間序列檔案的時間範圍查詢測試（含延遲送達、時間重疊的數據）
+
+執行方式：
+    uv run python -m unittest test_columnar_store
+"""
+
+import os
+import tempfile
+import unittest
+
+from columnar_store import ColumnarWriter, ColumnarReader, FLAG_SORTED
+
+# Pico 補送離線讀數時的接收順序：較新的讀數之後才收到較舊的讀數
+DRAIN_ORDER = [1000, 1001, 1002, 100, 101, 102, 103, 1003]
+
+
+def expected(timestamps, start_ms, end_ms):
+    return sorted(t for t in timestamps
+                  if (start_ms is None or t >= start_ms) and (end_ms is None or t <= end_ms))
+
+
+class LateDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'sensor_data.pts')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, timestamps, chunk_rows=4096):
+        with ColumnarWriter(self.path, chunk_rows=chunk_rows, flush_interval=0) as writer:
+            for t in timestamps:
+                writer.append(t, 20.0, 50.0, 1)
+
+    def assert_ranges(self, timestamps, ranges):
+        with ColumnarReader(self.path) as reader:
+            for start_ms, end_ms in ranges:
+                # 不先排序：延遲送達的數據也必須依時間回傳（降採樣與圖表都假設時間遞增）
+                got = list(reader.read(start_ms, end_ms)['timestamps'])
+                self.assertEqual(got, expected(timestamps, start_ms, end_ms), (start_ms, end_ms))
+                streamed = [t for columns in reader.iter_read(start_ms, end_ms) for t in columns['timestamps']]
+                self.assertEqual(streamed, got, (start_ms, end_ms))
+
+    def test_unsorted_chunk(self):
+        self.write(DRAIN_ORDER)
+        with ColumnarReader(self.path) as reader:
+            self.assertFalse(reader.chunks[0].flags & FLAG_SORTED)
+        self.assert_ranges(DRAIN_ORDER, [(100, 103), (1000, 1003), (101, 1001), (None, 102), (1002, None)])
+
+    def test_sorted_chunk_flag(self):
+        self.write(range(100))
+        with ColumnarReader(self.path) as reader:
+            self.assertTrue(reader.chunks[0].flags & FLAG_SORTED)
+        self.assert_ranges(range(100), [(10, 20), (None, 5), (95, None)])
+
+    def test_overlapping_chunks(self):
+        # 每 4 筆一個區塊：延遲的數據使區塊的時間範圍互相重疊
+        timestamps = DRAIN_ORDER * 3 + [5000, 50, 5001, 60]
+        self.write(timestamps, chunk_rows=4)
+        ranges = [(100, 103), (1000, 1003), (0, 99), (55, 1000), (4000, None), (None, None)]
+        self.assert_ranges(timestamps, ranges)
+
+    def test_values_follow_timestamps(self):
+        with ColumnarWriter(self.path, chunk_rows=4, flush_interval=0) as writer:
+            for t in DRAIN_ORDER:
+                writer.append(t, t / 10, 50.0, 1)
+        with ColumnarReader(self.path) as reader:
+            columns = reader.read(101, 1001)
+        self.assertEqual(list(columns['timestamps']), [101, 102, 103, 1000, 1001])
+        self.assertEqual([round(v * 10) for v in columns['temperature']], [101, 102, 103, 1000, 1001])
+
+    def test_pending_rows(self):
+        writer = ColumnarWriter(self.path, chunk_rows=4, flush_interval=0)
+        try:
+            for t in DRAIN_ORDER + [2000, 10]:
+                writer.append(t, 20.0, 50.0, 1)
+            got = [t for columns in writer.iter_read(5, 150) for t in columns['timestamps']]
+            self.assertEqual(got, [10, 100, 101, 102, 103])
+            got = [t for columns in writer.iter_read() for t in columns['timestamps']]
+            self.assertEqual(got, sorted(DRAIN_ORDER + [2000, 10]))
+        finally:
+            writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+"""
+歷史數據環形緩衝區的測試（含延遲送達的數據）
+
+執行方式：
+    uv run python -m unittest test_history_store
+"""
+
+import unittest
+
+from history_store import HistoryStore
+
+# Pico 補送離線讀數時的接收順序：較新的讀數之後才收到較舊的讀數
+DRAIN_ORDER = [1000, 1001, 1002, 100, 101, 102, 103, 1003]
+
+
+class LateDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = HistoryStore(100)
+        for t in DRAIN_ORDER:
+            self.store.append(t, t / 10, 50.0, '開')
+
+    def test_columns_in_time_order(self):
+        self.assertEqual(list(self.store.columns()['timestamps']), sorted(DRAIN_ORDER))
+        columns = self.store.columns(start_ms=101, end_ms=1001)
+        self.assertEqual(list(columns['timestamps']), [101, 102, 103, 1000, 1001])
+        self.assertEqual([round(v * 10) for v in columns['temperature']], [101, 102, 103, 1000, 1001])
+
+    def test_seq_keeps_receive_order(self):
+        result = self.store.since_columns(0)
+        self.assertEqual(list(result['columns']['timestamps']), DRAIN_ORDER)
+
+    def test_oldest_timestamp(self):
+        self.assertEqual(self.store.oldest_timestamp(), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+"""
+MQTT 主題路由
+以主題樹（trie）保存訂閱的主題樣式，支援 MQTT 萬用字元：
+    +   符合單一層級，例如 +/sensor 符合 living_room/sensor
+    #   符合其後所有層級（須為最後一層），例如 home/# 符合 home、home/kitchen/sensor
+
+比對成本只與主題的層級數有關，與註冊的樣式數量無關；
+另外快取最近比對過的主題，大量裝置重複傳送相同主題時直接取得結果。
+"""
+
+import threading
+
+SINGLE_LEVEL = '+'
+MULTI_LEVEL = '#'
+
+
+def validate_pattern(pattern):
+    """檢查主題樣式是否合法（# 只能是最後一層，萬用字元必須佔滿整個層級）"""
+    levels = pattern.split('/')
+    for i, level in enumerate(levels):
+        if level == MULTI_LEVEL and i != len(levels) - 1:
+            raise ValueError(f"'#' 只能出現在主題樣式的最後一層: {pattern}")
+        if level not in (SINGLE_LEVEL, MULTI_LEVEL) and (SINGLE_LEVEL in level or MULTI_LEVEL in level):
+            raise ValueError(f"萬用字元必須佔滿整個層級: {pattern}")
+    return levels
+
+
+class _Node:
+    __slots__ = ('children', 'routes')
+
+    def __init__(self):
+        self.children = {}
+        self.routes = []    # (註冊順序, 樣式, 處理函式)
+
+
+class TopicRouter:
+    """
+    主題樹路由器（執行緒安全）
+
+    add() 註冊主題樣式與處理函式，match() 找出符合主題的所有處理函式，
+    並回傳被萬用字元符合的層級（例如 +/sensor 比對 living_room/sensor 得到 ['living_room']），
+    可用來取出裝置名稱。
+    """
+
+    def __init__(self, cache_size=4096):
+        """
+        Args:
+            cache_size: 最多快取幾個主題的比對結果（0 表示不快取）
+        """
+        self._root = _Node()
+        self._lock = threading.Lock()
+        self._order = 0
+        self._cache = {}
+        self.cache_size = cache_size
+
+    def add(self, pattern, handler):
+        """
+        註冊主題樣式
+
+        Args:
+            pattern: 主題樣式（可含 + 與 #）
+            handler: 處理函式
+        """
+        levels = validate_pattern(pattern)
+        with self._lock:
+            node = self._root
+            for level in levels:
+                node = node.children.setdefault(level, _Node())
+            node.routes.append((self._order, pattern, handler))
+            self._order += 1
+            self._cache.clear()
+
+    def remove(self, pattern, handler=None):
+        """
+        移除主題樣式（handler 為 None 時移除該樣式的所有處理函式）
+
+        Returns:
+            bool: 是否有移除任何處理函式
+        """
+        levels = validate_pattern(pattern)
+        with self._lock:
+            path = [self._root]
+            for level in levels:
+                node = path[-1].children.get(level)
+                if node is None:
+                    return False
+                path.append(node)
+
+            node = path[-1]
+            before = len(node.routes)
+            node.routes = [r for r in node.routes if handler is not None and r[2] is not handler]
+            if len(node.routes) == before:
+                return False
+
+            # 刪除不再使用的節點
+            for parent, level, child in zip(reversed(path[:-1]), reversed(levels), reversed(path[1:])):
+                if child.routes or child.children:
+                    break
+                del parent.children[level]
+            self._cache.clear()
+            return True
+
+    def patterns(self):
+        """列出所有已註冊的主題樣式（依註冊順序，不重複）"""
+        with self._lock:
+            routes = []
+            stack = [self._root]
+            while stack:
+                node = stack.pop()
+                routes.extend(node.routes)
+                stack.extend(node.children.values())
+        seen = []
+        for _, pattern, _ in sorted(routes, key=lambda r: r[0]):
+            if pattern not in seen:
+                seen.append(pattern)
+        return seen
+
+    def match(self, topic):
+        """
+        找出符合主題的處理函式（依註冊順序）
+
+        以 $ 開頭的系統主題（例如 $SYS/...）不會被第一層的萬用字元符合
+
+        Returns:
+            list: (處理函式, 被萬用字元符合的層級列表)
+        """
+        result = self._cache.get(topic)
+        if result is not None:
+            return result
+
+        levels = topic.split('/')
+        matches = []
+        with self._lock:
+            # 深度優先走訪：(節點, 目前層級, 已符合的萬用字元層級)
+            stack = [(self._root, 0, ())]
+            while stack:
+                node, depth, wildcards = stack.pop()
+                system_topic = depth == 0 and topic.startswith('$')
+
+                multi = node.children.get(MULTI_LEVEL)
+                if multi is not None and not system_topic:
+                    rest = tuple(levels[depth:])
+                    matches.extend((order, handler, list(wildcards + rest)) for order, _, handler in multi.routes)
+
+                if depth == len(levels):
+                    matches.extend((order, handler, list(wildcards)) for order, _, handler in node.routes)
+                    continue
+
+                level = levels[depth]
+                child = node.children.get(level)
+                if child is not None:
+                    stack.append((child, depth + 1, wildcards))
+                single = node.children.get(SINGLE_LEVEL)
+                if single is not None and not system_topic:
+                    stack.append((single, depth + 1, wildcards + (level,)))
+
+            matches.sort(key=lambda m: m[0])
+            result = [(handler, wildcards) for _, handler, wildcards in matches]
+            if self.cache_size:
+                if len(self._cache) >= self.cache_size:
+                    self._cache.clear()
+                self._cache[topic] = result
+        return result
+
+    def route(self, topic, *args, **kwargs):
+        """
+        呼叫第一個符合主題的處理函式：handler(topic, wildcards, *args, **kwargs)
+
+        Returns:
+            處理函式的回傳值；沒有符合的樣式時回傳 None
+        """
+        matches = self.match(topic)
+        if not matches:
+            return None
+        handler, wildcards = matches[0]
+        return handler(topic, wildcards, *args, **kwargs)
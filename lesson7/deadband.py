@@ -0,0 +1,59 @@
+# deadband.py
+# 適用：Raspberry Pi Pico W (MicroPython)
+# 依變化發送（report-by-exception）：溫度或濕度與上次發送的值相差超過門檻、或電燈狀態改變時才發送，
+# 否則保持安靜；超過 heartbeat_ms 沒有發送時送出心跳，伺服器（lesson6/app_flask.py）
+# 藉此分辨「數值沒有變化」與「裝置離線」
+# 心跳格式：JSON {"heartbeat": 秒數}，或二進位版本 3（見 sensor_packet.PacketEncoder.encode_heartbeat）
+
+from sensor_packet import ticks_diff, ticks_ms
+
+# check() 的結果
+SKIP = 0
+REPORT = 1
+HEARTBEAT = 2
+
+
+class Deadband:
+    """
+    判斷每筆讀數是否需要發送
+
+    與「上次發送的值」比較（不是上一筆讀數），緩慢的漂移累積超過門檻時一樣會發送。
+    """
+
+    def __init__(self, temperature=0.5, humidity=2.0, heartbeat_ms=300000):
+        self.temperature = temperature
+        self.humidity = humidity
+        self.heartbeat_ms = heartbeat_ms
+        self.last = None        # 上次發送的 (溫度, 濕度, 電燈)
+        self.last_sent = None   # 上次發送（讀數或心跳）的 ticks_ms
+        self.reported = 0
+        self.skipped = 0
+        self.heartbeats = 0
+
+    def check(self, temperature, humidity, light_status, now=None):
+        """
+        回傳 REPORT（發送讀數）、HEARTBEAT（發送心跳）或 SKIP（不發送）
+
+        回傳 REPORT 或 HEARTBEAT 時即視為已發送（發送失敗的讀數由離線佇列補送）
+        """
+        now = ticks_ms() if now is None else now
+        last = self.last
+        if (last is None
+                or abs(temperature - last[0]) > self.temperature
+                or abs(humidity - last[1]) > self.humidity
+                or light_status != last[2]):
+            self.last = (temperature, humidity, light_status)
+            self.last_sent = now
+            self.reported += 1
+            return REPORT
+        if ticks_diff(now, self.last_sent) >= self.heartbeat_ms:
+            self.last_sent = now
+            self.heartbeats += 1
+            return HEARTBEAT
+        self.skipped += 1
+        return SKIP
+
+    def sent_ratio(self):
+        """實際發送的訊息數 / 讀數（讀數與心跳都算一則訊息）"""
+        total = self.reported + self.skipped + self.heartbeats
+        return (self.reported + self.heartbeats) / total if total else 0
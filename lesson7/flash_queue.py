@@ -0,0 +1,277 @@
+# flash_queue.py
+# 適用：Raspberry Pi Pico W (MicroPython)
+# 離線暫存（store-and-forward）：WiFi 或 Broker 無法使用時，把讀數存進 flash 上固定大小的環狀檔案，
+# 恢復連線後由舊到新分批補送，重新開機後仍會保留
+# 檔案格式（little-endian）：
+#   資料檔：capacity 個固定大小的槽，每槽 序號(I) 時間(I) 溫度×100(h) 濕度×100(H) 電燈(b) 開機編號(B) 檢查碼(B)
+#   確認檔：<path>.0 與 <path>.1 輪流寫入 世代(I) 已送出的序號(I) 檢查碼(B)
+#   開機計數檔：<path>.boot 每次開機加 1（1~255 循環）
+# 讀數的時間：
+#   - 時鐘已同步（main.py 以 NTP 設定 RTC 後設定 clock_synced）：time.time() 的秒數，開機編號為 0
+#   - 尚未同步：開機後的秒數，開機編號為本次開機的編號；
+#     補送時若已經重新開機，無法得知這些讀數的實際時間，直接捨棄（discarded 加 1），不猜測時間
+# 減少 flash 寫入次數：
+#   - 讀數先存在預先配置的記憶體緩衝區，累積 flush_every 筆才寫入一次
+#   - 不另外保存寫入位置，開機時掃描各槽的序號找出最新的一筆
+#   - 確認檔只在補送成功後更新，並在兩個檔案之間輪流寫入
+
+import os
+import struct
+import time
+
+from sensor_packet import LIGHT_CODES, _centi, _clamp, ticks_add, ticks_diff, ticks_ms
+
+SLOT_FORMAT = "<IIhHbB"
+SLOT_SIZE = struct.calcsize(SLOT_FORMAT) + 1
+ACK_FORMAT = "<II"
+ACK_SIZE = struct.calcsize(ACK_FORMAT) + 1
+
+# 補送時以 ticks_ms() 換算每筆的時間，ticks_diff() 最多只能表示約 6.2 天
+MAX_AGE_MS = 0x1FFFFFFF
+
+# 開機編號 0 表示時間為 time.time() 的秒數（時鐘已同步）
+WALL_CLOCK = 0
+
+# 建立 / 掃描資料檔時每次讀寫的槽數
+_CHUNK = 32
+
+
+def _checksum(buffer, start, end):
+    total = 0
+    for i in range(start, end):
+        total += buffer[i]
+    return total & 0xFF
+
+
+class FlashQueue:
+    """
+    flash 上的環狀離線佇列
+
+    序號由 1 開始遞增，序號 n 存在第 n % capacity 個槽；
+    已滿時覆蓋最舊的一筆（dropped 加 1），檔案大小固定為 capacity × SLOT_SIZE。
+    斷電時最多遺失記憶體中尚未寫入的 flush_every - 1 筆。
+    時鐘同步前記錄、重新開機後才補送的讀數沒有可信的時間，補送時捨棄（discarded 加 1）。
+    """
+
+    def __init__(self, path="offline.dat", capacity=2000, flush_every=10):
+        if capacity < 1 or not 0 < flush_every <= capacity:
+            raise ValueError("capacity 必須大於 0，flush_every 必須介於 1 到 capacity")
+        self.path = path
+        self.ack_paths = (path + ".0", path + ".1")
+        self.capacity = capacity
+        self.flush_every = flush_every
+        self.pending = bytearray(flush_every * SLOT_SIZE)
+        self.pending_count = 0
+        self.slot = bytearray(SLOT_SIZE)
+        self.head = 1        # 下一筆寫入 flash 的序號（記憶體中的讀數接在後面）
+        self.acked = 1       # 此序號之前的讀數都已送出
+        self.generation = 0  # 確認檔的世代，決定下一次寫入哪一個檔案
+        self.dropped = 0
+        self.discarded = 0
+        self.clock_synced = False  # RTC 是否已同步（由 main.py 在 NTP 同步成功後設定）
+        self._ticks = ticks_ms()
+        self._uptime_ms = 0
+        self._load()
+        self.boot = self._next_boot()
+
+    def _load(self):
+        """建立資料檔（大小不符時重建），掃描出最新的序號並讀取確認檔"""
+        size = self.capacity * SLOT_SIZE
+        try:
+            valid = os.stat(self.path)[6] == size
+        except OSError:
+            valid = False
+
+        newest = 0
+        if valid:
+            buffer = bytearray(_CHUNK * SLOT_SIZE)
+            with open(self.path, "rb") as f:
+                while True:
+                    n = f.readinto(buffer)
+                    if not n:
+                        break
+                    for offset in range(0, n - SLOT_SIZE + 1, SLOT_SIZE):
+                        seq = self._slot_seq(buffer, offset)
+                        if seq > newest:
+                            newest = seq
+        else:
+            zeros = memoryview(bytearray(_CHUNK * SLOT_SIZE))
+            with open(self.path, "wb") as f:
+                remaining = size
+                while remaining:
+                    n = min(remaining, len(zeros))
+                    f.write(zeros[:n])
+                    remaining -= n
+
+        acked = 1
+        for path in self.ack_paths:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            if len(data) != ACK_SIZE or _checksum(data, 0, ACK_SIZE - 1) != data[-1]:
+                continue
+            generation, seq = struct.unpack_from(ACK_FORMAT, data, 0)
+            if generation >= self.generation:
+                self.generation = generation
+                acked = seq
+
+        # 資料檔重建過，或記憶體中的讀數送出後未曾寫入 flash
+        self.head = max(newest + 1, acked)
+        self.acked = max(acked, self.head - self.capacity, 1)
+
+    def _next_boot(self):
+        """讀取並更新開機計數檔，回傳本次開機的編號（1~255）"""
+        boot = 0
+        try:
+            with open(self.path + ".boot", "rb") as f:
+                data = f.read()
+            if len(data) == 1:
+                boot = data[0]
+        except OSError:
+            pass
+        boot = boot % 255 + 1
+        with open(self.path + ".boot", "wb") as f:
+            f.write(bytes((boot,)))
+        return boot
+
+    def _uptime(self, now):
+        """開機後的秒數（逐次累計 ticks 差值，呼叫間隔不超過 ticks_diff 的範圍就不會溢位）"""
+        self._uptime_ms += ticks_diff(now, self._ticks)
+        self._ticks = now
+        return self._uptime_ms // 1000
+
+    def _stamp(self, now):
+        """目前的 (開機編號, 時間)：時鐘已同步時為 time.time()，否則為開機後的秒數"""
+        uptime = self._uptime(now)
+        if self.clock_synced:
+            return WALL_CLOCK, int(time.time())
+        return self.boot, uptime
+
+    @staticmethod
+    def _slot_seq(buffer, offset):
+        """槽的序號（空槽或檢查碼不符時為 0）"""
+        end = offset + SLOT_SIZE - 1
+        if _checksum(buffer, offset, end) != buffer[end]:
+            return 0
+        return struct.unpack_from("<I", buffer, offset)[0]
+
+    def oldest(self):
+        """最舊一筆尚未送出的序號"""
+        return max(self.acked, self.head + self.pending_count - self.capacity)
+
+    def __len__(self):
+        return self.head + self.pending_count - self.oldest()
+
+    def add(self, temperature, humidity, light_status, timestamp=None):
+        """加入一筆讀數（timestamp 為 time.time() 的秒數，None 表示現在）"""
+        if timestamp is None:
+            boot, timestamp = self._stamp(ticks_ms())
+        else:
+            boot = WALL_CLOCK
+        self.add_encoded(
+            timestamp,
+            _centi(temperature),
+            _clamp(int(round(humidity * 100)), 0, 65535),
+            LIGHT_CODES.get(light_status, -1),
+            boot
+        )
+
+    def add_encoded(self, timestamp, temperature, humidity, light, boot=WALL_CLOCK):
+        """
+        加入一筆已編碼的讀數（溫度、濕度為 ×100 的整數，電燈為代碼）
+
+        boot 為 WALL_CLOCK 時 timestamp 是 time.time() 的秒數，否則是該次開機後的秒數
+        """
+        if len(self) == self.capacity:
+            self.dropped += 1
+        offset = self.pending_count * SLOT_SIZE
+        end = offset + SLOT_SIZE - 1
+        struct.pack_into(
+            SLOT_FORMAT, self.pending, offset,
+            self.head + self.pending_count, timestamp, temperature, humidity, light, boot
+        )
+        self.pending[end] = _checksum(self.pending, offset, end)
+        self.pending_count += 1
+        if self.pending_count == self.flush_every:
+            self.flush()
+
+    def add_batch(self, batch, now=None):
+        """把發送失敗的 SensorBatch 讀數移入佇列（依 ticks 換算回 time.time() 或開機後的秒數）"""
+        now = ticks_ms() if now is None else now
+        boot, now_s = self._stamp(now)
+        for i in range(batch.count):
+            age_s = max(0, ticks_diff(now, batch.ticks[i])) // 1000
+            self.add_encoded(max(0, now_s - age_s), batch.temperature[i], batch.humidity[i], batch.light[i], boot)
+
+    def flush(self):
+        """把記憶體中的讀數寫入 flash（一次寫入，遇到檔尾時分成兩段）"""
+        if not self.pending_count:
+            return
+        view = memoryview(self.pending)
+        with open(self.path, "r+b") as f:
+            written = 0
+            while written < self.pending_count:
+                index = (self.head + written) % self.capacity
+                n = min(self.pending_count - written, self.capacity - index)
+                f.seek(index * SLOT_SIZE)
+                f.write(view[written * SLOT_SIZE:(written + n) * SLOT_SIZE])
+                written += n
+        self.head += self.pending_count
+        self.pending_count = 0
+
+    def fill(self, batch, now=None):
+        """
+        由舊到新取出讀數放進 SensorBatch，直到批次已滿或佇列已空
+
+        回傳取出的筆數（含檢查碼不符、無法得知時間而略過的槽），發送成功後以 commit() 確認
+        """
+        now = ticks_ms() if now is None else now
+        uptime_s = self._uptime(now)
+        wall_s = int(time.time()) if self.clock_synced else None
+        seq = self.oldest()
+        end = self.head + self.pending_count
+        f = None
+        try:
+            while seq < end and batch.count < batch.capacity:
+                if seq < self.head:
+                    if f is None:
+                        f = open(self.path, "rb")
+                    f.seek((seq % self.capacity) * SLOT_SIZE)
+                    f.readinto(self.slot)
+                    buffer, offset = self.slot, 0
+                else:
+                    buffer, offset = self.pending, (seq - self.head) * SLOT_SIZE
+                seq += 1
+                if self._slot_seq(buffer, offset) != seq - 1:
+                    continue
+                _, timestamp, temperature, humidity, light, boot = struct.unpack_from(SLOT_FORMAT, buffer, offset)
+                if boot == self.boot:
+                    age_s = uptime_s - timestamp
+                elif boot == WALL_CLOCK and wall_s is not None:
+                    age_s = wall_s - timestamp
+                else:
+                    # 時鐘同步前記錄、已經重新開機（或時鐘尚未同步）：無法換算時間，捨棄而不猜測
+                    self.discarded += 1
+                    continue
+                age_ms = _clamp(age_s * 1000, 0, MAX_AGE_MS)
+                batch.add_encoded(ticks_add(now, -age_ms), temperature, humidity, light)
+        finally:
+            if f is not None:
+                f.close()
+        return seq - self.oldest()
+
+    def commit(self, count):
+        """確認最舊的 count 筆已送出，寫入確認檔"""
+        self.acked = self.oldest() + count
+        if self.acked >= self.head + self.pending_count:
+            # 記憶體中的讀數全部送出，不需要再寫入 flash
+            self.head = self.acked
+            self.pending_count = 0
+        self.generation += 1
+        data = bytearray(ACK_SIZE)
+        struct.pack_into(ACK_FORMAT, data, 0, self.generation, self.acked)
+        data[-1] = _checksum(data, 0, ACK_SIZE - 1)
+        with open(self.ack_paths[self.generation & 1], "wb") as f:
+            f.write(data)
@@ -0,0 +1,39 @@
+# _link.py
+# 電腦端模擬：共用的 WiFi 連線狀態（network 與 umqtt.simple 都依此判斷能否連線）
+# 環境變數 PICO_SHIM_OUTAGE="開始秒數:結束秒數[,開始:結束...]" 可模擬斷線時段（以啟動時間起算），
+# 例如 PICO_SHIM_OUTAGE="30:90" 表示啟動後第 30 到 90 秒之間 WiFi 無法使用
+
+import os
+import time
+
+_started = time.monotonic()
+_forced = None
+
+
+def _parse_outages(text):
+    outages = []
+    for item in text.split(","):
+        if item.strip():
+            start, end = item.split(":")
+            outages.append((float(start), float(end)))
+    return outages
+
+
+OUTAGES = _parse_outages(os.environ.get("PICO_SHIM_OUTAGE", ""))
+
+
+def set_up(up):
+    """手動設定連線狀態（None 表示回到依 PICO_SHIM_OUTAGE 判斷）"""
+    global _forced
+    _forced = up
+
+
+def is_up():
+    """目前 WiFi 是否可用"""
+    if _forced is not None:
+        return _forced
+    elapsed = time.monotonic() - _started
+    for start, end in OUTAGES:
+        if start <= elapsed < end:
+            return False
+    return True
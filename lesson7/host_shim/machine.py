@@ -0,0 +1,119 @@
+# machine.py
+# 電腦端模擬 MicroPython 的 machine 模組：Pin / PWM 只記錄狀態，ADC 回傳帶雜訊的讀數，
+# Timer 以 threading.Timer 實作；Pin.irq() 的處理函式可用 Pin.trigger() 觸發
+
+import random
+import sys
+import threading
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, pin, mode=IN, pull=None, value=0):
+        self.pin = pin
+        self.mode = mode
+        self._value = value
+        self._handler = None
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING):
+        self._handler = handler
+
+    def trigger(self):
+        """模擬觸發中斷"""
+        if self._handler is not None:
+            self._handler(self)
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def toggle(self):
+        self._value ^= 1
+
+
+class ADC:
+    """讀數在固定的中心值附近加上雜訊，偶爾出現突波（ADC(4) 約為 25°C 的內建溫度感測器）"""
+
+    CORE_TEMP = 4
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.center = 14300 if pin == self.CORE_TEMP else 32768
+
+    def read_u16(self):
+        if random.random() < 0.01:
+            return random.randint(0, 65535)
+        return max(0, min(65535, self.center + random.randint(-400, 400)))
+
+
+class PWM:
+    def __init__(self, pin):
+        self.pin = pin
+        self._freq = 0
+        self._duty = 0
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return self._duty
+        self._duty = value
+
+    def deinit(self):
+        self._duty = 0
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, mode=PERIODIC, period=-1, callback=None):
+        self._timer = None
+        if callback is not None:
+            self.init(mode=mode, period=period, callback=callback)
+
+    def init(self, mode=PERIODIC, period=-1, callback=None, freq=-1):
+        self.deinit()
+        if freq > 0:
+            period = 1000 / freq
+
+        def fire():
+            callback(self)
+            if mode == Timer.PERIODIC and self._timer is not None:
+                self._start(period / 1000, fire)
+
+        self._start(period / 1000, fire)
+
+    def _start(self, seconds, func):
+        self._timer = threading.Timer(seconds, func)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def deinit(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+def unique_id():
+    return b"\xe6\x61\x38\x00\x00\x00\x00\x00"
+
+
+def reset():
+    sys.exit("machine.reset()")
@@ -0,0 +1,39 @@
+# network.py
+# 電腦端模擬 MicroPython 的 network 模組（只提供 wifi_connect.py 用到的部分）
+# 連線狀態由 _link 決定，可用 PICO_SHIM_OUTAGE 環境變數或 set_link() 模擬斷線
+
+import _link
+
+STA_IF = 0
+AP_IF = 1
+
+
+def set_link(up):
+    """模擬 WiFi 可用 / 斷線（None 表示回到依 PICO_SHIM_OUTAGE 判斷）"""
+    _link.set_up(up)
+
+
+class WLAN:
+    # 與 Pico 相同，每次 WLAN(STA_IF) 取得的是同一個介面的狀態
+    _interfaces = {}
+
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._state = self._interfaces.setdefault(interface, {"active": False, "ssid": None})
+
+    def active(self, value=None):
+        if value is None:
+            return self._state["active"]
+        self._state["active"] = bool(value)
+
+    def connect(self, ssid, password=None):
+        self._state["ssid"] = ssid
+
+    def disconnect(self):
+        self._state["ssid"] = None
+
+    def isconnected(self):
+        return self._state["active"] and self._state["ssid"] is not None and _link.is_up()
+
+    def ifconfig(self):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "8.8.8.8")
@@ -0,0 +1,13 @@
+# ntptime.py
+# 電腦端模擬 MicroPython 的 ntptime 模組：電腦的時鐘已經同步，settime() 不做任何事
+# WiFi 斷線時（見 _link）與 Pico 相同丟出 OSError
+
+import _link
+
+host = "pool.ntp.org"
+timeout = 1
+
+
+def settime():
+    if not _link.is_up():
+        raise OSError("NTP 逾時")
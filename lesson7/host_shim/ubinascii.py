@@ -0,0 +1,4 @@
+# ubinascii.py
+# 電腦端模擬：MicroPython 的 ubinascii 即 binascii
+
+from binascii import *  # noqa: F401,F403
@@ -0,0 +1,108 @@
+# umqtt/simple.py
+# 電腦端模擬 umqtt.simple.MQTTClient：不連線到 Broker，發布的訊息記錄在 published 並印出，
+# WiFi 斷線（見 _link）時 connect() / publish() 與真正的 Pico 一樣拋出 OSError
+# 收到的訊息：inject() 或環境變數 PICO_SHIM_MESSAGES="秒數:主題:內容[,秒數:主題:內容...]"
+# （以 connect() 的時間起算）；sock 是一個 socketpair，有訊息時可讀取，
+# 因此 pico_tasks.message_pump() 可以在電腦上等待 socket 而不輪詢
+
+import os
+import socket
+import threading
+
+import _link
+
+
+def _parse_messages(text):
+    messages = []
+    for item in text.split(","):
+        if item.strip():
+            delay, topic, msg = item.split(":", 2)
+            messages.append((float(delay), topic, msg))
+    return messages
+
+
+MESSAGES = _parse_messages(os.environ.get("PICO_SHIM_MESSAGES", ""))
+
+
+class MQTTException(Exception):
+    pass
+
+
+class MQTTClient:
+    def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0, ssl=False, ssl_params=None):
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.keepalive = keepalive
+        self.connected = False
+        self.published = []
+        self.cb = None
+        self.subscriptions = []
+        self.inbox = []
+        self.sock = None
+        self._peer = None
+        self._lock = threading.Lock()
+
+    def _check(self):
+        if not _link.is_up():
+            self.connected = False
+            raise OSError(113, "EHOSTUNREACH")
+        if not self.connected:
+            raise OSError(104, "ECONNRESET")
+
+    def connect(self, clean_session=True):
+        if not _link.is_up():
+            raise OSError(113, "EHOSTUNREACH")
+        if self.sock is None:
+            self.sock, self._peer = socket.socketpair()
+            for delay, topic, msg in MESSAGES:
+                timer = threading.Timer(delay, self.inject, (topic, msg))
+                timer.daemon = True
+                timer.start()
+        self.connected = True
+        return 0
+
+    def disconnect(self):
+        self.connected = False
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        self._check()
+        self.published.append((topic, bytes(msg) if not isinstance(msg, str) else msg))
+        print(f"[shim] publish {topic} ({len(msg)} bytes)")
+
+    def subscribe(self, topic, qos=0):
+        self._check()
+        self.subscriptions.append(topic)
+
+    def inject(self, topic, msg):
+        """模擬收到一則訊息（下一次 check_msg() 時交給 callback，可從其他執行緒呼叫）"""
+        topic = topic.encode() if isinstance(topic, str) else topic
+        msg = msg.encode() if isinstance(msg, str) else msg
+        with self._lock:
+            self.inbox.append((topic, msg))
+        if self._peer is not None:
+            self._peer.send(b"\x00")
+
+    def check_msg(self):
+        self._check()
+        self.sock.setblocking(False)
+        try:
+            self.sock.recv(1)
+        except BlockingIOError:
+            return None
+        finally:
+            self.sock.setblocking(True)
+        return self.wait_msg()
+
+    def wait_msg(self):
+        with self._lock:
+            message = self.inbox.pop(0) if self.inbox else None
+        if message is not None and self.cb is not None:
+            self.cb(*message)
+
+    def ping(self):
+        self._check()
+        print("[shim] ping")
@@ -2,9 +2,11 @@ import wifi_connect as wifi
 import time
 import json
 import random
-import json
-import random
+import ntptime
 from umqtt.simple import MQTTClient
+from sensor_packet import PacketEncoder, SensorBatch, ticks_diff, ticks_ms
+from flash_queue import FlashQueue
+from deadband import Deadband, REPORT, HEARTBEAT
 
 # MQTT 設定
 MQTT_BROKER = "10.218.58.186"  # 公開測試用 Broker
@@ -12,99 +14,229 @@ MQTT_PORT = 1883
 CLIENT_ID = "pico_w_publisher"
 TOPIC = "living_room/sensor"  # 改用英文主題避免編碼問題
 KEEPALIVE = 60  # 保持連線時間（秒）
-CLIENT_ID = "pico_w_publisher"
-TOPIC = "living_room/sensor"  # 改用英文主題避免編碼問題
-KEEPALIVE = 60  # 保持連線時間（秒）
 
-# 嘗試連線 WiFi
-wifi.connect()
+# 訊息格式："json"（約 70 bytes）或 "binary"（9 bytes，伺服器自動辨識，見 sensor_packet.py）
+PAYLOAD_FORMAT = "json"
 
-# 顯示 IP
-print("IP:", wifi.get_ip())
+# 讀取間隔（秒）
+READ_INTERVAL = 10
 
-# 建立 MQTT 客戶端（加入 keepalive 設定）
-client = MQTTClient(CLIENT_ID, MQTT_BROKER, port=MQTT_PORT, keepalive=KEEPALIVE)
+# 發送模式："interval"（每次讀取都發送）或 "deadband"（數值變化超過門檻才發送，見 deadband.py）
+# deadband 模式下超過 HEARTBEAT_INTERVAL 秒沒有發送時送出心跳，伺服器藉此分辨「沒有變化」與「離線」
+REPORT_MODE = "interval"
+DEADBAND_TEMPERATURE = 0.5  # °C
+DEADBAND_HUMIDITY = 2.0     # %
+HEARTBEAT_INTERVAL = 300    # 秒
+
+# 批次發送：累積 BATCH_SIZE 筆，或最舊一筆超過 BATCH_MAX_AGE 秒時一次發送
+# BATCH_SIZE = 1 表示每筆立即發送；例如 10 筆一批，WiFi 發送次數減為十分之一
+BATCH_SIZE = 1
+BATCH_MAX_AGE = 60
+
+# 離線暫存：無法發送的讀數存進 flash（見 flash_queue.py），約 15 bytes/筆
+QUEUE_PATH = "offline.dat"
+QUEUE_CAPACITY = 2000   # 最多保留筆數（每 10 秒一筆約 5.5 小時），已滿時覆蓋最舊的
+QUEUE_FLUSH_EVERY = 10  # 累積幾筆才寫入 flash 一次（減少寫入次數，斷電時最多遺失這麼多筆）
+
+# 恢復連線後的補送速率：每次迴圈最多 DRAIN_BATCHES 則、每則 DRAIN_BATCH_SIZE 筆，間隔 DRAIN_PAUSE 秒
+DRAIN_BATCH_SIZE = 50
+DRAIN_BATCHES = 3
+DRAIN_PAUSE = 0.2
+
+# 斷線時每隔 RECONNECT_INTERVAL 秒才嘗試重新連線一次（WiFi 每次最多等 WIFI_RETRY 秒）
+RECONNECT_INTERVAL = 60
+WIFI_RETRY = 5
 
-def mqtt_connect():
-    """連接 MQTT Broker"""
-    print("正在連接 MQTT Broker...")
-    client.connect()
-    print(f"已連接到 {MQTT_BROKER}")
 # 建立 MQTT 客戶端（加入 keepalive 設定）
 client = MQTTClient(CLIENT_ID, MQTT_BROKER, port=MQTT_PORT, keepalive=KEEPALIVE)
 
+# 二進位編碼器（重複使用同一個緩衝區）
+encoder = PacketEncoder()
+
+# 批次緩衝區（預先配置，BATCH_SIZE = 1 時不使用）
+batch = SensorBatch(BATCH_SIZE, BATCH_MAX_AGE * 1000) if BATCH_SIZE > 1 else None
+
+# deadband 判斷（REPORT_MODE = "interval" 時不使用）
+deadband = Deadband(DEADBAND_TEMPERATURE, DEADBAND_HUMIDITY, HEARTBEAT_INTERVAL * 1000) if REPORT_MODE == "deadband" else None
+
+# 離線佇列與補送用的批次緩衝區
+queue = FlashQueue(QUEUE_PATH, QUEUE_CAPACITY, QUEUE_FLUSH_EVERY)
+drain_batch = SensorBatch(DRAIN_BATCH_SIZE)
+
+# MQTT 是否已連線；上次嘗試連線的時間（ticks_ms，None 表示尚未嘗試）
+online = False
+last_attempt = None
+
 def mqtt_connect():
     """連接 MQTT Broker"""
     print("正在連接 MQTT Broker...")
     client.connect()
     print(f"已連接到 {MQTT_BROKER}")
 
-# 初始連線
-mqtt_connect()
+def connect_network():
+    """連線 WiFi 與 MQTT Broker；失敗時不結束程式，讀數改存進離線佇列"""
+    global online, last_attempt
+    last_attempt = ticks_ms()
+    try:
+        if not wifi.is_connected():
+            wifi.connect(retry=WIFI_RETRY)
+            print("IP:", wifi.get_ip())
+        sync_clock()
+        mqtt_connect()
+        if deadband is not None:
+            # 連線後先送出心跳，伺服器得知這個裝置的最長靜默時間
+            client.publish(TOPIC, build_heartbeat())
+        online = True
+    except (RuntimeError, OSError) as e:
+        print(f"網路無法使用，改為離線暫存: {e}")
+        online = False
+    return online
 
-# 初始連線
-mqtt_connect()
+def sync_clock():
+    """
+    以 NTP 設定 Pico 的時鐘（RTC），每次開機成功一次即可；失敗時下次連線再試
 
-# 每隔 10 秒發布一次訊息
-while True:
-    # 產生亂數資料
-    temperature = round(random.uniform(20.0, 35.0), 1)  # 溫度 20~35°C
-    humidity = round(random.uniform(40.0, 80.0), 1)     # 濕度 40~80%
-    light_status = random.choice(["on", "off"])         # 燈光狀態 (英文避免編碼問題)
-    
-    # 建立 JSON 資料
-    data = {
-        "temperature": temperature,
-        "humidity": humidity,
-        "light_status": light_status
-    }
-    message = json.dumps(data)
-    # 產生亂數資料
-    temperature = round(random.uniform(20.0, 35.0), 1)  # 溫度 20~35°C
-    humidity = round(random.uniform(40.0, 80.0), 1)     # 濕度 40~80%
-    light_status = random.choice(["on", "off"])         # 燈光狀態 (英文避免編碼問題)
-    
-    # 建立 JSON 資料
+    同步前離線佇列以開機後的秒數記錄讀數，重新開機後無法換算，補送時會捨棄
+    """
+    if queue.clock_synced:
+        return
+    try:
+        ntptime.settime()
+    except (OSError, OverflowError) as e:
+        print(f"時間同步失敗，稍後再試: {e}")
+        return
+    queue.clock_synced = True
+    print("已同步時間（UTC）:", time.gmtime())
+
+def network_ready():
+    """是否可以發送；斷線時每隔 RECONNECT_INTERVAL 秒重新連線一次"""
+    if online and wifi.is_connected():
+        return True
+    if last_attempt is not None and ticks_diff(ticks_ms(), last_attempt) < RECONNECT_INTERVAL * 1000:
+        return False
+    return connect_network()
+
+def build_message(temperature, humidity, light_status):
+    """依 PAYLOAD_FORMAT 建立要發送的訊息"""
+    if PAYLOAD_FORMAT == "binary":
+        return encoder.encode(temperature, humidity, light_status)
     data = {
         "temperature": temperature,
         "humidity": humidity,
         "light_status": light_status
     }
-    message = json.dumps(data)
-    
-    print("-" * 30)
-    
-    # 嘗試發布，如果失敗則重新連線
+    return json.dumps(data)
+
+def build_heartbeat():
+    """依 PAYLOAD_FORMAT 建立心跳訊息"""
+    if PAYLOAD_FORMAT == "binary":
+        return encoder.encode_heartbeat(HEARTBEAT_INTERVAL)
+    return json.dumps({"heartbeat": HEARTBEAT_INTERVAL})
+
+def build_batch_message():
+    """依 PAYLOAD_FORMAT 打包批次訊息"""
+    if PAYLOAD_FORMAT == "binary":
+        return batch.encode()
+    return batch.to_json()
+
+def publish(message):
+    """發布訊息，失敗時重新連線再試一次；回傳是否成功"""
+    global online
+    if not network_ready():
+        return False
     try:
         client.publish(TOPIC, message)
-        print("已發布訊息:")
-        print(f"  temperature: {temperature}")
-        print(f"  humidity: {humidity}")
-        print(f"  light_status: {light_status}")
-        print(f"Topic: {TOPIC}")
+        return True
     except OSError as e:
         print(f"發布失敗: {e}")
         print("嘗試重新連線...")
-        mqtt_connect()
-        # 重新連線後再發布一次
-        client.publish(TOPIC, message)
-        print("重新連線後發布成功!")
-    
-    # 嘗試發布，如果失敗則重新連線
     try:
-        client.publish(TOPIC, message)
-        print("已發布訊息:")
-        print(f"  temperature: {temperature}")
-        print(f"  humidity: {humidity}")
-        print(f"  light_status: {light_status}")
-        print(f"Topic: {TOPIC}")
-    except OSError as e:
-        print(f"發布失敗: {e}")
-        print("嘗試重新連線...")
         mqtt_connect()
-        # 重新連線後再發布一次
         client.publish(TOPIC, message)
         print("重新連線後發布成功!")
-    
-    print("等待 10 秒後再次發布...")
-    time.sleep(10)
\ No newline at end of file
+        return True
+    except OSError as e:
+        print(f"重新連線失敗: {e}")
+        online = False
+        return False
+
+def drain_queue():
+    """把離線佇列中的讀數以批次訊息補送，每次最多 DRAIN_BATCHES 則"""
+    for _ in range(DRAIN_BATCHES):
+        if not len(queue) or not network_ready():
+            return
+        count = queue.fill(drain_batch)
+        if not drain_batch.count:
+            # 取出的都是無法換算時間而捨棄的讀數
+            queue.commit(count)
+            continue
+        message = drain_batch.encode() if PAYLOAD_FORMAT == "binary" else drain_batch.to_json()
+        if not publish(message):
+            drain_batch.clear()
+            return
+        print(f"已補送離線讀數 {drain_batch.count} 筆（剩餘 {len(queue) - count} 筆）")
+        queue.commit(count)
+        drain_batch.clear()
+        time.sleep(DRAIN_PAUSE)
+
+# 初始連線（失敗時先離線暫存，稍後再試）
+connect_network()
+if len(queue):
+    print(f"離線佇列中有 {len(queue)} 筆讀數待補送")
+
+# 模擬的室內數據（每次小幅變動，偶爾開關燈）
+temperature = 26.0
+humidity = 60.0
+light_status = "off"
+
+# 每隔 READ_INTERVAL 秒讀取一次，依 BATCH_SIZE 立即或批次發布
+while True:
+    # 產生亂數資料
+    temperature = round(min(35.0, max(20.0, temperature + random.uniform(-0.1, 0.1))), 1)  # 溫度 20~35°C
+    humidity = round(min(80.0, max(40.0, humidity + random.uniform(-0.3, 0.3))), 1)        # 濕度 40~80%
+    if random.random() < 0.02:
+        light_status = "on" if light_status == "off" else "off"  # 燈光狀態 (英文避免編碼問題)
+
+    print("-" * 30)
+    print(f"讀數: temperature={temperature}, humidity={humidity}, light_status={light_status}")
+
+    # 先補送離線讀數，再處理這次的讀數：伺服器依時間順序收到數據
+    drain_queue()
+
+    decision = REPORT if deadband is None else deadband.check(temperature, humidity, light_status)
+    if decision == HEARTBEAT:
+        # 心跳不存進離線佇列：恢復連線時會補送讀數，伺服器看到的離線時段也是正確的
+        if publish(build_heartbeat()):
+            print(f"數值沒有變化，已發送心跳（發送比例 {deadband.sent_ratio():.0%}）")
+    elif decision != REPORT:
+        print(f"數值沒有變化，不發送（發送比例 {deadband.sent_ratio():.0%}）")
+    elif batch is None:
+        message = build_message(temperature, humidity, light_status)
+        # 佇列還有未補送的讀數時排在它們後面，不搶先發送
+        if not len(queue) and publish(message):
+            print(f"已發布訊息（{PAYLOAD_FORMAT}，{len(message)} bytes）")
+            print(f"Topic: {TOPIC}")
+        else:
+            queue.add(temperature, humidity, light_status)
+            print(f"已存入離線佇列（{len(queue)} 筆）")
+    elif batch.add(temperature, humidity, light_status):
+        message = build_batch_message()
+        if not len(queue) and publish(message):
+            print(f"已發布批次訊息（{PAYLOAD_FORMAT}，{batch.count} 筆，{len(message)} bytes）")
+            print(f"Topic: {TOPIC}")
+        else:
+            queue.add_batch(batch)
+            print(f"批次 {batch.count} 筆已存入離線佇列（{len(queue)} 筆）")
+        batch.clear()
+    else:
+        print(f"已加入批次（{batch.count}/{BATCH_SIZE}）")
+
+    if queue.dropped:
+        print(f"離線佇列已滿，已捨棄最舊的 {queue.dropped} 筆")
+        queue.dropped = 0
+    if queue.discarded:
+        print(f"已捨棄 {queue.discarded} 筆時鐘同步前記錄、重新開機後無法換算時間的讀數")
+        queue.discarded = 0
+
+    print(f"等待 {READ_INTERVAL} 秒後再次讀取...")
+    time.sleep(READ_INTERVAL)
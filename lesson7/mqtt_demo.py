@@ -2,11 +2,11 @@
 # 適用：Raspberry Pi Pico W (MicroPython)
 # 需確認已安裝 umqtt.simple (通常透過 Thonny 的套件管理搜尋 micropython-umqtt.simple 安裝)
 
-import time
 from umqtt.simple import MQTTClient
 import wifi_connect
 import ubinascii
 import machine
+import pico_tasks
 
 # -------------------------------
 # MQTT 設定
@@ -32,29 +32,40 @@ TWINKLE_RHYTHM = [
     (0, 0.5), (1, 0.5), (0, 0.5), (1, 0.5), (0, 0.5), (1, 0.5), (0, 0.5), (1, 1.0)  # 滿天都是小星星
 ]
 
-is_playing = False
-current_note_index = 0
-note_start_time = 0
 led_pin = machine.Pin("LED", machine.Pin.OUT)
 
+# 發送間隔（毫秒）
+PUBLISH_INTERVAL = 10000
+
+# LED 燈號（收到 "on" 開始播放，"off" 停止）
+twinkle = pico_tasks.LedPattern(led_pin, TWINKLE_RHYTHM)
+counter = 0
+
 # -------------------------------
 # 接收訊息的回調函式
 # -------------------------------
 def sub_cb(topic, msg):
     print(f"\n收到訊息 -> 主題: {topic.decode()}, 內容: {msg.decode()}")
-    
+
     # 範例：收到 "on" 開燈 (啟動一閃一閃亮晶晶模式)
     if msg == b"on":
-        global is_playing
-        is_playing = True
+        twinkle.start()
         print("🎵 啟動音樂燈光模式: 一閃一閃亮晶晶")
-        
+
     elif msg == b"off":
-        global is_playing
-        is_playing = False
-        machine.Pin("LED", machine.Pin.OUT).off()
+        twinkle.stop()
         print("LED 已關閉")
 
+# -------------------------------
+# 定期發送的訊息
+# -------------------------------
+def build_message():
+    global counter
+    msg = f"Data #{counter} from Pico"
+    print(f"[{counter}] 已發送: {msg}")
+    counter += 1
+    return msg
+
 # -------------------------------
 # 主程式
 # -------------------------------
@@ -66,85 +77,40 @@ def main():
         return
 
     print(f"正在連接 MQTT Broker ({MQTT_BROKER})...")
-    
+
     try:
         # 2. 初始化 MQTT Client
         client = MQTTClient(
-            CLIENT_ID, 
-            MQTT_BROKER, 
-            port=MQTT_PORT, 
-            user=MQTT_USER, 
+            CLIENT_ID,
+            MQTT_BROKER,
+            port=MQTT_PORT,
+            user=MQTT_USER,
             password=MQTT_PASSWORD,
             keepalive=60
         )
-        
+
         # 設定回調函式 (收到訊息時會執行)
         client.set_callback(sub_cb)
-        
+
         # 建立連線
         client.connect()
         print("✅ MQTT 連線成功!")
-        
+
         # 3. 訂閱主題
         client.subscribe(TOPIC_SUB)
         print(f"已訂閱主題: {TOPIC_SUB.decode()}")
-        
-        # 4. 主迴圈
-    top_is_playing = False
-    top_current_note_index = 0
-    top_note_start_time = 0
-
-    # 4. 主迴圈
-    last_pub = time.ticks_ms()
-    counter = 0
-
-    while True:
-        # 保持監聽 (每圈都要執行)
-        client.check_msg()
-
-        # 檢查時間是否超過 10 秒 (10000 ms)
-        now = time.ticks_ms()
-        if time.ticks_diff(now, last_pub) >= 10000:
-            msg = f"Data #{counter} from Pico"
-            client.publish(TOPIC_PUB, msg)
-            print(f"[{counter}] 已發送: {msg}")
-
-            counter += 1
-            last_pub = now
-
-        # --- 處理 LED 音樂燈光 (非阻塞) ---
-        # 為了避免與函數內的變數混淆，我們直接使用 global 的變數狀態
-        # 注意：Python 中如果在函數內對全域變數賦值，需要宣告 global
-        # 但如果是讀取則不需要，不過為了保險起見，我們統一處理
-        
-        global is_playing, current_note_index, note_start_time
-
-        if is_playing:
-            # 取得目前音符 (狀態, 持續時間)
-            state, duration = TWINKLE_RHYTHM[current_note_index]
-
-            # 設定 LED 狀態
-            if state:
-                led_pin.on()
-            else:
-                led_pin.off()
-
-            # 檢查這個音符是否播放完畢
-            # duration 是秒，轉成 ms
-            if time.ticks_diff(now, note_start_time) >= duration * 1000:
-                current_note_index += 1
-                note_start_time = now
-
-                # 如果播完整首，重頭開始
-                if current_note_index >= len(TWINKLE_RHYTHM):
-                    current_note_index = 0
-        else:
-             # 確保停止時燈是滅的
-             pass
-
-        # 短暫休息避免 CPU 滿載，但不要睡太久以免錯過訊息
-        time.sleep(0.01) 
-            
+
+        # 4. 同時執行三個工作（見 pico_tasks.py）：
+        #    每個工作都睡到自己的下一個時間點，不需要 time.sleep(0.01) 的忙碌迴圈
+        #    - 每 10 秒發送一次數據
+        #    - socket 有資料時才處理收到的訊息
+        #    - 依節奏播放 LED（停止時不佔用 CPU）
+        pico_tasks.run(
+            pico_tasks.publisher(client, TOPIC_PUB, PUBLISH_INTERVAL, build_message),
+            pico_tasks.message_pump(client),
+            twinkle.run()
+        )
+
     except OSError as e:
         print(f"❌ MQTT 連線或傳輸錯誤: {e}")
         if e.args[0] == 103 or e.args[0] == 113:
@@ -0,0 +1,214 @@
+# pico_tasks.py
+# 適用：Raspberry Pi Pico W (MicroPython，使用內建的 uasyncio)
+# 以協作式工作（task）取代「while True + time.sleep(0.01) + 自己記錄 ticks」的主迴圈：
+# 每個工作都睡到下一個截止時間才醒來，沒事做時 CPU 可以閒置，收到 MQTT 訊息時也能立即處理
+# 提供的工作：
+#   publisher()     - 固定週期發布訊息（以截止時間排程，不會因處理時間而漂移）
+#   message_pump()  - 等到 MQTT socket 有資料才呼叫 check_msg()
+#   keepalive()     - 定期送出 PINGREQ，只訂閱不發布時維持連線
+#   LedPattern      - 依節奏表播放 LED 燈號，停止時不佔用 CPU
+#   sampler()       - 固定週期讀取感測器，可由 gate（Event）暫停
+# 在電腦上可搭配 host_shim/ 以 CPython 的 asyncio 執行（見 README）
+
+try:
+    import uasyncio as asyncio
+    from uasyncio import core as _core
+except ImportError:
+    # CPython（搭配 host_shim 在電腦上測試）
+    import asyncio
+    _core = None
+
+try:
+    from time import ticks_ms, ticks_diff, ticks_add
+except ImportError:
+    import time as _time
+
+    def ticks_ms():
+        return int(_time.monotonic() * 1000) & 0x3FFFFFFF
+
+    def ticks_diff(a, b):
+        return ((a - b + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+
+    def ticks_add(a, delta):
+        return (a + delta) & 0x3FFFFFFF
+
+
+def sleep_ms(ms):
+    """非同步等待 ms 毫秒"""
+    if hasattr(asyncio, "sleep_ms"):
+        return asyncio.sleep_ms(ms)
+    return asyncio.sleep(ms / 1000)
+
+
+async def sleep_until(deadline):
+    """睡到 deadline（ticks_ms）為止，已經超過時立即返回"""
+    remaining = ticks_diff(deadline, ticks_ms())
+    if remaining > 0:
+        await sleep_ms(remaining)
+
+
+def next_deadline(deadline, interval_ms):
+    """下一個截止時間；落後超過一個週期時（例如處理太久）從現在重新起算，不補跑"""
+    deadline = ticks_add(deadline, interval_ms)
+    now = ticks_ms()
+    if ticks_diff(now, deadline) > interval_ms:
+        return now
+    return deadline
+
+
+async def every(interval_ms, func, *args):
+    """每 interval_ms 毫秒呼叫一次 func(*args)"""
+    deadline = ticks_ms()
+    while True:
+        func(*args)
+        deadline = next_deadline(deadline, interval_ms)
+        await sleep_until(deadline)
+
+
+async def publisher(client, topic, interval_ms, build_message):
+    """
+    固定週期發布訊息
+
+    Args:
+        client: umqtt.simple.MQTTClient
+        topic: 發布的主題
+        interval_ms: 週期（毫秒）
+        build_message: 無參數的函式，回傳要發布的訊息（回傳 None 表示這一次不發布）
+    """
+    def publish():
+        message = build_message()
+        if message is not None:
+            client.publish(topic, message)
+
+    await every(interval_ms, publish)
+
+
+class _Readable:
+    """MicroPython：把 socket 加入 uasyncio 的 I/O 等待佇列，可讀取時才繼續"""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def __iter__(self):
+        yield _core._io_queue.queue_read(self.sock)
+
+    __await__ = __iter__
+
+
+async def wait_readable(sock):
+    """等到 socket 有資料可讀（不輪詢）"""
+    if _core is not None:
+        await _Readable(sock)
+        return
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+
+    def on_readable():
+        if not ready.done():
+            ready.set_result(None)
+
+    loop.add_reader(sock, on_readable)
+    try:
+        await ready
+    finally:
+        loop.remove_reader(sock)
+
+
+async def message_pump(client):
+    """MQTT socket 有資料時才呼叫 check_msg()，收到的訊息交給 set_callback() 設定的函式"""
+    while True:
+        await wait_readable(client.sock)
+        client.check_msg()
+
+
+async def keepalive(client, interval_ms):
+    """每 interval_ms 毫秒送出一次 PINGREQ（應小於連線時設定的 keepalive）"""
+    await every(interval_ms, client.ping)
+
+
+class LedPattern:
+    """
+    依節奏表播放 LED 燈號
+
+    pattern 為 (狀態, 秒數) 的串列，播完從頭開始；
+    stop() 後工作會等待 start()，不佔用 CPU。
+    """
+
+    def __init__(self, pin, pattern):
+        self.pin = pin
+        self.pattern = pattern
+        self.playing = False
+        self._changed = asyncio.Event()
+
+    def start(self):
+        self.playing = True
+        self._changed.set()
+
+    def stop(self):
+        self.playing = False
+        self.pin.off()
+        self._changed.set()
+
+    async def run(self):
+        while True:
+            if not self.playing:
+                self._changed.clear()
+                await self._changed.wait()
+                continue
+            deadline = ticks_ms()
+            for state, duration in self.pattern:
+                if not self.playing:
+                    break
+                self.pin.value(state)
+                deadline = ticks_add(deadline, int(duration * 1000))
+                await sleep_until(deadline)
+
+
+async def sampler(read, interval_ms, handle, gate=None):
+    """
+    每 interval_ms 毫秒讀取一次感測器並交給 handle(value)
+
+    gate 為 asyncio.Event 時，只有 gate 設定時才讀取；清除後工作會等待，不佔用 CPU
+    """
+    deadline = ticks_ms()
+    while True:
+        if gate is not None and not gate.is_set():
+            await gate.wait()
+            deadline = ticks_ms()
+        handle(read())
+        deadline = next_deadline(deadline, interval_ms)
+        await sleep_until(deadline)
+
+
+class Flag:
+    """
+    可以在中斷處理函式（IRQ）中設定的旗標
+
+    MicroPython 使用 ThreadSafeFlag；CPython 以 call_soon_threadsafe 轉交給事件迴圈
+    """
+
+    def __init__(self):
+        self._threadsafe = hasattr(asyncio, "ThreadSafeFlag")
+        self._flag = asyncio.ThreadSafeFlag() if self._threadsafe else asyncio.Event()
+        self._loop = None
+
+    def set(self):
+        if self._loop is None:
+            self._flag.set()
+        else:
+            self._loop.call_soon_threadsafe(self._flag.set)
+
+    async def wait(self):
+        if not self._threadsafe:
+            self._loop = asyncio.get_running_loop()
+        await self._flag.wait()
+        if not self._threadsafe:
+            self._flag.clear()
+
+
+def run(*coros):
+    """同時執行多個工作，直到其中一個結束或發生例外"""
+    async def main():
+        await asyncio.gather(*coros)
+
+    asyncio.run(main())
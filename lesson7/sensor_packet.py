@@ -0,0 +1,200 @@
+# sensor_packet.py
+# 適用：Raspberry Pi Pico W (MicroPython)
+# 把一筆感測器讀數打包成 9 bytes 的二進位訊息（取代約 70 bytes 的 JSON），
+# 或把多筆讀數累積在預先配置的陣列中，一次發送（SensorBatch）
+# 格式須與伺服器端 lesson6/sensor_codec.py 一致（little-endian）：
+#   單筆（版本 1）：magic(B) version(B) seq(H) 溫度×100(h) 濕度×100(H) 電燈(b)
+#   批次（版本 2）：magic(B) version(B) seq(H) 筆數(B)，
+#                  接著每筆 距離發送的毫秒數(I) 溫度×100(h) 濕度×100(H) 電燈(b)
+#   心跳（版本 3）：magic(B) version(B) seq(H) 最長靜默秒數(H)
+
+from array import array
+import json
+import struct
+
+try:
+    from time import ticks_ms, ticks_diff, ticks_add
+except ImportError:
+    # CPython（在電腦上測試編碼格式時使用）
+    import time as _time
+
+    def ticks_ms():
+        return int(_time.monotonic() * 1000) & 0x3FFFFFFF
+
+    def ticks_diff(a, b):
+        return ((a - b + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+
+    def ticks_add(a, delta):
+        return (a + delta) & 0x3FFFFFFF
+
+MAGIC = 0xA7
+VERSION = 1
+FORMAT = "<BBHhHb"
+SIZE = struct.calcsize(FORMAT)
+
+BATCH_VERSION = 2
+BATCH_HEADER = "<BBHB"
+BATCH_HEADER_SIZE = struct.calcsize(BATCH_HEADER)
+BATCH_READING = "<IhHb"
+BATCH_READING_SIZE = struct.calcsize(BATCH_READING)
+BATCH_MAX_COUNT = 255
+
+HEARTBEAT_VERSION = 3
+HEARTBEAT_FORMAT = "<BBHH"
+HEARTBEAT_SIZE = struct.calcsize(HEARTBEAT_FORMAT)
+
+# 電燈狀態代碼（無法辨識時為 -1）
+LIGHT_CODES = {"on": 1, "off": 0}
+LIGHT_NAMES = {1: "on", 0: "off"}
+
+
+def _clamp(value, low, high):
+    return low if value < low else high if value > high else value
+
+
+def _centi(value):
+    """轉換為 ×100 的 int16"""
+    return _clamp(int(round(value * 100)), -32768, 32767)
+
+
+class PacketEncoder:
+    """
+    二進位訊息編碼器
+
+    重複使用同一個 bytearray，每次發送不會配置新的 dict 或字串；
+    序號每次加 1（0-65535 循環），伺服器可以用來找出遺失的訊息。
+    """
+
+    def __init__(self):
+        self.seq = 0
+        self.buffer = bytearray(SIZE)
+        self.heartbeat_buffer = bytearray(HEARTBEAT_SIZE)
+
+    def encode(self, temperature, humidity, light_status):
+        """
+        打包一筆讀數
+
+        回傳的是內部的 bytearray，下一次 encode() 會覆寫內容，
+        須在發送後才呼叫下一次 encode()
+        """
+        struct.pack_into(
+            FORMAT, self.buffer, 0,
+            MAGIC,
+            VERSION,
+            self.seq,
+            _centi(temperature),
+            _clamp(int(round(humidity * 100)), 0, 65535),
+            LIGHT_CODES.get(light_status, -1)
+        )
+        self.seq = (self.seq + 1) & 0xFFFF
+        return self.buffer
+
+    def encode_heartbeat(self, interval_s):
+        """打包心跳訊息（6 bytes），interval_s 為最長靜默秒數"""
+        struct.pack_into(
+            HEARTBEAT_FORMAT, self.heartbeat_buffer, 0,
+            MAGIC,
+            HEARTBEAT_VERSION,
+            self.seq,
+            _clamp(int(interval_s), 0, 65535)
+        )
+        self.seq = (self.seq + 1) & 0xFFFF
+        return self.heartbeat_buffer
+
+
+class SensorBatch:
+    """
+    批次累積讀數，筆數達到 capacity 或最舊一筆超過 max_age_ms 時發送
+
+    讀數存放在建立時配置好的陣列中（時間為 ticks_ms()），
+    發送時換算成「距離發送的毫秒數」，伺服器以收到訊息的時間往回推算每筆的時間，
+    Pico 不需要同步時鐘。發送失敗時保留數據，已滿時覆蓋最舊的一筆。
+    """
+
+    def __init__(self, capacity=10, max_age_ms=60000):
+        if not 0 < capacity <= BATCH_MAX_COUNT:
+            raise ValueError("capacity 必須介於 1 到 255")
+        self.capacity = capacity
+        self.max_age_ms = max_age_ms
+        self.count = 0
+        self.seq = 0
+        self.ticks = array("i", [0] * capacity)
+        self.temperature = array("h", [0] * capacity)
+        self.humidity = array("H", [0] * capacity)
+        self.light = array("b", [0] * capacity)
+        self.buffer = bytearray(BATCH_HEADER_SIZE + capacity * BATCH_READING_SIZE)
+
+    def add(self, temperature, humidity, light_status, now=None):
+        """
+        加入一筆讀數
+
+        回傳 True 表示應該發送（已滿或最舊一筆已超過 max_age_ms）
+        """
+        now = ticks_ms() if now is None else now
+        self.add_encoded(
+            now,
+            _centi(temperature),
+            _clamp(int(round(humidity * 100)), 0, 65535),
+            LIGHT_CODES.get(light_status, -1)
+        )
+        return self.ready(now)
+
+    def add_encoded(self, ticks, temperature, humidity, light):
+        """加入一筆已編碼的讀數（溫度、濕度為 ×100 的整數，電燈為代碼）"""
+        if self.count == self.capacity:
+            # 已滿（先前發送失敗）：捨棄最舊的一筆
+            for column in (self.ticks, self.temperature, self.humidity, self.light):
+                for j in range(self.capacity - 1):
+                    column[j] = column[j + 1]
+            self.count -= 1
+        i = self.count
+        self.ticks[i] = ticks
+        self.temperature[i] = temperature
+        self.humidity[i] = humidity
+        self.light[i] = light
+        self.count += 1
+
+    def ready(self, now=None):
+        """是否應該發送"""
+        if self.count == 0:
+            return False
+        if self.count >= self.capacity:
+            return True
+        now = ticks_ms() if now is None else now
+        return ticks_diff(now, self.ticks[0]) >= self.max_age_ms
+
+    def encode(self, now=None):
+        """
+        打包成二進位批次訊息
+
+        回傳內部緩衝區的 memoryview（不會配置新的 bytes），發送成功後再呼叫 clear()
+        """
+        now = ticks_ms() if now is None else now
+        struct.pack_into(BATCH_HEADER, self.buffer, 0, MAGIC, BATCH_VERSION, self.seq, self.count)
+        offset = BATCH_HEADER_SIZE
+        for i in range(self.count):
+            struct.pack_into(
+                BATCH_READING, self.buffer, offset,
+                max(0, ticks_diff(now, self.ticks[i])),
+                self.temperature[i],
+                self.humidity[i],
+                self.light[i]
+            )
+            offset += BATCH_READING_SIZE
+        return memoryview(self.buffer)[:offset]
+
+    def to_json(self, now=None):
+        """打包成 JSON 批次訊息（各欄位為陣列，age_ms 為距離發送的毫秒數）"""
+        now = ticks_ms() if now is None else now
+        n = self.count
+        return json.dumps({
+            "age_ms": [max(0, ticks_diff(now, self.ticks[i])) for i in range(n)],
+            "temperature": [self.temperature[i] / 100 for i in range(n)],
+            "humidity": [self.humidity[i] / 100 for i in range(n)],
+            "light_status": [LIGHT_NAMES.get(self.light[i], "unknown") for i in range(n)],
+        })
+
+    def clear(self):
+        """清除已發送的讀數"""
+        self.count = 0
+        self.seq = (self.seq + 1) & 0xFFFF
@@ -0,0 +1,172 @@
+# adc_sampler.py
+# 適用：Raspberry Pi Pico W (MicroPython)
+# 過取樣的 ADC 讀取：每次連續讀取 burst 次存進預先配置的 array('H')，
+# 再以整數運算濾波（平均 + 移動平均、中位數、EMA），不會每個樣本都配置 float 或新的物件
+# 另外累計每個發送週期的 最小 / 最大 / 標準差，發送摘要取代逐筆原始數據，減少雜訊與訊息量
+#
+# 使用方式：
+#     sampler = ADCSampler(ADC(4), burst=32, filter="median")
+#     value = sampler.read()      # 平滑後的 0-65535 讀數
+#     info = sampler.summary()    # 本週期的 value / mean / min / max / stddev / count，並重新累計
+
+from array import array
+import math
+
+try:
+    import micropython
+    native = micropython.native
+except (ImportError, AttributeError):
+    # CPython（搭配 lesson7/host_shim 在電腦上測試）
+    def native(func):
+        return func
+
+FILTERS = ("mean", "median", "ema")
+
+# ADC 參考電壓（毫伏）；RP2040 內建溫度感測器在 27°C 時為 706 mV，每度 -1.721 mV
+VREF_MV = 3300
+TEMP_SENSOR_MV_27C = 706
+TEMP_SENSOR_UV_PER_C = 1721
+
+
+def raw_to_millivolts(raw):
+    """read_u16() 的值轉換為毫伏（整數）"""
+    return raw * VREF_MV // 65535
+
+
+def raw_to_percent(raw):
+    """read_u16() 的值轉換為百分比（整數）"""
+    return raw * 100 // 65535
+
+
+def raw_to_celsius(raw):
+    """內建溫度感測器（ADC(4)）的讀數轉換為攝氏溫度"""
+    microvolts = raw * VREF_MV * 1000 // 65535
+    return 27 - (microvolts - TEMP_SENSOR_MV_27C * 1000) / TEMP_SENSOR_UV_PER_C
+
+
+class ADCSampler:
+    """
+    過取樣 + 整數濾波的 ADC 取樣器
+
+    filter：
+        "mean"   - 每次 burst 取平均，再對最近 window 次做移動平均
+        "median" - 每次 burst 取中位數（去除突波）
+        "ema"    - 每次 burst 取平均，再做指數移動平均（alpha = 1 / 2**ema_shift）
+    統計以 12 位元（>> 4）與週期第一筆的差值累計，數值維持在 small int 範圍，
+    只有讀數在一個週期內大幅擺動時才會用到大整數。
+    """
+
+    def __init__(self, adc, burst=16, filter="mean", window=8, ema_shift=3):
+        if filter not in FILTERS:
+            raise ValueError("filter 必須是 mean、median 或 ema")
+        if not 0 < burst <= 256 or window < 1:
+            raise ValueError("burst 必須介於 1 到 256，window 必須大於 0")
+        self.adc = adc
+        self.burst = burst
+        self.filter = filter
+        self.ema_shift = ema_shift
+        self.samples = array("H", [0] * burst)
+        self.window = array("H", [0] * window)
+        self.window_size = window
+        self.window_index = 0
+        self.window_count = 0
+        self.window_sum = 0
+        self.ema = -1
+        self.value = 0
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.count = 0
+        self.low = 65535
+        self.high = 0
+        self.origin = 0
+        self.delta_sum = 0
+        self.delta_sq_sum = 0
+
+    @native
+    def _read_burst(self):
+        """連續讀取 burst 次，回傳總和"""
+        read = self.adc.read_u16
+        samples = self.samples
+        total = 0
+        for i in range(self.burst):
+            value = read()
+            samples[i] = value
+            total += value
+        return total
+
+    def _median(self):
+        """burst 樣本的中位數（就地插入排序，不配置新串列）"""
+        samples = self.samples
+        for i in range(1, self.burst):
+            value = samples[i]
+            j = i - 1
+            while j >= 0 and samples[j] > value:
+                samples[j + 1] = samples[j]
+                j -= 1
+            samples[j + 1] = value
+        return samples[self.burst >> 1]
+
+    def read(self):
+        """讀取一次 burst，回傳濾波後的讀數（0-65535），並計入本週期的統計"""
+        total = self._read_burst()
+        if self.filter == "median":
+            value = self._median()
+        elif self.filter == "ema":
+            mean = total // self.burst
+            if self.ema < 0:
+                self.ema = mean << self.ema_shift
+            else:
+                # 以 2**ema_shift 倍的定點數保存，避免整數除法的誤差累積
+                self.ema += mean - (self.ema >> self.ema_shift)
+            value = self.ema >> self.ema_shift
+        else:
+            mean = total // self.burst
+            i = self.window_index
+            if self.window_count == self.window_size:
+                self.window_sum -= self.window[i]
+            else:
+                self.window_count += 1
+            self.window[i] = mean
+            self.window_sum += mean
+            self.window_index = (i + 1) % self.window_size
+            value = self.window_sum // self.window_count
+        self.value = value
+        self._accumulate(value)
+        return value
+
+    def _accumulate(self, value):
+        if value < self.low:
+            self.low = value
+        if value > self.high:
+            self.high = value
+        if self.count == 0:
+            self.origin = value >> 4
+        delta = (value >> 4) - self.origin
+        self.delta_sum += delta
+        self.delta_sq_sum += delta * delta
+        self.count += 1
+
+    def summary(self):
+        """
+        本週期的摘要，並重新開始累計
+
+        Returns:
+            {'value': 最後一次的平滑讀數, 'mean', 'min', 'max', 'stddev'（read_u16 單位）,
+             'count': 讀取次數}
+            尚未讀取時為 None
+        """
+        if self.count == 0:
+            return None
+        n = self.count
+        variance = (self.delta_sq_sum - self.delta_sum * self.delta_sum / n) / n
+        result = {
+            "value": self.value,
+            "mean": (self.origin * n + self.delta_sum) * 16 // n,
+            "min": self.low,
+            "max": self.high,
+            "stddev": math.sqrt(max(0, variance)) * 16,
+            "count": n,
+        }
+        self._reset_stats()
+        return result
@@ -1,22 +1,27 @@
 from machine import ADC, Pin,PWM
 from time import sleep
+from adc_sampler import ADCSampler, raw_to_millivolts, raw_to_percent
 
 # 初始化 ADC（使用 GPIO 26）
 potentiometer = ADC(Pin(28))
+
+# 每次連續讀取 16 次取平均，再對最近 8 次做移動平均（整數運算，不會每個樣本配置 float）
+sampler = ADCSampler(potentiometer, burst=16, filter="mean", window=8)
+
 led = PWM(Pin(15))
 led.freq(1000)  # 設定 PWM 頻率為 1000Hz
 
 while True:
-    # 讀取 ADC 值（0 ~ 65535）
-    raw_value = potentiometer.read_u16()
+    # 讀取平滑後的 ADC 值（0 ~ 65535）
+    raw_value = sampler.read()
     
-    # 轉換為電壓值（0 ~ 3.3V）
-    voltage = raw_value * 3.3 / 65535
+    # 轉換為電壓值（0 ~ 3300 mV）
+    millivolts = raw_to_millivolts(raw_value)
     
     # 轉換為百分比（0% ~ 100%）
-    percentage = raw_value * 100 / 65535
+    percentage = raw_to_percent(raw_value)
     
-    print(f"原始值: {raw_value}, 電壓: {voltage:.2f}V, 百分比: {percentage:.1f}%")
+    print(f"原始值: {raw_value}, 電壓: {millivolts / 1000:.2f}V, 百分比: {percentage}%")
     
     led.duty_u16(raw_value)
     
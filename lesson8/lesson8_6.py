@@ -1,5 +1,6 @@
 from machine import Pin, ADC, PWM
-import time
+import pico_tasks  # 需一併上傳 lesson7/pico_tasks.py
+from adc_sampler import ADCSampler
 
 # --- 硬體初始化 ---
 # 可變電阻，連接到 GP26
@@ -12,37 +13,51 @@ led_pwm.freq(1000)  # 設定 PWM 頻率為 1000Hz
 # 按鈕，連接到 GP14，使用內部上拉電阻
 button = Pin(14, Pin.IN, Pin.PULL_UP)
 
+# 讀取可變電阻的間隔（毫秒）
+SAMPLE_INTERVAL = 20
+
+# 每次連續讀取 8 次取平均，再做指數移動平均，旋鈕的雜訊不會讓 LED 閃爍
+sampler = ADCSampler(potentiometer, burst=8, filter="ema", ema_shift=2)
+
 # --- 狀態與中斷防彈跳變數 ---
-led_is_on = False  # LED 的開關狀態
+led_is_on = pico_tasks.asyncio.Event()  # LED 的開關狀態（設定時才讀取可變電阻）
+button_pressed = pico_tasks.Flag()  # 由中斷設定，交給 button_task 處理
 last_interrupt_time = 0  # 上次中斷觸發時間
 
 # --- 中斷處理函式 (ISR) ---
 def button_irq_handler(pin):
-    """當中斷觸發時，切換 LED 的開關狀態"""
-    global led_is_on, last_interrupt_time
-    current_time = time.ticks_ms()
+    """中斷中只記錄按下，狀態切換交給 button_task"""
+    global last_interrupt_time
+    current_time = pico_tasks.ticks_ms()
 
     # 軟體防彈跳：與上次觸發時間間隔需大於 200ms
-    if time.ticks_diff(current_time, last_interrupt_time) > 200:
+    if pico_tasks.ticks_diff(current_time, last_interrupt_time) > 200:
         last_interrupt_time = current_time
-        led_is_on = not led_is_on  # 反轉開關狀態
-        print(f"IRQ: LED toggled to {'ON' if led_is_on else 'OFF'}")
+        button_pressed.set()
+
+# --- 工作 ---
+async def button_task():
+    """等待按鈕中斷，切換 LED 的開關狀態"""
+    while True:
+        await button_pressed.wait()
+        if led_is_on.is_set():
+            led_is_on.clear()
+            # 關閉時亮度設為 0，sampler 會停在 led_is_on.wait()，不再讀取可變電阻
+            led_pwm.duty_u16(0)
+        else:
+            led_is_on.set()
+        print(f"IRQ: LED toggled to {'ON' if led_is_on.is_set() else 'OFF'}")
 
 # --- 註冊中斷 ---
 # 設定按鈕在下降邊緣 (按下瞬間) 觸發中斷
 button.irq(trigger=Pin.IRQ_FALLING, handler=button_irq_handler)
 
 print("可調光開關已啟動 (中斷模式)...")
-
-# --- 主迴圈 ---
-while True:
-    if led_is_on:
-        # 如果 LED 是開啟狀態，則讀取可變電阻並設定亮度
-        brightness = potentiometer.read_u16()
-        led_pwm.duty_u16(brightness)
-    else:
-        # 如果 LED 是關閉狀態，則將亮度設為 0
-        led_pwm.duty_u16(0)
-
-    # 短暫延遲以降低 CPU 負載
-    time.sleep_ms(20)
\ No newline at end of file
+led_pwm.duty_u16(0)
+
+# --- 主程式 ---
+# LED 開啟時每 SAMPLE_INTERVAL 毫秒讀取可變電阻並設定亮度；關閉時兩個工作都在等待，CPU 閒置
+pico_tasks.run(
+    button_task(),
+    pico_tasks.sampler(sampler.read, SAMPLE_INTERVAL, led_pwm.duty_u16, gate=led_is_on)
+)
@@ -1,5 +1,6 @@
 from machine import ADC, Pin
 import time
+from adc_sampler import ADCSampler
 
 # 溫度感測器連接到 ADC 4，但在 MicroPython 中，我們通常直接使用 4 作為 Pin 腳位編號
 # 或者使用特定於 Pico SDK 的方式來初始化
@@ -10,11 +11,14 @@ sensor_temp = ADC(4)
 # Pico 的 ADC 是 12 bit，最大值為 2^12 - 1 = 4095
 conversion_factor = 3.3 / (65535) # 由於 MicroPython 預設讀取 16 位元 (0-65535)，所以使用 65535
 
-def read_temperature():
-    """讀取並轉換 RP2040 晶片內建溫度感測器的值"""
-    
-    # 讀取 ADC 的原始 16 位元值 (0-65535)
-    reading = sensor_temp.read_u16() 
+# 過取樣：每 SAMPLE_INTERVAL 秒連續讀取 32 次取中位數（去除突波），
+# 每 REPORT_INTERVAL 秒印出一次摘要（平均 / 最低 / 最高 / 標準差），取代逐筆的原始讀數
+SAMPLE_INTERVAL = 0.2
+REPORT_INTERVAL = 2
+sampler = ADCSampler(sensor_temp, burst=32, filter="median")
+
+def to_temperature(reading):
+    """把 RP2040 晶片內建溫度感測器的 ADC 值（0-65535）轉換為攝氏溫度"""
     
     # 步驟 1: 將 16 位元讀數轉換回實際電壓值
     voltage = reading * conversion_factor
@@ -29,10 +33,18 @@ def read_temperature():
 # --- 主迴圈 ---
 print("開始讀取 Pico W 晶片溫度...")
 
+readings = int(REPORT_INTERVAL / SAMPLE_INTERVAL)
+
 while True:
-    temp_c = read_temperature()
-    
+    for _ in range(readings):
+        sampler.read()
+        time.sleep(SAMPLE_INTERVAL)
+
+    info = sampler.summary()
+    # 溫度每度約 -1.721 mV，標準差換算為溫度
+    stddev_c = info["stddev"] * conversion_factor / 0.001721
+
     # 格式化輸出，保留兩位小數
-    print(f"晶片溫度: {temp_c:.2f} °C")
-    
-    time.sleep(2) # 每 2 秒讀取一次
\ No newline at end of file
+    print(f"晶片溫度: {to_temperature(info['mean']):.2f} °C "
+          f"（最低 {to_temperature(info['max']):.2f}，最高 {to_temperature(info['min']):.2f}，"
+          f"標準差 {stddev_c:.2f}，{info['count']} 次 × 32 個樣本）")
\ No newline at end of file
@@ -1,6 +1,7 @@
 '''
 MQTT 訂閱程式 - 收到訊息時 LED 亮 0.1 秒
 適用於 Raspberry Pi Pico W
+需要一併上傳 lesson7/pico_tasks.py（socket 有資料時才處理訊息，不再每 0.1 秒輪詢）
 '''
 
 from machine import Pin, Timer
@@ -9,6 +10,7 @@ import time
 import machine
 import network
 from umqtt.simple import MQTTClient
+import pico_tasks
 
 # WiFi 設定（請修改為您的 WiFi 資訊）
 WIFI_SSID = "F602-15D"  # 請修改
@@ -22,6 +24,7 @@ MQTT_PORT = 1883
 MQTT_USERNAME = "pi"
 MQTT_PASSWORD = "raspberry"
 MQTT_TOPIC = "客廳/message"  # 訂閱的主題，可以改為 "客廳/#" 訂閱所有
+MQTT_KEEPALIVE = 60  # 秒；只訂閱不發布，每 KEEPALIVE / 2 秒送出一次 PING 維持連線
 
 # LED 設定
 led = Pin("LED", Pin.OUT)  # 使用內建 LED，或改為 Pin(15, Pin.OUT) 使用外部 LED
@@ -126,7 +129,7 @@ def main():
         mqtt_client = MQTTClient(client_id, MQTT_SERVER, 
                                  user=MQTT_USERNAME, 
                                  password=MQTT_PASSWORD,
-                                 keepalive=60)  # 設定 keepalive
+                                 keepalive=MQTT_KEEPALIVE)  # 設定 keepalive
         mqtt_client.set_callback(mqtt_callback)  # 設定訊息接收回調
         
         # 嘗試連接，最多重試 3 次
@@ -170,13 +173,12 @@ def main():
         print(f"❌ 訂閱失敗: {e}")
         return
     
-    # 4. 持續監聽訊息
+    # 4. 持續監聽訊息：socket 有資料時才處理，閒置時定期 PING 維持連線
     try:
-        while True:
-            # 檢查是否有新訊息（非阻塞）
-            mqtt_client.check_msg()
-            # 短暫延遲，避免 CPU 使用率過高
-            time.sleep(0.1)
+        pico_tasks.run(
+            pico_tasks.message_pump(mqtt_client),
+            pico_tasks.keepalive(mqtt_client, MQTT_KEEPALIVE * 1000 // 2)
+        )
     except KeyboardInterrupt:
         print("\n\n⚠️  程式被中斷")
     finally:
@@ -0,0 +1,25 @@
+"""
+儀表板的即時數據版本
+
+MQTT 執行緒每處理一則訊息就把版本加 1；頁面上的即時區塊（st.fragment）
+只比較版本號碼，版本沒有變化時沿用上次建立的圖表與列表，不重新計算。
+"""
+
+import threading
+
+
+class DataVersion:
+    """執行緒安全的版本計數器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def bump(self):
+        """數據有變化（由 MQTT 執行緒呼叫）"""
+        with self._lock:
+            self._value += 1
+
+    @property
+    def value(self):
+        return self._value
@@ -0,0 +1,317 @@
+"""
+Streamlit 儀表板共用的 MQTT 接收服務
+
+整個 Streamlit 程序只建立一個 IngestService（app.py 以 st.cache_resource 快取），
+由它持有唯一的 MQTT 連線與一份歷史數據，各瀏覽器 session 只透過 snapshot() 讀取。
+paho 的回調在網路執行緒中執行，只修改服務本身的狀態（以鎖保護），不會碰到 st.session_state。
+"""
+
+from collections import deque, namedtuple
+from datetime import datetime
+import os
+import sys
+import threading
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+
+# 共用 lesson6 的主題路由與訊息解析
+LESSON6_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lesson6')
+if LESSON6_DIR not in sys.path:
+    sys.path.append(LESSON6_DIR)
+
+from topic_router import TopicRouter
+from sensor_codec import PayloadSchema, loads as json_loads
+from live_data import DataVersion
+from sensor_series import SensorSeries
+
+# 預設訂閱的主題
+DEFAULT_TOPICS = {
+    'light': "客廳/light",
+    'sensor': "客廳/sensor",
+}
+
+# 感測器數據最多保留的筆數（NumPy 環形緩衝區，每筆 16 bytes）
+SENSOR_CAPACITY = 100000
+
+# 訊息記錄最多保留的筆數
+MAX_MESSAGES = 1000
+
+# 連線後等待 CONNACK 的秒數
+CONNECT_TIMEOUT = 3
+
+# 訊息欄位定義（別名依優先順序）
+LIGHT_SCHEMA = PayloadSchema({
+    'status': (('status', 'light_status', 'light'), 'unknown'),
+    'timestamp': (('timestamp',), None),
+})
+SENSOR_SCHEMA = PayloadSchema({
+    'temperature': (('temperature', 'temp'), None),
+    'humidity': (('humidity', 'humi'), None),
+})
+
+# 某個數據版本的唯讀快照；所有 session 共用同一個物件，不可修改
+Snapshot = namedtuple('Snapshot', [
+    'version', 'connected', 'broker', 'topics', 'viewers',
+    'light_status', 'light_timestamp', 'current_temperature', 'current_humidity',
+    'sensor_count', 'messages_history',
+])
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class IngestService:
+    """
+    共用的 MQTT 接收服務（執行緒安全）
+
+    - connect() 建立唯一的連線；已連線到同一個 Broker 時直接沿用
+    - attach() / detach() 記錄正在觀看的 session，最後一個 session 離開時才斷線
+    - snapshot() 回傳目前狀態與訊息記錄的快照：數據版本沒有變化時回傳同一個物件，不重複複製
+    - sensor_frame() / sensor_stats() 讀取感測器時間序列（只複製需要的時間範圍）
+    """
+
+    def __init__(self, topics=None, sensor_capacity=SENSOR_CAPACITY, max_messages=MAX_MESSAGES):
+        """
+        Args:
+            topics: {'light': 電燈主題, 'sensor': 感測器主題}，可使用 + 與 # 萬用字元
+            sensor_capacity: 感測器數據最多保留的筆數
+            max_messages: 訊息記錄最多保留的筆數
+        """
+        topics = topics or DEFAULT_TOPICS
+        self.version = DataVersion()
+        self.router = TopicRouter()
+        self.router.add(topics['light'], self._handle_light)
+        self.router.add(topics['sensor'], self._handle_sensor)
+
+        self._lock = threading.RLock()
+        self._connect_lock = threading.Lock()   # 同時只有一個 session 在建立連線
+        self._connected_event = threading.Event()
+        self._client = None
+        self._broker = None
+        self._viewers = set()
+        self._snapshot = None
+
+        self.connected = False
+        self.light_status = None
+        self.light_timestamp = None
+        self.current_temperature = None
+        self.current_humidity = None
+        self.sensors = SensorSeries(sensor_capacity)
+        self.messages_history = deque(maxlen=max_messages)
+
+    # ----- 連線管理（由 Streamlit 的 script 執行緒呼叫）-----
+
+    def connect(self, broker, port, username=None, password=None):
+        """
+        連接 MQTT Broker；已連線到同一個 Broker 時直接回傳 True
+
+        Returns:
+            bool: 是否已連線
+        """
+        with self._connect_lock:
+            return self._connect(broker, port, username, password)
+
+    def _connect(self, broker, port, username, password):
+        target = (broker, int(port), username)
+        with self._lock:
+            if self._client is not None and self._broker == target and self.connected:
+                return True
+            previous = self._take_client()
+            self._connected_event.clear()
+        self._stop(previous)
+
+        client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+                             client_id=f"streamlit_{uuid.uuid4().hex[:8]}")
+        if username and password:
+            client.username_pw_set(username, password)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_message = self._on_message
+        try:
+            client.connect(broker, int(port), 60)
+        except ConnectionRefusedError:
+            self._log('error', f'❌ 連接被拒絕: 請確認 Broker 地址 ({broker}:{port}) 是否正確，以及 MQTT 服務是否運行')
+            return False
+        except Exception as e:
+            self._log('error', f'❌ 連接失敗: {str(e)}')
+            return False
+        with self._lock:
+            self._client = client
+            self._broker = target
+        client.loop_start()
+
+        # 在鎖外等待，回調才能更新狀態
+        if not self._connected_event.wait(CONNECT_TIMEOUT):
+            self._log('error', '❌ 連接超時，請檢查 Broker 地址和端口')
+        if self.connected:
+            return True
+        self.disconnect()
+        return False
+
+    def disconnect(self):
+        """斷開 MQTT 連線（所有 session 都會停止收到新數據）"""
+        with self._lock:
+            client = self._take_client()
+        if client is None:
+            return False
+        try:
+            self._stop(client)
+        except Exception as e:
+            self._log('error', f'❌ 斷開連接時發生錯誤: {str(e)}')
+            return False
+        self.version.bump()
+        return True
+
+    def _take_client(self):
+        """取出目前的客戶端並清除連線狀態（呼叫時需持有鎖）"""
+        client, self._client = self._client, None
+        self._broker = None
+        self.connected = False
+        return client
+
+    @staticmethod
+    def _stop(client):
+        """停止客戶端；loop_stop() 會等待網路執行緒結束，不可在持有鎖時呼叫（回調需要鎖）"""
+        if client is not None:
+            client.loop_stop()
+            client.disconnect()
+
+    def attach(self, session_id):
+        """session 開始觀看"""
+        with self._lock:
+            self._viewers.add(session_id)
+        self.version.bump()
+
+    def detach(self, session_id):
+        """session 停止觀看；沒有任何 session 時斷開連線"""
+        with self._lock:
+            self._viewers.discard(session_id)
+            idle = not self._viewers
+        if idle:
+            self.disconnect()
+        self.version.bump()
+
+    def snapshot(self):
+        """目前數據的快照（數據版本沒有變化時回傳同一個物件）"""
+        snapshot = self._snapshot
+        version = self.version.value
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            # 在鎖內重新讀取版本：回調都在持有鎖時修改數據，版本號碼與內容一致
+            version = self.version.value
+            snapshot = Snapshot(
+                version=version,
+                connected=self.connected,
+                broker=self._broker,
+                topics=tuple(self.router.patterns()),
+                viewers=len(self._viewers),
+                light_status=self.light_status,
+                light_timestamp=self.light_timestamp,
+                current_temperature=self.current_temperature,
+                current_humidity=self.current_humidity,
+                sensor_count=len(self.sensors),
+                messages_history=tuple(self.messages_history),
+            )
+            self._snapshot = snapshot
+        return snapshot
+
+    def sensor_frame(self, start_ms=None):
+        """感測器數據的 DataFrame（datetime / temperature / humidity），只包含時間 >= start_ms 的數據"""
+        with self._lock:
+            return self.sensors.frame(start_ms)
+
+    def sensor_stats(self):
+        """全部感測器數據的平均與最大值，見 SensorSeries.stats()"""
+        with self._lock:
+            return self.sensors.stats()
+
+    # ----- MQTT 回調（在 paho 的網路執行緒中執行）-----
+
+    def _log(self, type, message):
+        with self._lock:
+            self.messages_history.append({
+                'timestamp': _now(),
+                'type': type,
+                'message': message
+            })
+            self.version.bump()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        """MQTT 連接回調"""
+        if reason_code.is_failure:
+            with self._lock:
+                self.connected = False
+            self._log('error', f'❌ 連接失敗: {reason_code}')
+            self._connected_event.set()
+            return
+        topics = self.router.patterns()
+        try:
+            result = client.subscribe([(topic, 1) for topic in topics])
+            print(f"[MQTT] 訂閱結果: {result}")
+            with self._lock:
+                self.connected = True
+            self._log('system', f'✅ MQTT 連接成功並已訂閱主題: {", ".join(topics)} (rc={result[0]})')
+        except Exception as e:
+            self._log('error', f'❌ 訂閱主題時發生錯誤: {str(e)}')
+        self._connected_event.set()
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        """MQTT 斷開連接回調"""
+        with self._lock:
+            self.connected = False
+        self._log('system', '⚠️ MQTT 連接已斷開')
+
+    def _handle_light(self, topic, wildcards, data, timestamp, history_entry):
+        """處理電燈狀態訊息（呼叫時已持有鎖）"""
+        data = LIGHT_SCHEMA.parse(data)
+        status = data['status']
+        self.light_status = status
+        self.light_timestamp = data['timestamp'] or timestamp
+        history_entry['light_status'] = status
+
+    def _handle_sensor(self, topic, wildcards, data, timestamp, history_entry):
+        """處理感測器數據訊息（呼叫時已持有鎖）"""
+        data = SENSOR_SCHEMA.parse(data)
+        temperature = data['temperature']
+        humidity = data['humidity']
+
+        if temperature is not None:
+            self.current_temperature = temperature
+        if humidity is not None:
+            self.current_humidity = humidity
+
+        self.sensors.append(int(time.time() * 1000), temperature, humidity)
+
+        history_entry['temperature'] = temperature
+        history_entry['humidity'] = humidity
+
+    def _on_message(self, client, userdata, msg):
+        """MQTT 訊息接收回調"""
+        try:
+            payload = msg.payload.decode('utf-8')
+            data = json_loads(msg.payload)
+        except ValueError as e:
+            self._log('error', f'❌ JSON 解析錯誤: {str(e)}')
+            return
+
+        timestamp = _now()
+        history_entry = {
+            'timestamp': timestamp,
+            'topic': msg.topic,
+            'temperature': None,
+            'humidity': None,
+            'light_status': None,
+            'raw_message': payload
+        }
+        try:
+            with self._lock:
+                # 依主題路由交給對應的處理函式
+                self.router.route(msg.topic, data, timestamp, history_entry)
+                self.messages_history.append(history_entry)
+                self.version.bump()
+        except Exception as e:
+            self._log('error', f'❌ 處理訊息時發生錯誤: {str(e)}')
@@ -0,0 +1,139 @@
+"""
+儀表板的感測器時間序列緩衝區
+以 NumPy 欄位陣列組成固定容量的環形緩衝區（ring buffer）：
+    epoch_ms     -> int64    接收時間（epoch 毫秒）
+    temperature  -> float32  溫度（沒有數值時為 NaN）
+    humidity     -> float32  濕度（沒有數值時為 NaN）
+
+新增與淘汰最舊數據皆為 O(1)，不會每筆建立 dict 或 datetime；
+frame() 只複製需要的時間範圍一次就建立 DataFrame，成本與容量無關。
+本身不是執行緒安全的，由 mqtt_ingest.IngestService 在持有鎖時呼叫。
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 顯示用的本地時區（DataFrame 的 datetime 欄位為本地時間，與 datetime.now() 一致）
+LOCAL_TZ = datetime.now().astimezone().tzinfo
+
+COLUMNS = (
+    ('epoch_ms', np.int64),
+    ('temperature', np.float32),
+    ('humidity', np.float32),
+)
+
+
+class SensorSeries:
+    """固定容量的感測器時間序列（容量滿時覆蓋最舊的一筆）"""
+
+    def __init__(self, capacity=100000):
+        """
+        Args:
+            capacity: 最多保留的數據筆數
+        """
+        if capacity <= 0:
+            raise ValueError("capacity 必須大於 0")
+        self.capacity = capacity
+        self._columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS}
+        self._head = 0   # 下一筆數據寫入的位置
+        self._size = 0   # 目前保存的筆數
+
+    def __len__(self):
+        return self._size
+
+    def append(self, epoch_ms, temperature, humidity):
+        """新增一筆數據（溫度、濕度為 None 時存成 NaN）"""
+        i = self._head
+        columns = self._columns
+        columns['epoch_ms'][i] = epoch_ms
+        columns['temperature'][i] = np.nan if temperature is None else temperature
+        columns['humidity'][i] = np.nan if humidity is None else humidity
+        self._head = (i + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
+
+    def _spans(self):
+        """由舊到新的索引範圍（最多兩段 slice）"""
+        start = (self._head - self._size) % self.capacity
+        end = start + self._size
+        if end <= self.capacity:
+            return [slice(start, end)]
+        return [slice(start, self.capacity), slice(0, end - self.capacity)]
+
+    def _spans_since(self, start_ms):
+        """時間 >= start_ms 的索引範圍（數據依接收時間排列，以二分搜尋找出起點）"""
+        spans = self._spans()
+        if start_ms is None:
+            return spans
+        epoch = self._columns['epoch_ms']
+        for k, span in enumerate(spans):
+            values = epoch[span]
+            if len(values) and values[-1] >= start_ms:
+                first = span.start + int(np.searchsorted(values, start_ms, side='left'))
+                return [slice(first, span.stop)] + spans[k + 1:]
+        return []
+
+    def columns(self, start_ms=None):
+        """
+        由舊到新取得欄位陣列（只複製一次，之後的新增不會影響回傳的陣列）
+
+        Args:
+            start_ms: 只保留時間 >= start_ms 的數據
+
+        Returns:
+            dict: epoch_ms / temperature / humidity 三個 numpy 陣列
+        """
+        spans = self._spans_since(start_ms)
+        result = {}
+        for name, dtype in COLUMNS:
+            column = self._columns[name]
+            if len(spans) == 1:
+                result[name] = column[spans[0]].copy()
+            elif spans:
+                result[name] = np.concatenate([column[span] for span in spans])
+            else:
+                result[name] = np.empty(0, dtype=dtype)
+        return result
+
+    def frame(self, start_ms=None):
+        """
+        以 DataFrame 取得數據（datetime / temperature / humidity 欄位）
+
+        DataFrame 直接使用 columns() 複製出來的陣列，不再另外複製
+        """
+        columns = self.columns(start_ms)
+        times = pd.to_datetime(columns['epoch_ms'], unit='ms', utc=True).tz_convert(LOCAL_TZ).tz_localize(None)
+        return pd.DataFrame({
+            'datetime': times,
+            'temperature': columns['temperature'],
+            'humidity': columns['humidity'],
+        }, copy=False)
+
+    def stats(self):
+        """
+        全部數據的統計（直接在緩衝區上計算，不建立 DataFrame）
+
+        Returns:
+            dict: {'temperature': (平均, 最大) 或 None, 'humidity': ...}
+        """
+        spans = self._spans()
+        result = {}
+        for name in ('temperature', 'humidity'):
+            column = self._columns[name]
+            total, count, highest = 0.0, 0, None
+            for span in spans:
+                values = column[span]
+                valid = values[~np.isnan(values)]
+                if len(valid):
+                    total += float(valid.sum(dtype=np.float64))
+                    count += len(valid)
+                    peak = float(valid.max())
+                    highest = peak if highest is None else max(highest, peak)
+            result[name] = (total / count, highest) if count else None
+        return result